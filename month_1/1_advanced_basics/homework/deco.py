@@ -1,10 +1,39 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import asyncio
+import hashlib
+import inspect
+import math
+import operator
+import os
+import pickle
+import random
+import shelve
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import timeit
+import zlib
+from collections import Counter, OrderedDict, deque, namedtuple
+from concurrent.futures import Future
 from functools import update_wrapper
+from multiprocessing import resource_tracker, shared_memory
 
 
-def disable():
+MISSING = object()  # marker of value which is not in cache
+KWARGS_MARK = object()  # separates positional and keyword arguments in key of cache
+RAW_VALUE, PICKLED_VALUE = 1, 2  # kinds of values serialized by persistent memo backends
+INTERRUPTS = (asyncio.CancelledError, KeyboardInterrupt, SystemExit)  # of caller, not of memoized computation
+TRACE_BUFFER_SIZE = 10000  # spans kept by sampling trace
+
+Span = namedtuple('Span', ['stack', 'call', 'result', 'duration', 'self_time'])
+trace_state = threading.local()  # stack of traced calls running in thread
+
+
+def disable(func):
     '''
     Disable a decorator by re-assigning the decorator's name
     to this function. For example, to turn off memoization:
@@ -12,39 +41,605 @@ def disable():
     >>> memo = disable
 
     '''
-    return
+    return func
 
 
-def decorator():
+def decorator(deco):
     '''
     Decorate a decorator so that it inherits the docstrings
     and stuff from the function it's decorating.
     '''
-    return
+    def wrapped(func):
+        return update_wrapper(deco(func), func)
+
+    return update_wrapper(wrapped, deco)
+
+
+@decorator
+def countcalls(func):
+    '''
+    Decorator that counts calls made to the function decorated.
+    Counter is thread-safe, calls of coroutine function are counted
+    when coroutine is awaited (started), not when it's created: wrapper
+    stays a coroutine function, so memo and asyncio still recognize it.
+    '''
+    lock = threading.Lock()
 
+    def count():
+        with lock:
+            wrapper.calls += 1
 
-def countcalls():
-    '''Decorator that counts calls made to the function decorated.'''
-    return
+    if inspect.iscoroutinefunction(func):
+        async def wrapper(*args, **kwargs):
+            count()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                update_wrapper(wrapper, func)  # attributes of inner decorators (e.g. hits) are updated
+    else:
+        def wrapper(*args, **kwargs):
+            count()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                update_wrapper(wrapper, func)
 
+    wrapper.calls = 0
+    return wrapper
 
-def memo():
+
+class LRUCache:
+    '''
+    Cache of at most maxsize keys (unbounded if None), the least recently
+    used key is evicted first. Entries expire ttl seconds after they were
+    set (never if None). Every operation is O(1) (amortized for expiry).
+    '''
+
+    def __init__(self, maxsize=None, ttl=None, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.data = {}  # key: (value, expiration time)
+        self.expiry = deque()  # (expiration time, key) in order of setting
+        self.evictions = 0
+        self.order = OrderedDict()  # keys from the least recently used
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key):
+        '''Get value of key or MISSING if there is no key or it is expired.'''
+        entry = self.data.get(key)
+        if entry is None:
+            return MISSING
+        value, expires = entry
+        if expires is not None and expires <= self.timer():
+            self.remove(key)
+            return MISSING
+        self.touch(key)
+        return value
+
+    def set(self, key, value):
+        if key in self.data:
+            self.remove(key)
+        self.purge()
+        if self.maxsize is not None:
+            if self.maxsize <= 0:
+                return
+            while len(self.data) >= self.maxsize:
+                self.remove(self.victim())
+                self.evictions += 1
+        expires = None if self.ttl is None else self.timer() + self.ttl
+        self.data[key] = (value, expires)
+        if expires is not None:
+            self.expiry.append((expires, key))
+        self.insert(key)
+
+    def purge(self):
+        '''Remove expired entries, so keys which are not looked up don't stay forever.'''
+        now = self.timer()
+        while self.expiry and self.expiry[0][0] <= now:
+            expires, key = self.expiry.popleft()
+            entry = self.data.get(key)
+            if entry is not None and entry[1] == expires:  # key wasn't set again after that
+                self.remove(key)
+
+    def clear(self):
+        self.data.clear()
+        self.expiry.clear()
+        self.order.clear()
+
+    def remove(self, key):
+        del self.data[key]
+        del self.order[key]
+
+    def touch(self, key):
+        self.order.move_to_end(key)
+
+    def insert(self, key):
+        self.order[key] = None
+
+    def victim(self):
+        return next(iter(self.order))
+
+
+class LFUCache(LRUCache):
+    '''
+    Cache of at most maxsize keys, the least frequently used key is
+    evicted first (the least recently used of them if there are few).
+    Keys are kept in buckets by frequency, so every operation is O(1).
+    '''
+
+    def __init__(self, maxsize=None, ttl=None, timer=time.monotonic):
+        super().__init__(maxsize, ttl, timer)
+        self.frequencies = {}  # key: number of uses
+        self.buckets = {}  # number of uses: keys with it from the least recently used
+        self.min_frequency = 0
+
+    def clear(self):
+        super().clear()
+        self.frequencies.clear()
+        self.buckets.clear()
+
+    def remove(self, key):
+        del self.data[key]
+        self.unlink(key, self.frequencies.pop(key))
+
+    def unlink(self, key, frequency):
+        bucket = self.buckets[frequency]
+        del bucket[key]
+        if not bucket:
+            del self.buckets[frequency]
+            if self.min_frequency == frequency:
+                self.min_frequency += 1
+
+    def touch(self, key):
+        frequency = self.frequencies[key]
+        self.unlink(key, frequency)
+        self.frequencies[key] = frequency + 1
+        self.buckets.setdefault(frequency + 1, OrderedDict())[key] = None
+
+    def insert(self, key):
+        self.frequencies[key] = 1
+        self.buckets.setdefault(1, OrderedDict())[key] = None
+        self.min_frequency = 1
+
+    def victim(self):
+        while self.min_frequency not in self.buckets:  # removed keys could leave it behind
+            self.min_frequency += 1
+        return next(iter(self.buckets[self.min_frequency]))
+
+
+CACHE_POLICIES = {
+    'lru': LRUCache,
+    'lfu': LFUCache,
+}
+
+
+def make_key(args, kwargs):
+    '''Hashable key of call arguments.'''
+    if kwargs:
+        return args + (KWARGS_MARK,) + tuple(sorted(kwargs.items()))
+    return args
+
+
+def stable_key(func, args, kwargs, namespace=None):
+    '''
+    Key of call which is the same in every process and after restart:
+    digest of pickled namespace (qualified name of function by default)
+    and arguments.
+    Raises TypeError (or pickle.PicklingError) for arguments which can't be pickled.
+    '''
+    name = namespace if namespace is not None else (func.__module__, func.__qualname__)
+    data = pickle.dumps((name, args, sorted(kwargs.items())), protocol=4)
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def dump_value(value):
+    '''Serialize value: bytes are stored raw, other values are pickled.'''
+    if type(value) is bytes:
+        return RAW_VALUE, value
+    return PICKLED_VALUE, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_value(kind, data):
+    return bytes(data) if kind == RAW_VALUE else pickle.loads(data)
+
+
+class ShelveBackend:
+    '''
+    Memo backend in shelve file: results survive restarts.
+    dbm files don't support concurrent writers, so file should be used
+    by one process at a time (SQLiteBackend is for many processes).
+    Entries expire ttl seconds after they were set (never if None).
+    '''
+    persistent = True
+    evictions = 0
+
+    def __init__(self, path, ttl=None):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.shelf = shelve.open(path)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.shelf)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.shelf.get(key.hex())
+            if entry is None:
+                return MISSING
+            value, expires = entry
+            if expires is not None and expires <= time.time():
+                del self.shelf[key.hex()]
+                return MISSING
+            return value
+
+    def set(self, key, value):
+        expires = None if self.ttl is None else time.time() + self.ttl
+        with self.lock:
+            self.shelf[key.hex()] = (value, expires)
+            self.shelf.sync()
+
+    def clear(self):
+        with self.lock:
+            self.shelf.clear()
+
+    def close(self):
+        self.shelf.close()
+
+
+class SQLiteBackend:
+    '''
+    Memo backend in SQLite file shared by processes (in WAL mode): value
+    computed by one worker is reused by the others and survives restarts.
+    Values are stored as raw bytes or pickled. At most maxsize values are
+    kept (the first set is evicted first), entries expire after ttl seconds.
+    '''
+    persistent = True
+
+    def __init__(self, path, maxsize=None, ttl=None, timeout=30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=timeout, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS memo "
+                                "(key BLOB PRIMARY KEY, kind INTEGER, value BLOB, expires REAL)")
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM memo").fetchone()[0]
+
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute("SELECT kind, value, expires FROM memo WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return MISSING
+            kind, data, expires = row
+            if expires is not None and expires <= time.time():
+                self.connection.execute("DELETE FROM memo WHERE key = ? AND expires = ?", (key, expires))
+                return MISSING
+        return load_value(kind, data)
+
+    def set(self, key, value):
+        kind, data = dump_value(value)
+        expires = None if self.ttl is None else time.time() + self.ttl
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO memo VALUES (?, ?, ?, ?)", (key, kind, data, expires))
+            if self.maxsize is not None:
+                evicted = self.connection.execute(
+                        "DELETE FROM memo WHERE rowid IN (SELECT rowid FROM memo ORDER BY rowid "
+                        "LIMIT max((SELECT COUNT(*) FROM memo) - ?, 0))", (self.maxsize,)
+                ).rowcount
+                self.evictions += max(evicted, 0)
+
+    def clear(self):
+        with self.lock:
+            self.connection.execute("DELETE FROM memo")
+
+    def close(self):
+        self.connection.close()
+
+
+class SharedMemoryBackend:
+    '''
+    Memo backend in table of fixed slots in multiprocessing.shared_memory:
+    processes which attach to the same name share results without disk.
+    Slot is chosen by key (a new key overwrites the old one in its slot),
+    values bigger than slot_size bytes aren't cached. Slot is checked by
+    CRC32 instead of locking: torn write of concurrent process is a miss.
+    Table is removed by unlink(), processes which attached to it don't
+    remove it when they exit.
+    '''
+    persistent = True
+    SLOT_HEADER = struct.Struct('<16sIIBd')  # key, length, CRC32 of key and value, kind of value, expiration time
+    KIND_OFFSET = struct.calcsize('<16sII')  # kind 0 is an empty slot
+
+    def __init__(self, name=None, slots=1024, slot_size=4096, ttl=None):
+        self.slots = slots
+        self.slot_size = slot_size
+        self.ttl = ttl
+        self.evictions = 0
+        self.lock = threading.Lock()
+        size = slots * (self.SLOT_HEADER.size + slot_size)
+        try:
+            self.memory = shared_memory.SharedMemory(name, create=True, size=size)
+            self.created = True
+        except FileExistsError:
+            self.memory = attach_shared_memory(name)
+            self.created = False
+        self.name = self.memory.name
+
+    def __len__(self):
+        return sum(self.memory.buf[self.offset(slot) + self.KIND_OFFSET] != 0 for slot in range(self.slots))
+
+    def offset(self, slot):
+        return slot * (self.SLOT_HEADER.size + self.slot_size)
+
+    def slot_of(self, key):
+        return self.offset(int.from_bytes(key[:8], 'little') % self.slots)
+
+    def get(self, key):
+        offset = self.slot_of(key)
+        slot_key, length, crc, kind, expires = self.SLOT_HEADER.unpack_from(self.memory.buf, offset)
+        if slot_key != key or not kind or length > self.slot_size:
+            return MISSING
+        start = offset + self.SLOT_HEADER.size
+        data = bytes(self.memory.buf[start:start + length])
+        if zlib.crc32(data, zlib.crc32(key)) != crc or (expires and expires <= time.time()):
+            return MISSING
+        return load_value(kind, data)
+
+    def set(self, key, value):
+        kind, data = dump_value(value)
+        if len(data) > self.slot_size:
+            return
+        offset = self.slot_of(key)
+        start = offset + self.SLOT_HEADER.size
+        expires = time.time() + self.ttl if self.ttl is not None else 0.0
+        with self.lock:
+            slot_key, _, _, slot_kind, _ = self.SLOT_HEADER.unpack_from(self.memory.buf, offset)
+            if slot_kind and slot_key != key:
+                self.evictions += 1
+            self.memory.buf[offset + self.KIND_OFFSET] = 0  # slot is invalid while it's written
+            self.memory.buf[start:start + len(data)] = data
+            self.SLOT_HEADER.pack_into(self.memory.buf, offset, key, len(data), zlib.crc32(data, zlib.crc32(key)),
+                                       kind, expires)
+
+    def clear(self):
+        with self.lock:
+            for slot in range(self.slots):
+                self.memory.buf[self.offset(slot) + self.KIND_OFFSET] = 0
+
+    def close(self):
+        self.memory.close()
+
+    def unlink(self):
+        if sys.version_info < (3, 13) and os.name == 'posix':
+            # attach in this process (or its fork) could unregister it, unlink unregisters it again
+            resource_tracker.register(self.memory._name, 'shared_memory')
+        self.memory.unlink()
+
+
+def attach_shared_memory(name):
+    '''
+    Attach to existing shared memory without tracking it: before Python 3.13
+    resource tracker of every process which attached unlinks memory when
+    that process exits, so the others lose it.
+    '''
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name, track=False)
+    memory = shared_memory.SharedMemory(name)
+    if os.name == 'posix':  # memory is tracked only there
+        resource_tracker.unregister(memory._name, 'shared_memory')
+    return memory
+
+
+def memo(func=None, maxsize=None, ttl=None, policy='lru', backend=None, namespace=None):
     '''
     Memoize a function so that it caches all return values for
     faster future lookups.
+
+    Cache is bounded by maxsize values (unbounded if None) evicted by policy
+    ('lru' or 'lfu'), values expire after ttl seconds (never if None):
+
+    >>> @memo(maxsize=1000, ttl=60, policy='lfu')
+    ... def f(x): ...
+
+    Statistics are attributes of decorated function: hits, misses,
+    evictions and currsize. Calls with unhashable arguments aren't cached.
+
+    Cache is thread-safe and concurrent misses of the same arguments are
+    computed once: the first caller computes value, the others wait for it
+    (and are counted as hits when they get it). If the first caller is
+    interrupted (cancelled, KeyboardInterrupt), the others don't inherit it:
+    one of them computes value again. Coroutine functions are memoized by
+    coroutine function which caches awaited results, coroutines (of any
+    thread and loop) awaiting the same arguments share one in-flight
+    computation.
+
+    Results could be shared by processes and survive restarts with
+    persistent backend (its own maxsize and ttl are used then):
+
+    >>> @memo(backend=SQLiteBackend('memo.sqlite', ttl=3600))
+    ... def f(x): ...
+
+    Arguments of persistent backend are pickled to stable keys, calls with
+    arguments which can't be pickled aren't cached. Keys are made of module
+    and qualified name of function, lambdas and local functions don't have
+    unique ones, so they need namespace shared only by calls of the same
+    function:
+
+    >>> square = memo(lambda x: x * x, backend=backend, namespace='square')
     '''
-    return
+    if func is None:
+        return lambda func: memo(func, maxsize, ttl, policy, backend, namespace)
+    if policy not in CACHE_POLICIES:
+        raise ValueError(f"Unknown cache policy: {policy}")
 
+    cache = backend if backend is not None else CACHE_POLICIES[policy](maxsize, ttl)
+    persistent = getattr(cache, 'persistent', False)
+    if persistent and namespace is None and ('<lambda>' in func.__qualname__ or '<locals>' in func.__qualname__):
+        raise ValueError(f"namespace is required to memoize {func.__qualname__} in persistent backend: "
+                         f"other functions of the same name would share its results")
+    lock = threading.Lock()
+    in_flight = {}  # key: Future of value which is being computed
 
-def n_ary():
+    def lookup(key):
+        '''Get cached value or future of value being computed and flag that caller should compute it.'''
+        with lock:
+            result = cache.get(key)
+            if result is not MISSING:
+                wrapper.hits += 1
+                return result, None, False
+            future = in_flight.get(key)
+            if future is None:
+                wrapper.misses += 1
+                future = in_flight[key] = Future()
+                return MISSING, future, True
+            return MISSING, future, False
+
+    def joined(result):
+        '''Count waiter of in-flight computation: hit if it got value, miss if computation failed.'''
+        with lock:
+            if result is MISSING:
+                wrapper.misses += 1
+            else:
+                wrapper.hits += 1
+        return result
+
+    def store(key, future, result=MISSING, exception=None):
+        '''Cache result and pass it (or exception) to waiters, MISSING makes them look key up again.'''
+        with lock:
+            if result is not MISSING:
+                cache.set(key, result)
+                if not persistent:  # size of persistent backend is len(backend), it could be slow
+                    wrapper.currsize = len(cache)
+                wrapper.evictions = cache.evictions
+            del in_flight[key]
+        if exception is None:
+            future.set_result(result)
+        else:
+            future.set_exception(exception)
+
+    def hashable_key(args, kwargs):
+        try:
+            key = stable_key(func, args, kwargs, namespace) if persistent else make_key(args, kwargs)
+            hash(key)
+        except (TypeError, AttributeError, pickle.PicklingError):  # unhashable (or not picklable) arguments
+            with lock:
+                wrapper.misses += 1
+            return MISSING
+        return key
+
+    def updated(result):
+        update_wrapper(wrapper, func)  # attributes of inner decorators (e.g. calls) are updated
+        return result
+
+    if inspect.iscoroutinefunction(func):
+        async def wrapper(*args, **kwargs):
+            key = hashable_key(args, kwargs)
+            if key is MISSING:
+                return updated(await func(*args, **kwargs))
+            while True:
+                result, future, owner = lookup(key)
+                if result is not MISSING:
+                    return result
+                if owner:
+                    break
+                try:
+                    result = await asyncio.shield(asyncio.wrap_future(future))  # cancelled waiter doesn't cancel others
+                except BaseException:
+                    joined(MISSING)
+                    raise
+                if result is not MISSING:  # else the first caller was interrupted
+                    return joined(result)
+            try:
+                result = updated(await func(*args, **kwargs))
+            except INTERRUPTS:
+                store(key, future)
+                raise
+            except BaseException as exception:
+                store(key, future, exception=exception)
+                raise
+            store(key, future, result)
+            return result
+    else:
+        def wrapper(*args, **kwargs):
+            key = hashable_key(args, kwargs)
+            if key is MISSING:
+                return updated(func(*args, **kwargs))
+            while True:
+                result, future, owner = lookup(key)
+                if result is not MISSING:
+                    return result
+                if owner:
+                    break
+                try:
+                    result = future.result()
+                except BaseException:
+                    joined(MISSING)
+                    raise
+                if result is not MISSING:
+                    return joined(result)
+            try:
+                result = updated(func(*args, **kwargs))
+            except INTERRUPTS:
+                store(key, future)
+                raise
+            except BaseException as exception:
+                store(key, future, exception=exception)
+                raise
+            store(key, future, result)
+            return result
+
+    def cache_clear():
+        with lock:
+            cache.clear()
+            wrapper.currsize = 0
+
+    update_wrapper(wrapper, func)
+    wrapper.hits = wrapper.misses = wrapper.evictions = wrapper.currsize = 0
+    wrapper.maxsize = getattr(cache, 'maxsize', None)
+    wrapper.cache_clear = cache_clear
+    return wrapper
+
+
+def n_ary(f=None, associative=None):
     '''
     Given binary function f(x, y), return an n_ary function such
     that f(x, y, z) = f(x, f(y,z)), etc. Also allow f(x) = x.
+
+    Arguments are folded from the right by loop, so their number isn't
+    limited by recursion depth. If f is associative, associative is
+    a function reducing all the arguments at once used instead of folding:
+
+    >>> @n_ary(associative=sum)
+    ... def add(x, y): return x + y
     '''
-    return
+    if f is None:
+        return lambda f: n_ary(f, associative)
+
+    if associative is not None:
+        def wrapper(x, *args):
+            return x if not args else associative((x,) + args)
+    else:
+        def wrapper(x, *args):
+            if not args:
+                return x
+            result = args[-1]
+            for i in range(len(args) - 2, -1, -1):
+                result = f(args[i], result)
+            return f(x, result)
 
+    return update_wrapper(wrapper, f)
 
-def trace():
+
+def trace(indent='', sample_rate=None, min_duration=None,
+          buffer_size=TRACE_BUFFER_SIZE, output=print):
     '''Trace calls made to function decorated.
 
     @trace("____")
@@ -63,20 +658,100 @@ def trace():
     ____ <-- fib(1) == 1
      <-- fib(3) == 3
 
+    If sample_rate or min_duration is given calls are only timed, and
+    the spans of calls sampled with sample_rate probability or running
+    at least min_duration seconds are kept in wrapper.spans ring buffer
+    of buffer_size and emitted with output (None to keep silent):
+
+    @trace("____", sample_rate=0.001, min_duration=0.1)
+    def fib(n):
+        ....
+
+    >>> fib(30)
+    >>> fib.export('fib.folded')
+
+    wrapper.export(path) writes self time of spans recorded in collapsed
+    stack format readable by flamegraph.pl and speedscope.
+
     '''
-    return
+    sampling = sample_rate is not None or min_duration is not None
+
+    @decorator
+    def trace_decorator(func):
+        def wrapper(*args):
+            prefix = indent * wrapper.depth
+            signature = f"{func.__name__}({', '.join(map(repr, args))})"
+            print(f"{prefix} --> {signature}")
+            wrapper.depth += 1
+            try:
+                result = func(*args)
+            finally:
+                wrapper.depth -= 1
+            print(f"{prefix} <-- {signature} == {result}")
+            return result
+
+        def sampling_wrapper(*args):
+            stack = getattr(trace_state, 'stack', None)
+            if stack is None:
+                stack = trace_state.stack = []
+            frame = [func.__name__, 0.0]  # name and time spent in traced calls made
+            stack.append(frame)
+            started = time.perf_counter()
+            try:
+                result = func(*args)
+            finally:
+                duration = time.perf_counter() - started
+                stack.pop()
+                if stack:
+                    stack[-1][1] += duration
+            if ((sample_rate and random.random() < sample_rate)
+                    or (min_duration is not None and duration >= min_duration)):
+                record(stack, frame, args, result, duration)
+            return result
+
+        def record(stack, frame, args, result, duration):
+            names = [caller[0] for caller in stack]
+            names.append(frame[0])
+            signature = f"{func.__name__}({', '.join(map(repr, args))})"
+            span = Span(';'.join(names), signature, result, duration, duration - frame[1])
+            sampling_wrapper.spans.append(span)
+            if output is not None:
+                output(f"{indent * len(stack)} <-- {signature} == {result} "
+                       f"[{duration * 1000:.3f} ms]")
+
+        if not sampling:
+            wrapper.depth = 0
+            return wrapper
+
+        sampling_wrapper.spans = deque(maxlen=buffer_size)
+        sampling_wrapper.export = lambda path: export_collapsed(sampling_wrapper.spans, path)
+        return sampling_wrapper
+
+    return trace_decorator
+
+
+def export_collapsed(spans, path):
+    '''Write self time of spans in microseconds summed by stack
+    as collapsed stack lines "fib;fib;fib 42" to path.
+    '''
+    weights = Counter()
+    for span in spans:
+        weights[span.stack] += span.self_time
+    with open(path, 'w') as folded:
+        for stack, seconds in sorted(weights.items()):
+            folded.write(f"{stack} {max(round(seconds * 1e6), 1)}\n")
 
 
 @memo
 @countcalls
-@n_ary
+@n_ary(associative=sum)
 def foo(a, b):
     return a + b
 
 
 @countcalls
 @memo
-@n_ary
+@n_ary(associative=math.prod)
 def bar(a, b):
     return a * b
 
@@ -105,5 +780,24 @@ def main():
     print(fib.calls, 'calls made')
 
 
+def benchmark(sizes=(2, 10, 100, 1000, 10000), number=1000):
+    '''Compare time of n_ary calls folded by loop and reduced by sum/math.prod.'''
+    add = n_ary(operator.add)
+    mul = n_ary(operator.mul)
+    fast_add = n_ary(operator.add, associative=sum)
+    fast_mul = n_ary(operator.mul, associative=math.prod)
+    print(f"{'args':>6} {'op':>4} {'fold, us':>10} {'fast, us':>10} {'speedup':>8}")
+    for size in sizes:
+        args = [random.random() for _ in range(size)]
+        for name, folded, fast in (('add', add, fast_add), ('mul', mul, fast_mul)):
+            fold_time = timeit.timeit(lambda: folded(*args), number=number) / number
+            fast_time = timeit.timeit(lambda: fast(*args), number=number) / number
+            print(f"{size:>6} {name:>4} {fold_time * 1e6:>10.2f} {fast_time * 1e6:>10.2f} "
+                  f"{fold_time / fast_time:>7.1f}x")
+
+
 if __name__ == '__main__':
-    main()
+    if sys.argv[1:] == ['benchmark']:
+        benchmark()
+    else:
+        main()
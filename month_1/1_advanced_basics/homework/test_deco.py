@@ -0,0 +1,536 @@
+import asyncio
+import contextlib
+import io
+import math
+import operator
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import uuid
+
+from deco import benchmark, countcalls, memo, n_ary, trace, export_collapsed, LRUCache, LFUCache, ShelveBackend, \
+    SQLiteBackend, SharedMemoryBackend, MISSING, Span, stable_key
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestCountCalls(unittest.TestCase):
+    def test_calls_are_counted(self):
+        @countcalls
+        def add(a, b):
+            '''Add.'''
+            return a + b
+
+        self.assertEqual((add(1, 2), add(3, 4)), (3, 7))
+        self.assertEqual(add.calls, 2)
+        self.assertEqual((add.__name__, add.__doc__), ('add', 'Add.'))
+
+    def test_threads(self):
+        @countcalls
+        def noop():
+            pass
+
+        threads = [threading.Thread(target=lambda: [noop() for _ in range(1000)]) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(noop.calls, 8000)
+
+    def test_coroutine_function(self):
+        @countcalls
+        async def double(x):
+            return x * 2
+
+        self.assertTrue(asyncio.iscoroutinefunction(double))
+        coroutine = double(2)
+        self.assertEqual(double.calls, 0)  # counted when awaited
+        self.assertEqual(asyncio.run(coroutine), 4)
+        self.assertEqual(double.calls, 1)
+
+    def test_memo_of_coroutine_function(self):
+        @memo
+        @countcalls
+        async def double(x):
+            return x * 2
+
+        async def main():
+            return [await double(2), await double(2)]
+
+        self.assertEqual(asyncio.run(main()), [4, 4])
+        self.assertEqual((double.calls, double.hits), (1, 1))
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_least_recently_used_is_evicted(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertIs(cache.get('b'), MISSING)
+        self.assertEqual((cache.get('a'), cache.get('c'), cache.evictions, len(cache)), (1, 3, 1, 2))
+
+    def test_ttl(self):
+        timer = FakeTimer()
+        cache = LRUCache(ttl=10, timer=timer)
+        cache.set('a', 1)
+        timer.now = 5
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        timer.now = 10
+        self.assertIs(cache.get('a'), MISSING)
+        self.assertEqual(cache.get('b'), 2)
+
+        cache.set('b', 3)  # set again, the first expiration is stale
+        timer.now = 16
+        cache.purge()
+        self.assertEqual((cache.get('b'), len(cache)), (3, 1))
+        timer.now = 30
+        cache.purge()
+        self.assertEqual(len(cache), 0)
+
+    def test_zero_maxsize(self):
+        cache = LRUCache(maxsize=0)
+        cache.set('a', 1)
+        self.assertIs(cache.get('a'), MISSING)
+
+
+class TestLFUCache(unittest.TestCase):
+    def test_least_frequently_used_is_evicted(self):
+        cache = LFUCache(maxsize=3)
+        for key in 'abc':
+            cache.set(key, key)
+        cache.get('a')
+        cache.get('a')
+        cache.get('c')
+        cache.set('d', 'd')  # b is used once
+        self.assertIs(cache.get('b'), MISSING)
+        cache.set('e', 'e')  # d and e are used once, d is older
+        self.assertEqual([cache.get(key) for key in 'acde'], ['a', 'c', MISSING, 'e'])
+        self.assertEqual(cache.evictions, 2)
+
+    def test_removed_keys(self):
+        timer = FakeTimer()
+        cache = LFUCache(maxsize=2, ttl=10, timer=timer)
+        cache.set('a', 1)
+        cache.get('a')
+        timer.now = 10
+        cache.set('b', 2)  # expired a is purged
+        cache.set('c', 3)
+        self.assertEqual((cache.get('b'), cache.get('c'), cache.evictions), (2, 3, 0))
+        cache.clear()
+        self.assertEqual((len(cache), cache.frequencies, cache.buckets), (0, {}, {}))
+
+
+class TestMemo(unittest.TestCase):
+    def test_stats(self):
+        @memo(maxsize=2)
+        def square(x):
+            return x * x
+
+        self.assertEqual([square(x) for x in (1, 2, 1, 3, 2)], [1, 4, 1, 9, 4])
+        self.assertEqual((square.hits, square.misses, square.evictions, square.currsize, square.maxsize),
+                         (1, 4, 2, 2, 2))
+        square.cache_clear()
+        self.assertEqual(square.currsize, 0)
+
+    def test_arguments(self):
+        calls = []
+
+        @memo
+        def join(*args, **kwargs):
+            calls.append((args, kwargs))
+            return len(calls)
+
+        self.assertEqual((join(1, b=2, c=3), join(1, c=3, b=2), join(1, 2)), (1, 1, 2))
+        self.assertEqual((join([1]), join([1])), (3, 4))  # unhashable arguments aren't cached
+        self.assertEqual((join.hits, join.misses), (1, 4))
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            memo(lambda x: x, policy='fifo')
+
+    def test_concurrent_misses_are_computed_once(self):
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        @memo
+        def slow(x):
+            calls.append(x)
+            started.set()
+            release.wait(5)
+            return x * 10
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(slow(1))) for _ in range(10)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual((calls, results), ([1], [10] * 10))
+        self.assertEqual((slow.hits, slow.misses), (9, 1))  # waiters got the shared value
+
+    def test_interrupted_owner(self):
+        started = threading.Event()
+        calls = []
+
+        @memo
+        def interrupted(x):
+            calls.append(x)
+            if len(calls) == 1:
+                started.wait(5)
+                time.sleep(0.1)
+                raise KeyboardInterrupt
+            return x
+
+        def owner():
+            with self.assertRaises(KeyboardInterrupt):
+                interrupted(1)
+
+        thread = threading.Thread(target=owner)
+        thread.start()
+        while not calls:
+            time.sleep(0.01)
+        started.set()
+        self.assertEqual(interrupted(1), 1)  # waiter computes value again instead of raising KeyboardInterrupt
+        thread.join()
+        self.assertEqual((calls, interrupted.hits, interrupted.misses), ([1, 1], 0, 2))
+
+    def test_cancelled_owner(self):
+        calls = []
+
+        @memo
+        async def fetch(x):
+            calls.append(x)
+            await asyncio.sleep(0.05)
+            return x
+
+        async def main():
+            owner = asyncio.ensure_future(fetch(1))
+            await asyncio.sleep(0.01)
+            waiter = asyncio.ensure_future(fetch(1))
+            await asyncio.sleep(0.01)
+            owner.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await owner
+            return await waiter
+
+        self.assertEqual(asyncio.run(main()), 1)
+        self.assertEqual(calls, [1, 1])
+
+    def test_exception_is_not_cached(self):
+        calls = []
+
+        @memo
+        def fail(x):
+            calls.append(x)
+            raise KeyError(x)
+
+        for _ in range(2):
+            with self.assertRaises(KeyError):
+                fail(1)
+        self.assertEqual(calls, [1, 1])
+
+    def test_coroutine_function(self):
+        calls = []
+
+        @memo(ttl=60)
+        async def fetch(x):
+            calls.append(x)
+            await asyncio.sleep(0.01)
+            return x + 1
+
+        async def main():
+            return await asyncio.gather(*(fetch(x) for x in (1, 1, 2, 1)))
+
+        self.assertTrue(asyncio.iscoroutinefunction(fetch))
+        self.assertEqual(asyncio.run(main()), [2, 2, 3, 2])
+        self.assertEqual(asyncio.run(main()), [2, 2, 3, 2])
+        self.assertEqual(sorted(calls), [1, 2])
+        self.assertEqual((fetch.hits, fetch.misses), (6, 2))
+
+    def test_countcalls_of_memo(self):
+        @countcalls
+        @memo
+        def fib(n):
+            return n if n < 2 else fib(n - 1) + fib(n - 2)
+
+        self.assertEqual(fib(30), 832040)
+        self.assertEqual(fib.calls, 59)
+        self.assertEqual((fib.hits, fib.misses, fib.currsize), (28, 31, 31))
+
+
+class TestBackends(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def check_backend(self, backend):
+        calls = []
+
+        @memo(backend=backend, namespace='compute')
+        def compute(x, raw=False):
+            calls.append(x)
+            return bytes([x]) if raw else {'x': x}
+
+        self.assertEqual((compute(1), compute(1), compute(2, raw=True), compute(2, raw=True)),
+                         ({'x': 1}, {'x': 1}, b'\x02', b'\x02'))
+        self.assertEqual((compute(lambda: 0) is not None, len(calls)), (True, 3))  # not picklable isn't cached
+        self.assertEqual((compute.hits, compute.misses, len(backend)), (2, 3, 2))
+        compute.cache_clear()
+        self.assertEqual(len(backend), 0)
+
+    def test_shelve(self):
+        backend = ShelveBackend(os.path.join(self.tmp_dir.name, 'memo'))
+        self.addCleanup(backend.close)
+        self.check_backend(backend)
+
+    def test_shelve_survives_restart(self):
+        path = os.path.join(self.tmp_dir.name, 'memo')
+        key = stable_key(len, ('x',), {})
+        backend = ShelveBackend(path)
+        backend.set(key, 1)
+        backend.close()
+        backend = ShelveBackend(path, ttl=60)
+        self.addCleanup(backend.close)
+        self.assertEqual(backend.get(key), 1)
+
+    def test_sqlite(self):
+        backend = SQLiteBackend(os.path.join(self.tmp_dir.name, 'memo.sqlite'))
+        self.addCleanup(backend.close)
+        self.check_backend(backend)
+
+    def test_namespace(self):
+        backend = SQLiteBackend(os.path.join(self.tmp_dir.name, 'memo.sqlite'))
+        self.addCleanup(backend.close)
+        with self.assertRaisesRegex(ValueError, 'namespace is required'):
+            memo(lambda x: x + 1, backend=backend)
+        increment = memo(lambda x: x + 1, backend=backend, namespace='increment')
+        double = memo(lambda x: x * 2, backend=backend, namespace='double')
+        self.assertEqual((increment(5), double(5), increment(5), double(5)), (6, 10, 6, 10))
+        self.assertEqual((increment.hits, double.hits), (1, 1))
+        self.assertNotEqual(stable_key(len, (1,), {}), stable_key(len, (1,), {}, 'len'))
+
+    def test_sqlite_maxsize_and_ttl(self):
+        path = os.path.join(self.tmp_dir.name, 'memo.sqlite')
+        backend = SQLiteBackend(path, maxsize=2)
+        self.addCleanup(backend.close)
+        keys = [stable_key(len, (i,), {}) for i in range(3)]
+        for i, key in enumerate(keys):
+            backend.set(key, i)
+        self.assertEqual([backend.get(key) for key in keys], [MISSING, 1, 2])
+        self.assertEqual(backend.evictions, 1)
+
+        other = SQLiteBackend(path, ttl=-1)  # another process sees the same table, its entries are expired at once
+        self.addCleanup(other.close)
+        self.assertEqual(other.get(keys[2]), 2)
+        other.set(keys[0], 0)
+        self.assertIs(backend.get(keys[0]), MISSING)
+
+    def test_shared_memory(self):
+        backend = SharedMemoryBackend(f'deco-test-{uuid.uuid4().hex[:8]}', slots=64, slot_size=64)
+        self.addCleanup(backend.unlink)
+        self.addCleanup(backend.close)
+        self.check_backend(backend)
+
+    def test_shared_memory_slots(self):
+        name = f'deco-test-{uuid.uuid4().hex[:8]}'
+        backend = SharedMemoryBackend(name, slots=1, slot_size=16)
+        self.addCleanup(backend.unlink)
+        self.addCleanup(backend.close)
+        attached = SharedMemoryBackend(name, slots=1, slot_size=16)
+        self.addCleanup(attached.close)
+        self.assertFalse(attached.created)
+
+        first, second = stable_key(len, (1,), {}), stable_key(len, (2,), {})
+        backend.set(first, b'value')
+        self.assertEqual(attached.get(first), b'value')
+        backend.set(second, b'x' * 17)  # too big for slot
+        self.assertEqual(attached.get(first), b'value')
+        backend.set(second, b'other')  # the only slot is taken by the new key
+        self.assertEqual((attached.get(first), attached.get(second), backend.evictions), (MISSING, b'other', 1))
+
+        start = backend.SLOT_HEADER.size
+        backend.memory.buf[start] ^= 0xff  # torn write
+        self.assertIs(attached.get(second), MISSING)
+
+
+    def test_shared_memory_processes(self):
+        name = f'deco-test-{uuid.uuid4().hex[:8]}'
+        backend = SharedMemoryBackend(name, slots=64, slot_size=64)
+        self.addCleanup(backend.unlink)
+        self.addCleanup(backend.close)
+        script = (
+            "from deco import memo, SharedMemoryBackend\n"
+            f"backend = SharedMemoryBackend({name!r}, slots=64, slot_size=64)\n"
+            "square = memo(lambda x: x * x, backend=backend, namespace='square')\n"
+            "print(square(7), square.hits)\n"
+            "backend.close()\n"
+        )
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for expected in ('49 0', '49 1', '49 1'):  # the second process uses value computed by the first one
+            process = subprocess.run([sys.executable, '-c', script], cwd=directory, capture_output=True, text=True,
+                                     timeout=30)
+            self.assertEqual((process.stdout.strip(), process.stderr), (expected, ''))
+
+
+class TestTrace(unittest.TestCase):
+    def test_print_every_call(self):
+        @trace("__")
+        def fib(n):
+            return 1 if n <= 1 else fib(n - 1) + fib(n - 2)
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.assertEqual(fib(2), 2)
+        self.assertEqual(output.getvalue().splitlines(), [
+            ' --> fib(2)',
+            '__ --> fib(1)',
+            '__ <-- fib(1) == 1',
+            '__ --> fib(0)',
+            '__ <-- fib(0) == 1',
+            ' <-- fib(2) == 2',
+        ])
+
+    def test_sampling(self):
+        lines = []
+
+        @trace(sample_rate=1, buffer_size=3, output=lines.append)
+        def fib(n):
+            return 1 if n <= 1 else fib(n - 1) + fib(n - 2)
+
+        self.assertEqual(fib(3), 3)
+        self.assertEqual(len(lines), 5)
+        self.assertEqual([(span.stack, span.call, span.result) for span in fib.spans],
+                         [('fib;fib', 'fib(2)', 2), ('fib;fib', 'fib(1)', 1), ('fib', 'fib(3)', 3)])
+        self.assertTrue(all(0 <= span.self_time <= span.duration for span in fib.spans))
+
+    def test_slow_calls_only(self):
+        @trace(sample_rate=0, min_duration=0.01, output=None)
+        def outer():
+            inner(0)
+            inner(0.02)
+
+        @trace(sample_rate=0, min_duration=0.01, output=None)
+        def inner(seconds):
+            time.sleep(seconds)
+
+        outer()
+        self.assertEqual([span.call for span in inner.spans], ['inner(0.02)'])
+        self.assertEqual(inner.spans[0].stack, 'outer;inner')
+        self.assertEqual(len(outer.spans), 1)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'outer.folded')
+            outer.export(path)
+            with open(path) as folded:
+                stack, microseconds = folded.read().split()
+        self.assertEqual(stack, 'outer')
+        self.assertLess(int(microseconds), outer.spans[0].duration * 1e6)  # self time only
+
+
+    def test_ring_buffer_keeps_the_last_spans(self):
+        @trace(sample_rate=1, buffer_size=2, output=None)
+        def identity(x):
+            return x
+
+        for x in range(5):
+            identity(x)
+        self.assertEqual([span.call for span in identity.spans], ['identity(3)', 'identity(4)'])
+
+    def test_sample_rate(self):
+        @trace(sample_rate=0.25, output=None)
+        def identity(x):
+            return x
+
+        random.seed(7)
+        for x in range(1000):
+            identity(x)
+        self.assertTrue(150 < len(identity.spans) < 350)
+
+    def test_export_collapsed(self):
+        spans = [
+            Span('main;parse', 'parse(1)', None, 0.003, 0.002),
+            Span('main', 'main()', None, 0.010, 0.004),
+            Span('main;parse', 'parse(2)', None, 0.001, 0.001),
+            Span('main;render', 'render()', None, 0.0000001, 0.0000001),
+        ]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'trace.folded')
+            export_collapsed(spans, path)
+            with open(path) as folded:
+                lines = folded.read().splitlines()
+        self.assertEqual(lines, ['main 4000', 'main;parse 3000', 'main;render 1'])
+
+
+class TestNAry(unittest.TestCase):
+    def test_right_fold(self):
+        sub = n_ary(operator.sub)
+        self.assertEqual((sub(10), sub(10, 3), sub(10, 3, 2), sub(10, 3, 2, 1)), (10, 7, 9, 8))
+        self.assertEqual(n_ary(lambda x, y: f'({x} {y})')('a', 'b', 'c'), '(a (b c))')
+
+    def test_many_arguments(self):
+        args = range(10 ** 5)
+        self.assertEqual(n_ary(operator.add)(*args), sum(args))
+        self.assertEqual(n_ary(operator.add, associative=sum)(*args), sum(args))
+
+    def test_evaluation_order(self):
+        calls = []
+
+        def pair(x, y):
+            calls.append((x, y))
+            return x + y
+
+        self.assertEqual(n_ary(pair)('a', 'b', 'c', 'd'), 'abcd')
+        self.assertEqual(calls, [('c', 'd'), ('b', 'cd'), ('a', 'bcd')])  # from the right
+
+    def test_no_recursion_limit(self):
+        args = [1] * (sys.getrecursionlimit() * 10)
+        self.assertEqual(n_ary(operator.mul)(*args), 1)
+
+    def test_associative_reduces_all_arguments_at_once(self):
+        calls = []
+
+        def reduce(values):
+            calls.append(values)
+            return sum(values)
+
+        add = n_ary(operator.add, associative=reduce)
+        self.assertEqual((add(1), add(1, 2, 3)), (1, 6))
+        self.assertEqual(calls, [(1, 2, 3)])
+
+    def test_benchmark(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            benchmark(sizes=(2, 10), number=3)
+        self.assertEqual(len(output.getvalue().splitlines()), 5)  # header and add, mul for every size
+
+    def test_associative(self):
+        @n_ary(associative=math.prod)
+        def mul(a, b):
+            '''Multiply.'''
+            return a * b
+
+        self.assertEqual((mul(5), mul(2, 3, 4)), (5, 24))
+        self.assertEqual((mul.__name__, mul.__doc__), ('mul', 'Multiply.'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import argparse
+import gzip
+import json
+import platform
+import random
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from collections import namedtuple
+from datetime import datetime
+from itertools import accumulate, islice
+from pathlib import Path
+from typing import Callable, Iterator, List, NamedTuple, Tuple, Union
+
+from log_analyzer import DEFAULT_CONFIG, LastLog, LineParser, UrlStatsStore, calculate_stats, collect_info, \
+    generate_report, gz_decompressor_command, np, parse_lines, parse_mapped, read_log, read_log_chunks
+
+LINE_TEMPLATE = (
+    '1.196.116.{ip} -  - [29/Jun/2017:03:50:22 +0300] "GET {url} HTTP/1.1" 200 927 "-" '
+    '"Lynx/2.8.8dev.9 libwww-FM/2.14 SSL-MM/1.4.1 GNUTLS/2.10.5" "-" "1498697422-2190034393-4708-9752759" '
+    '"dc7161be3" {request_time:.3f}\n'
+)
+ERROR_LINE_TEMPLATE = (  # line without $request, it is counted as fail
+    '1.169.137.{ip} -  - [29/Jun/2017:03:50:22 +0300] "" 400 0 "-" "-" "-" "1498697422-2118016444-4708-9752769" '
+    '"-" {request_time:.3f}\n'
+)
+SUITE_STAGES = ("read_log", "parse_line", "collect_info", "calculate_stats", "end_to_end")
+SUITE_BATCH = 50000  # lines read, parsed and collected at once by the suite
+BASELINE = Path(__file__).resolve().with_name("benchmark_baseline.json")
+
+
+def iter_lines(lines_num: int, urls_num: int = 1000, seed: int = 42, zipf: float = 0.0,
+               error_rate: float = 0.0) -> Iterator[bytes]:
+    """
+    Generate synthetic ui_short log lines.
+    :param lines_num: number of lines
+    :param urls_num: number of distinct URLs
+    :param seed: seed of random generator, the same seed and parameters give the same lines
+    :param zipf: skew of URL popularity: URL of rank k is met 1 / k ** zipf times as often as the first one
+                 (URLs are uniform if 0)
+    :param error_rate: part of lines which could not be parsed
+    :return: iterator of lines in bytes
+    """
+    generator = random.Random(seed)
+    url_ids = range(urls_num)
+    cum_weights = list(accumulate(1 / rank ** zipf for rank in range(1, urls_num + 1))) if zipf else None
+
+    for _ in range(lines_num):
+        if error_rate and generator.random() < error_rate:
+            yield ERROR_LINE_TEMPLATE.format(ip=generator.randrange(256), request_time=generator.random()).encode()
+            continue
+        yield LINE_TEMPLATE.format(
+                ip=generator.randrange(256),
+                url=f"/api/v2/banner/"
+                    f"{generator.choices(url_ids, cum_weights)[0] if zipf else generator.randrange(urls_num)}",
+                request_time=generator.lognormvariate(-1, 1),
+        ).encode()
+
+
+def generate_lines(lines_num: int, urls_num: int = 1000, seed: int = 42, zipf: float = 0.0,
+                   error_rate: float = 0.0) -> List[bytes]:
+    """List of synthetic ui_short log lines, see iter_lines."""
+    return list(iter_lines(lines_num, urls_num, seed, zipf, error_rate))
+
+
+def write_log(log_file: Path, lines_num: int, gz: bool = False, **params) -> None:
+    """
+    Write synthetic ui_short log by batches of lines, so logs of 1e7 lines don't need memory.
+    :param log_file: path to logfile
+    :param lines_num: number of lines
+    :param gz: compress log with gzip
+    :param params: parameters of iter_lines
+    """
+    lines = iter_lines(lines_num, **params)
+    with gzip.open(log_file, 'wb', compresslevel=6) if gz else open(log_file, 'wb') as lf_handler:
+        while True:
+            batch = list(islice(lines, SUITE_BATCH))
+            if not batch:
+                break
+            lf_handler.writelines(batch)
+
+
+def legacy_parse_line(line: Union[str, bytes]) -> NamedTuple:
+    """parse_line before LineParser: regexes and namedtuple are created on every call."""
+    url_pattern = re.compile(r'\"\w+\s(\S+)\s+HTTP')
+    request_time_pattern = re.compile(r'\d+\.\d+$')
+    URLandReq_time = namedtuple("URLandReq_time", ["url", "request_time", "fail"])
+
+    if isinstance(line, bytes):
+        line = line.decode("UTF-8")
+
+    url = url_pattern.search(line)
+    request_time = request_time_pattern.search(line)
+
+    if not url or not request_time:
+        return URLandReq_time(url=None, request_time=None, fail=True)
+
+    return URLandReq_time(url=url.group(1), request_time=round(float(request_time.group()), 3), fail=False)
+
+
+def lines_per_second(parse: Callable, lines: List[bytes]) -> float:
+    started = time.perf_counter()
+    for line in lines:
+        parse(line)
+    return len(lines) / (time.perf_counter() - started)
+
+
+def bench_parse_line(lines_num: int) -> None:
+    lines = generate_lines(lines_num)
+    before = lines_per_second(legacy_parse_line, lines)
+    after = lines_per_second(LineParser().parse, lines)
+    print(f"parse_line: before {before:,.0f} lines/sec, after {after:,.0f} lines/sec ({after / before:.1f}x)")
+
+
+def bench_gz_reading(lines_num: int) -> None:
+    lines = generate_lines(lines_num)
+    size = sum(map(len, lines)) / 2 ** 20
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        log_file = Path(tmp_dir) / "nginx-access-ui.log-20170630.gz"
+        log_file.write_bytes(gzip.compress(b"".join(lines)))
+
+        started = time.perf_counter()
+        with gzip.open(log_file) as lf_handler:
+            for _ in lf_handler:
+                pass
+        print(f"gz reading: gzip.open lines {size / (time.perf_counter() - started):,.1f} MB/sec")
+
+        for decompressor in ("python", "pigz", "gzip"):
+            if decompressor != "python" and not gz_decompressor_command(decompressor):
+                print(f"gz reading: {decompressor} is not found")
+                continue
+            started = time.perf_counter()
+            for _ in read_log_chunks(log_file, decompressor=decompressor):
+                pass
+            print(f"gz reading: chunks by {decompressor} {size / (time.perf_counter() - started):,.1f} MB/sec")
+
+
+def measure(func: Callable) -> Tuple[float, float]:
+    """
+    Run func twice: for time and with tracemalloc for memory (tracing slows func down).
+    :param func: function without arguments
+    :return: seconds and peak of allocated memory in MB
+    """
+    started = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - started
+
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def bench_plain_reading(lines_num: int) -> None:
+    lines = generate_lines(lines_num)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        log_file = Path(tmp_dir) / "nginx-access-ui.log-20170630"
+        log_file.write_bytes(b"".join(lines))
+        del lines
+
+        for name, func in (
+                ("read_log lines", lambda: parse_lines(read_log(log_file))),
+                ("mmap", lambda: list(parse_mapped(log_file, UrlStatsStore()))),
+        ):
+            seconds, peak = measure(func)
+            print(f"plain parsing: {name} {lines_num / seconds:,.0f} lines/sec, peak memory {peak:,.1f} MB")
+
+
+def bench_suite(lines_num: int, urls_num: int, zipf: float, error_rate: float, gz: bool) -> dict:
+    """
+    Time stages of report generation separately on synthetic log: read_log, parse_line (LineParser),
+    collect_info, calculate_stats and the whole generate_report.
+    :return: dict of stage and lines/sec
+    """
+    seconds = dict.fromkeys(SUITE_STAGES, 0.0)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        log_file = Path(tmp_dir) / ("nginx-access-ui.log-20170630" + (".gz" if gz else ""))
+        write_log(log_file, lines_num, gz, urls_num=urls_num, zipf=zipf, error_rate=error_rate)
+
+        parse = LineParser().parse
+        store = UrlStatsStore()
+        lines = read_log(log_file)
+        while True:
+            started = time.perf_counter()
+            batch = list(islice(lines, SUITE_BATCH))
+            seconds["read_log"] += time.perf_counter() - started
+            if not batch:
+                break
+
+            started = time.perf_counter()
+            parsed = [(record.url, record.request_time) for record in map(parse, batch) if not record.fail]
+            seconds["parse_line"] += time.perf_counter() - started
+
+            started = time.perf_counter()
+            for url, request_time in parsed:
+                collect_info(store, url, request_time)
+            seconds["collect_info"] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        calculate_stats(store, lines_num, DEFAULT_CONFIG["REPORT_SIZE"])
+        seconds["calculate_stats"] = time.perf_counter() - started
+
+        config = dict(DEFAULT_CONFIG, REPORT_DIR=tmp_dir, CHECKPOINT_DIR=None, SAVE_AGGREGATES=False,
+                      MISTAKES_BIAS=1.01)
+        started = time.perf_counter()
+        generate_report(LastLog(log_name=log_file, log_date=datetime(2017, 6, 30)), config)
+        seconds["end_to_end"] = time.perf_counter() - started
+
+    return {stage: round(lines_num / max(stage_seconds, 1e-9)) for stage, stage_seconds in seconds.items()}
+
+
+def suite_key(lines_num: int, urls_num: int, zipf: float, error_rate: float, gz: bool) -> str:
+    return f"lines={lines_num} urls={urls_num} zipf={zipf} errors={error_rate} gz={gz}"
+
+
+def compare_with_baseline(results: dict, baseline: dict, tolerance: float) -> bool:
+    """
+    Print lines/sec of stages against baseline.
+    :param results: dict of suite key and lines/sec of stages
+    :param baseline: the same dict saved before
+    :param tolerance: allowed part of slowdown
+    :return: False if some stage is slower than baseline more than tolerance
+    """
+    ok = True
+    print(f"{'case':<55} {'stage':<16} {'lines/sec':>11} {'baseline':>11} {'ratio':>6}")
+    for key, stages in results.items():
+        for stage, lines_per_second in stages.items():
+            expected = baseline.get(key, {}).get(stage)
+            if not expected:
+                print(f"{key:<55} {stage:<16} {lines_per_second:>11,} {'-':>11} {'-':>6}")
+                continue
+            ratio = lines_per_second / expected
+            regression = ratio < 1 - tolerance
+            ok = ok and not regression
+            print(f"{key:<55} {stage:<16} {lines_per_second:>11,} {expected:>11,} {ratio:>6.2f}"
+                  f"{'  REGRESSION' if regression else ''}")
+    return ok
+
+
+def run_suite(args: argparse.Namespace) -> bool:
+    results = {}
+    for lines_num in args.sizes:
+        key = suite_key(lines_num, args.urls, args.zipf, args.error_rate, args.gz)
+        print(f"Running {key}...", file=sys.stderr)
+        results[key] = bench_suite(lines_num, args.urls, args.zipf, args.error_rate, args.gz)
+
+    baseline_path = Path(args.baseline)
+    saved = json.loads(baseline_path.read_text()) if baseline_path.exists() else {"results": {}}
+    ok = compare_with_baseline(results, saved["results"], args.tolerance)
+
+    if args.save_baseline:
+        saved["results"].update(results)
+        saved["python"] = platform.python_version()
+        saved["numpy"] = np is not None
+        baseline_path.write_text(json.dumps(saved, indent=2, sort_keys=True) + "\n")
+        print(f"Baseline is saved to {baseline_path}", file=sys.stderr)
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", dest="lines", type=int, default=200000, help="Number of synthetic log lines")
+    parser.add_argument("--suite", dest="suite", action="store_true",
+                        help="Time stages of report generation at --sizes and compare with baseline")
+    parser.add_argument("--sizes", dest="sizes", type=int, nargs="+", default=[10 ** 5, 10 ** 6],
+                        help="Numbers of lines of suite logs")
+    parser.add_argument("--urls", dest="urls", type=int, default=10000, help="Number of distinct URLs of suite logs")
+    parser.add_argument("--zipf", dest="zipf", type=float, default=1.1, help="Zipf skew of URLs, 0 for uniform")
+    parser.add_argument("--error-rate", dest="error_rate", type=float, default=0.001, help="Part of broken lines")
+    parser.add_argument("--gz", dest="gz", action="store_true", help="Compress suite logs with gzip")
+    parser.add_argument("--baseline", dest="baseline", default=str(BASELINE), help="Path to baseline json")
+    parser.add_argument("--save-baseline", dest="save_baseline", action="store_true",
+                        help="Save results of suite to baseline")
+    parser.add_argument("--tolerance", dest="tolerance", type=float, default=0.2,
+                        help="Allowed slowdown against baseline, suite exits with 1 if it is exceeded")
+    args = parser.parse_args()
+
+    if args.suite:
+        sys.exit(0 if run_suite(args) else 1)
+    bench_parse_line(args.lines)
+    bench_gz_reading(args.lines)
+    bench_plain_reading(args.lines)
@@ -1,18 +1,58 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import argparse
+import cProfile
+import csv
+import ctypes
+import ctypes.util
+import functools
 import gzip
+import heapq
 import json
 import logging
+import math
+import mmap
+import os
+import pickle
+import random
 import re
+import selectors
+import shutil
+import signal
+import socket
+import struct
+import subprocess
 import sys
+import time
+import zlib
 
-from collections import defaultdict, namedtuple
+from array import array
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, wait
+from contextlib import contextmanager, nullcontext
 from datetime import datetime
+from itertools import islice
 from pathlib import Path
 from statistics import median
 from string import Template
-from typing import DefaultDict, List, Generator, NamedTuple, Pattern, Union
+from typing import BinaryIO, Callable, ContextManager, Iterable, Iterator, List, Generator, NamedTuple, Pattern, \
+    Sequence, TextIO, Tuple, Union
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, stats are calculated in pure Python without it
+    np = None
+
+try:
+    import resource
+except ImportError:  # there is no resource module on Windows, peak RSS is not reported
+    resource = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # PyArrow is optional, parquet export is replaced by csv without it
+    pa = pq = None
 
 # log_format ui_short '$remote_addr  $remote_user $http_x_real_ip [$time_local] "$request" '
 #                     '$status $body_bytes_sent "$http_referer" '
@@ -25,8 +65,139 @@ DEFAULT_CONFIG = {
     "LOG_DIR": "./log",
     "LOG_FILE": None,
     "MISTAKES_BIAS": 0.05,
+    "MISTAKES_CHECK_LINES": 10000,
+    "WORKERS": 1,
+    "CHUNK_LINES": 50000,
+    "GZ_DECOMPRESSOR": "auto",
+    "MEMORY_BUDGET_MB": 512,
+    "DIGEST_EXACT_LIMIT": 10000,
+    "LATENCY_HISTOGRAMS": False,
+    "CHECKPOINT_DIR": "checkpoints",  # relative to REPORT_DIR
+    "CHECKPOINT_EVERY_LINES": 1000000,
+    "SAVE_AGGREGATES": True,
+    "URL_RULES": [],
+    "URL_CACHE_SIZE": 65536,
+    "MAX_URLS": None,
+    "REPORT_TEMPLATE": None,
+    "REPORT_GZIP": False,
+    "EXPORT_FORMATS": [],
+    "FOLLOW_WINDOWS": {"1m": 60, "5m": 300, "1h": 3600},
+    "FOLLOW_BUCKETS": 60,
+    "FOLLOW_POLL_SECONDS": 1,
+    "FOLLOW_REFRESH_SECONDS": 10,
+    "STATS": False,
+    "PROFILE": False,
+    "SAMPLE_FRACTION": None,
+    "SAMPLE_SEED": None,
+    "DAEMON_SOCKET": "./log_analyzer.sock",
+    "DAEMON_POLL_SECONDS": 5,
+    "DAEMON_SETTLE_SECONDS": 60,
+    "DAEMON_INOTIFY": True,
 }
 
+GZ_BLOCK_SIZE = 2 ** 20  # compressed bytes read at once
+CHECKPOINT_VERSION = 1
+DATE_FORMAT = "%Y%m%d"  # date in log name
+REPORT_DATE_FORMAT = "%Y.%m.%d"  # date in report name
+REPORT_NAME_PATTERN = re.compile(r'^report-(\d{4})\.(\d{2})\.(\d{2})\.html(\.gz)?$')  # groups 1-3 are date
+AGGREGATE_MAGIC = b'LOGAGG\x01'
+AGGREGATE_HEADER = struct.Struct('<qqqd')  # number of URLs, number of lines, fails count, total request time
+AGGREGATE_URL = struct.Struct('<IqddqI')  # URL length, count, time sum, time max, zeros, number of buckets
+
+LastLog = namedtuple("LastLog", ["log_name", "log_date"])
+ReportResult = namedtuple("ReportResult", ["log_name", "num_of_lines", "log_size", "seconds", "error"])
+
+DIGEST_MIN_EXACT = 64  # digests smaller than that are not compacted when memory budget is exceeded
+
+# $request is the first quoted field of ui_short line, $request_time is the last field
+URL_PATTERN = re.compile(rb'[^"]*"\w+\s(\S+)\s+HTTP')
+REQUEST_TIME_PATTERN = re.compile(rb'\s*(\d+\.\d+)\s*')
+URL_RULES = {
+    "strip_query": (re.compile(r'\?.*$'), ''),
+    "collapse_ids": (re.compile(r'(?<=[/=])\d+(?=[/?&;]|$)'), '{id}'),  # numeric path segments and query values
+}
+OTHER_URL = "__other__"  # bucket of URLs over MAX_URLS
+REPORT_TEMPLATE = Path(__file__).resolve().with_name("report.html")
+EXPORT_FORMATS = ("ndjson", "csv", "parquet")
+PARQUET_ROW_GROUP = 10000  # rows of parquet export written at once
+FOLLOW_READ_SIZE = 2 ** 20  # bytes of followed log read at once
+LIVE_REPORT_NAME = "report-live.json"
+SAMPLE_BLOCK_SIZE = 2 ** 20  # bytes of uncompressed log in one sampled block
+SHARD_SIZE = 2 ** 26  # bytes of uncompressed log parsed by worker at once, mistakes are checked after every shard
+MISTAKES_CONFIDENCE_Z = 5.0  # one-sided z-score of early stop: a log within bias is stopped with chance ~3e-7
+INOTIFY_EVENT = struct.Struct('iIII')  # wd, mask, cookie, length of name of struct inotify_event
+INOTIFY_MASK = 0x8 | 0x40 | 0x80 | 0x100 | 0x200  # IN_CLOSE_WRITE, IN_MOVED_FROM/TO, IN_CREATE, IN_DELETE
+INOTIFY_FINISHED = 0x8 | 0x80  # IN_CLOSE_WRITE, IN_MOVED_TO: file is written or renamed to LOG_DIR
+DAEMON_HISTORY = 100  # results of reports kept for status of daemon
+DAEMON_COMMAND_SIZE = 4096  # max bytes of command to daemon
+DAEMON_CLIENT_TIMEOUT = 5  # seconds to read command from client or to wait for reply of daemon
+STAGES = ("read", "parse", "aggregate", "stats", "median", "render")  # "median" is a part of "stats"
+
+
+class StageTimer:
+    """
+    Accumulated wall time of stages of report generation for --stats.
+    Disabled timer measures nothing and costs nothing: wrap() and iterate() return arguments as they are.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+        self.counts = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        if self.enabled:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+    def count(self, **counts) -> None:
+        if self.enabled:
+            self.counts.update(counts)
+
+    @contextmanager
+    def measure(self, stage: str) -> ContextManager[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - started)
+
+    def stage(self, stage: str) -> ContextManager[None]:
+        return self.measure(stage) if self.enabled else nullcontext()
+
+    def wrap(self, stage: str, func: Callable) -> Callable:
+        """Function which adds time of every call of func to stage."""
+        if not self.enabled:
+            return func
+
+        def timed(*args):
+            started = time.perf_counter()
+            try:
+                return func(*args)
+            finally:
+                self.add(stage, time.perf_counter() - started)
+
+        return timed
+
+    def iterate(self, stage: str, iterable: Iterable) -> Iterator:
+        """Iterator which adds time of getting every item of iterable to stage."""
+        if not self.enabled:
+            return iter(iterable)
+        return self.timed_items(stage, iter(iterable))
+
+    def timed_items(self, stage: str, iterator: Iterator) -> Generator:
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.add(stage, time.perf_counter() - started)
+            yield item
+
+
+NULL_TIMER = StageTimer(enabled=False)
+
 
 def prepare_config(default_config: dict, path_to_config: str = None) -> dict:
     """
@@ -51,6 +222,142 @@ def prepare_config(default_config: dict, path_to_config: str = None) -> dict:
         raise FileNotFoundError("Config file not found")
 
 
+class LogEntry(NamedTuple):
+    """Log of LOG_DIR in LogDirIndex: path, date from name, size, mtime and report status (None if unknown)."""
+    path: str
+    date: datetime
+    size: int
+    mtime: float
+    reported: Union[bool, None] = None
+
+
+class LogDirIndex:
+    """
+    Cached index of logs of directory refreshed incrementally by os.scandir: name pattern is matched, date is
+    parsed and size and mtime are stat'ed only for names which were not met before (not matching names are
+    remembered too). Rotated logs don't change, so only the latest log is stat'ed again on every refresh.
+    Report status of logs is updated by one scan of report directory.
+    """
+
+    def __init__(self, path_to_log_dir: str, file_pattern: Pattern):
+        """
+        :param path_to_log_dir: path to directory with logs.
+        :param file_pattern: name pattern for log file to search, group 1 is date.
+        """
+        self.path_to_log_dir = path_to_log_dir
+        self.file_pattern = file_pattern
+        self.dates = {}  # name: date of log or None if name doesn't match pattern
+        self.entries = {}  # name: LogEntry
+
+    def parse_date(self, name: str) -> Union[datetime, None]:
+        match = self.file_pattern.match(name)
+        if not match:
+            return None
+        date = match.group(1)  # DATE_FORMAT, slicing is much faster than strptime on big directories
+        return datetime(int(date[:4]), int(date[4:6]), int(date[6:8]))
+
+    def refresh(self, report_dir: str = None) -> 'LogDirIndex':
+        """
+        Rescan directory of logs (and directory of reports if it is given).
+        :param report_dir: path to report directory
+        :return: index itself
+        """
+        path = Path(self.path_to_log_dir)
+        if not path.is_dir():
+            logging.error("LOG_DIR is not a directory path")
+            raise NotADirectoryError("Path to LOG_DIR is not pointing to a directory")
+        reported = reported_dates(report_dir) if report_dir is not None else None
+
+        dates = {}  # names which were removed are forgotten
+        entries = {}
+        latest = None
+        with os.scandir(path) as dir_entries:
+            for dir_entry in dir_entries:
+                name = dir_entry.name
+                entry = self.entries.get(name)
+                if entry is None:
+                    log_date = dates[name] = self.dates[name] if name in self.dates else self.parse_date(name)
+                    if log_date is None:
+                        continue
+                    try:
+                        stat = dir_entry.stat()
+                    except FileNotFoundError:  # removed by rotation while scanning
+                        continue
+                    entry = LogEntry(dir_entry.path, log_date, stat.st_size, stat.st_mtime)
+                else:
+                    dates[name] = entry.date
+                if reported is not None and entry.reported != (entry.date in reported):
+                    entry = entry._replace(reported=entry.date in reported)
+                entries[name] = entry
+                if latest is None or entry.date > latest.date:
+                    latest = entry
+
+        name = os.path.basename(latest.path) if latest else None
+        if name in self.entries:  # the latest log could be still written
+            try:
+                stat = os.stat(latest.path)
+                entries[name] = latest._replace(size=stat.st_size, mtime=stat.st_mtime)
+            except FileNotFoundError:
+                del entries[name]
+        self.dates = dates
+        self.entries = entries
+        return self
+
+    def restat(self, names: Iterable[str]) -> List[LogEntry]:
+        """
+        Stat logs again which could be changed after they were indexed (e.g. old logs still copied into directory).
+        :param names: names of logs in index
+        :return: updated entries, removed logs are dropped from index
+        """
+        updated = []
+        for name in names:
+            entry = self.entries.get(name)
+            if entry is None:
+                continue
+            try:
+                stat = os.stat(entry.path)
+            except FileNotFoundError:
+                del self.entries[name]
+                continue
+            entry = self.entries[name] = entry._replace(size=stat.st_size, mtime=stat.st_mtime)
+            updated.append(entry)
+        return updated
+
+    def logs(self, since: datetime = datetime.min, until: datetime = datetime.max) -> List[LogEntry]:
+        """
+        Get logs with dates in [since, until] range, one log per date.
+        :param since: the first date
+        :param until: the last date
+        :return: list of logs sorted by date
+        """
+        logs = {}
+        for entry in self.entries.values():
+            if since <= entry.date <= until:
+                logs.setdefault(entry.date, entry)  # there should be one log per date
+        return [logs[log_date] for log_date in sorted(logs)]
+
+
+@functools.lru_cache(maxsize=16)
+def log_dir_index(path_to_log_dir: str, file_pattern: Pattern) -> LogDirIndex:
+    """Get cached index of directory with logs (it should be refreshed before use)."""
+    return LogDirIndex(path_to_log_dir, file_pattern)
+
+
+def reported_dates(report_dir: str) -> set:
+    """
+    Find dates of reports (compressed or not) in report directory by one scan.
+    :param report_dir: path to report directory
+    :return: set of dates
+    """
+    if not Path(report_dir).is_dir():
+        logging.error("REPORT_DIR is not a directory path")
+        raise NotADirectoryError("Something wrong with path while checking is log was reported.")
+
+    with os.scandir(report_dir) as dir_entries:
+        return {datetime(*map(int, match.group(1, 2, 3)))
+                for match in map(REPORT_NAME_PATTERN.match, (entry.name for entry in dir_entries)) if match}
+
+
 def find_log_last(path_to_log_dir: str, file_pattern: Pattern) -> NamedTuple:
     """
     Find the latest log in the dir.
@@ -58,34 +365,27 @@ def find_log_last(path_to_log_dir: str, file_pattern: Pattern) -> NamedTuple:
     :param file_pattern: name pattern for log file to search.
     :return: named tuple with log name and log date fields.
     """
-    path = Path(path_to_log_dir)
-    if not path.is_dir():
-        logging.error("LOG_DIR is not a directory path")
-        raise NotADirectoryError("Path to LOG_DIR is not pointing to a directory")
-
-    LastLog = namedtuple("LastLog", ["log_name", "log_date"])
-    latest_log_date = datetime(1, 1, 1)  # start point for dates comparison
-    file_latest = None
-    date_format = "%Y%m%d"  # classmethod datetime.strptime(date_string, format)
-
-    for file in path.iterdir():
-        match = file_pattern.match(str(file).split("/")[1])  # file is a path: dir_name/file
-        if match:
-            curr_date = datetime.strptime(match.group(1), date_format)
-            if curr_date > latest_log_date:
-                latest_log_date = curr_date
-                file_latest = file
-
-    last_log = LastLog(
-            log_name=file_latest,
-            log_date=latest_log_date
-    )
-
-    if last_log.log_date == datetime(1, 1, 1):
+    logs = log_dir_index(path_to_log_dir, file_pattern).refresh().logs()
+    if not logs:
         logging.error("ERROR! Latest log was not found!")
         raise FileNotFoundError("Latest log was not found!")
 
-    return last_log  # then call of this function should be inside outter try/except block
+    return LastLog(log_name=Path(logs[-1].path), log_date=logs[-1].date)  # then call of this function should be inside
+    # outter try/except block
+
+
+def find_logs(path_to_log_dir: str, file_pattern: Pattern, since: datetime = datetime.min,
+              until: datetime = datetime.max) -> List[NamedTuple]:
+    """
+    Find all logs in the dir with dates in [since, until] range.
+    :param path_to_log_dir: path to directory with logs.
+    :param file_pattern: name pattern for log file to search.
+    :param since: the first date
+    :param until: the last date
+    :return: list of named tuples with log name and log date fields sorted by date.
+    """
+    logs = log_dir_index(path_to_log_dir, file_pattern).refresh().logs(since, until)
+    return [LastLog(log_name=Path(entry.path), log_date=entry.date) for entry in logs]
 
 
 def log_is_reported(log_file: NamedTuple, report_dir: str) -> bool:
@@ -102,213 +402,1634 @@ def log_is_reported(log_file: NamedTuple, report_dir: str) -> bool:
         logging.exception("Exception raised while checking log was reported or not!")
         raise NotADirectoryError("Something wrong with path while checking is log was reported.")
 
-    return Path(report_path).exists()
+    return Path(report_path).exists() or Path(report_path + ".gz").exists()
 
 
-def read_log(log_file: Path) -> Generator[Union[str, bytes], None, None]:
-    with gzip.open(log_file) if log_file.suffix == '.gz' else open(log_file) as lf_handler:
+def read_log(log_file: Path) -> Generator[bytes, None, None]:
+    if log_file.suffix == '.gz':
+        for lines, _ in read_log_chunks(log_file):
+            yield from lines
+        return
+
+    with open(log_file, 'rb') as lf_handler:
         for line in lf_handler:
             yield line
 
 
-def parse_line(line: Union[str, bytes]) -> NamedTuple:
-    url_pattern = re.compile(r'\"\w+\s(\S+)\s+HTTP')
-    request_time_pattern = re.compile(r'\d+\.\d+$')
-    URLandReq_time = namedtuple("URLandReq_time", ["url", "request_time", "fail"])
-    fail = False
+def complete_lines_end(log_file: Path) -> int:
+    """
+    Find end of the last complete line of uncompressed log (nginx could be still writing the last line).
+    :param log_file: path to logfile
+    :return: offset after the last newline
+    """
+    with open(log_file, 'rb') as lf_handler:
+        end = lf_handler.seek(0, os.SEEK_END)
+        while end > 0:
+            block_start = max(end - 2 ** 16, 0)
+            lf_handler.seek(block_start)
+            newline = lf_handler.read(end - block_start).rfind(b'\n')
+            if newline != -1:
+                return block_start + newline + 1
+            end = block_start
+    return 0
+
+
+def split_log(log_file: Path, shards_num: int, start: int = 0) -> List[Tuple[int, int]]:
+    """
+    Split complete lines of uncompressed log after start offset into byte ranges aligned on newlines.
+    :param log_file: path to logfile
+    :param shards_num: wanted number of shards
+    :param start: offset of the first line
+    :return: list of (start, end) offsets, empty shards are dropped
+    """
+    file_end = complete_lines_end(log_file)
+    step = max((file_end - start) // max(shards_num, 1), 1)
+    bounds = [start]
 
-    if isinstance(line, bytes):
-        line = line.decode("UTF-8")
+    with open(log_file, 'rb') as lf_handler:
+        for shard in range(1, shards_num):
+            lf_handler.seek(max(start + shard * step, bounds[-1]))
+            lf_handler.readline()  # move to the start of the next line
+            position = min(lf_handler.tell(), file_end)
+            if position > bounds[-1]:
+                bounds.append(position)
 
-    url = url_pattern.search(line)  # https://docs.python.org/3/library/re.html?highlight=re%20match#search-vs-match
-    request_time = request_time_pattern.search(line)
+    if bounds[-1] < file_end:
+        bounds.append(file_end)
 
-    if not url or not request_time:
-        fail = True
+    return list(zip(bounds[:-1], bounds[1:]))
 
-        url_and_req_time = URLandReq_time(
-                url=None,
-                request_time=None,
-                fail=fail
-        )  # remember that you have to create an instance of namedtuple.
 
-        return url_and_req_time
+class LogPosition(NamedTuple):
+    """
+    Position of the next unread line in log.
+    For uncompressed log offset is byte offset in file and member_offset is 0.
+    For gz log offset is byte offset of gzip member where the line starts and member_offset is number of
+    decompressed bytes of this member before the line.
+    """
+    offset: int = 0
+    member_offset: int = 0
 
-    url_and_req_time = URLandReq_time(
-            url=url.group(1),
-            request_time=round(float(request_time.group()), 3),
-            fail=fail
-    )
 
-    return url_and_req_time
+def read_plain_chunks(log_file: Path, position: LogPosition,
+                      chunk_size: int) -> Generator[Tuple[List[bytes], LogPosition], None, None]:
+    """
+    Read uncompressed log by chunks of lines starting from position.
+    Last line without newline is not read: nginx is still writing it.
+    :param log_file: path to logfile
+    :param position: position to start from
+    :param chunk_size: number of lines in one chunk
+    :return: generator of chunks and positions after them
+    """
+    with open(log_file, 'rb') as lf_handler:
+        lf_handler.seek(position.offset)
+        offset = position.offset
+        while True:
+            lines = list(islice(lf_handler, chunk_size))
+            if lines and not lines[-1].endswith(b'\n'):
+                lines.pop()
+            if not lines:
+                return
+            offset += sum(map(len, lines))
+            yield lines, LogPosition(offset)
+
+
+def split_lines(blocks: Iterable[bytes], skip: int,
+                chunk_size: int) -> Generator[Tuple[List[bytes], int], None, None]:
+    """
+    Split decompressed blocks into chunks of about chunk_size lines in bulk.
+    :param blocks: iterable with decompressed data
+    :param skip: number of bytes at the start which were already read
+    :param chunk_size: number of lines in one chunk
+    :return: generator of chunks and offsets after them (counted from the start of the first block)
+    """
+    consumed = 0  # bytes before the first not finished line
+    tail = b''
+    lines = []
+
+    for data in blocks:
+        if skip:
+            skipped = min(skip, len(data))
+            data = data[skipped:]
+            skip -= skipped
+            consumed += skipped
+
+        buffer = tail + data
+        new_lines = buffer.splitlines(keepends=True)
+        tail = new_lines.pop() if new_lines and not new_lines[-1].endswith(b'\n') else b''
+        lines.extend(new_lines)
+        consumed += len(buffer) - len(tail)
+
+        if len(lines) >= chunk_size:
+            yield lines, consumed
+            lines = []
+
+    if tail:
+        lines.append(tail)
+        consumed += len(tail)
+    if lines:
+        yield lines, consumed
+
+
+def zlib_blocks(lf_handler: BinaryIO, members: deque) -> Generator[bytes, None, None]:
+    """
+    Decompress gz file (could be of several gzip members) by big blocks in this process.
+    :param lf_handler: file handler positioned at the start of gzip member
+    :param members: deque with compressed and decompressed offsets of the first member,
+                    offsets of the next members are appended to it
+    :return: generator of decompressed blocks
+    """
+    read_offset = members[-1][0]
+    decompressed = members[-1][1]
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    while True:
+        block = lf_handler.read(GZ_BLOCK_SIZE)
+        if not block:
+            return
+        read_offset += len(block)
+        while block:
+            data = decompressor.decompress(block)
+            decompressed += len(data)
+            yield data
+            if not decompressor.eof:
+                break
+            block = decompressor.unused_data
+            if not block.strip(b'\x00'):  # gzip file could be padded with zeros
+                break
+            members.append((read_offset - len(block), decompressed))
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+def pipe_blocks(lf_handler: BinaryIO, command: List[str]) -> Generator[bytes, None, None]:
+    """
+    Decompress gz file by external process (pigz or gzip), so decompression runs on another core.
+    :param lf_handler: file handler positioned at the start of gzip member, it is stdin of the process
+    :param command: command of decompressor
+    :return: generator of decompressed blocks
+    """
+    process = subprocess.Popen(command, stdin=lf_handler, stdout=subprocess.PIPE)
+    try:
+        while True:
+            data = process.stdout.read(GZ_BLOCK_SIZE * 4)
+            if not data:
+                break
+            yield data
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
+        if process.wait() > 0:
+            logging.warning(f"{command[0]} exited with code {process.returncode} while reading {lf_handler.name}.")
+
+
+def gz_decompressor_command(decompressor: str) -> Union[List[str], None]:
+    """
+    Find external gzip decompressor.
+    :param decompressor: 'auto' (pigz if found), 'pigz', 'gzip' or 'python' (zlib in this process)
+    :return: command of decompressor or None if gz should be decompressed by zlib
+    """
+    # single threaded gzip is slower than zlib in this process, so 'auto' doesn't fall back to it
+    name = 'pigz' if decompressor == 'auto' else decompressor
+    if name in ('pigz', 'gzip') and shutil.which(name):
+        return [name, '-dc']
+    return None
+
+
+def read_gz_chunks(log_file: Path, position: LogPosition, chunk_size: int,
+                   decompressor: str = 'python') -> Generator[Tuple[List[bytes], LogPosition], None, None]:
+    """
+    Read gz log (could be of several gzip members) by chunks of about chunk_size lines starting from position.
+    With external decompressor positions are counted from the gzip member of start position,
+    because boundaries of next members are not known.
+    :param log_file: path to logfile
+    :param position: position to start from
+    :param chunk_size: number of lines in one chunk
+    :param decompressor: 'auto' (pigz if found), 'pigz', 'gzip' or 'python'
+    :return: generator of chunks and positions after them
+    """
+    command = gz_decompressor_command(decompressor)
+    members = deque([(position.offset, 0)])  # compressed offset and decompressed offset of start of gzip members
+
+    def position_of(uncompressed_offset: int) -> LogPosition:
+        while len(members) > 1 and members[1][1] <= uncompressed_offset:
+            members.popleft()
+        return LogPosition(members[0][0], uncompressed_offset - members[0][1])
+
+    with open(log_file, 'rb') as lf_handler:
+        lf_handler.seek(position.offset)
+        blocks = pipe_blocks(lf_handler, command) if command else zlib_blocks(lf_handler, members)
+        for lines, consumed in split_lines(blocks, position.member_offset, chunk_size):
+            yield lines, position_of(consumed)
+
+
+def read_log_chunks(log_file: Path, position: LogPosition = LogPosition(), chunk_size: int = 50000,
+                    decompressor: str = 'python') -> Generator[Tuple[List[bytes], LogPosition], None, None]:
+    """
+    Read log by chunks of lines starting from position.
+    :param log_file: path to logfile
+    :param position: position to start from
+    :param chunk_size: number of lines in one chunk
+    :param decompressor: decompressor of gz log: 'auto' (pigz if found), 'pigz', 'gzip' or 'python'
+    :return: generator of chunks and positions after them
+    """
+    if log_file.suffix == '.gz':
+        return read_gz_chunks(log_file, position, chunk_size, decompressor)
+    return read_plain_chunks(log_file, position, chunk_size)
+
+
+class ParsedLine:
+    """Result of line parsing: URL, request time and fail flag. Could be unpacked as tuple."""
+    __slots__ = ('url', 'request_time', 'fail')
+
+    def __init__(self, url: str = None, request_time: float = None, fail: bool = True):
+        self.url = url
+        self.request_time = request_time
+        self.fail = fail
+
+    def __iter__(self):
+        return iter((self.url, self.request_time, self.fail))
+
+
+class LineParser:
+    """
+    Parser of ui_short lines in bytes. Should be created once per run.
+    URL is matched by one anchored pattern, request time is split from the right, only URL is decoded.
+    parse() returns the same ParsedLine record every time, so it should be used before the next call.
+    """
+    __slots__ = ('record', 'url_match')
+
+    def __init__(self):
+        self.record = ParsedLine()
+        self.url_match = URL_PATTERN.match
+
+    def parse(self, line: bytes) -> ParsedLine:
+        record = self.record
+        url = self.url_match(line)
+        request_time = line.rpartition(b' ')[2].strip()
+        seconds, dot, fraction = request_time.partition(b'.')
+
+        if not url or not dot or not seconds.isdigit() or not fraction.isdigit():
+            record.url = None
+            record.request_time = None
+            record.fail = True
+            return record
+
+        record.url = url.group(1).decode("UTF-8", "replace")
+        record.request_time = round(float(request_time), 3)
+        record.fail = False
+        return record
+
 
+def parse_line(line: Union[str, bytes]) -> ParsedLine:
+    """
+    Parse one line. Use LineParser for a lot of lines.
+    :param line: log line
+    :return: new ParsedLine record
+    """
+    if isinstance(line, str):
+        line = line.encode("UTF-8")
+
+    return LineParser().parse(line)
+
+
+class RequestTimeDigest:
+    """
+    Request times of one URL for median calculation.
+
+    Times are kept exactly (array of doubles, 8 bytes per time) while there are not more than exact_limit of them.
+    After that digest is compacted to log-bucket quantile sketch (DDSketch, https://arxiv.org/abs/1908.10693):
+    bucket i counts times in (GAMMA^(i-1), GAMMA^i], GAMMA = (1 + RELATIVE_ERROR) / (1 - RELATIVE_ERROR).
+    Sketch needs about 600 buckets for times from 1 ms to 100 s and two sketches are merged by summing counts.
+
+    Error bound: median of compacted digest differs from the exact one by not more than RELATIVE_ERROR (1%)
+    (for even number of times - from the lower of two middle times which statistics.median averages),
+    the same is true for other quantiles. Digest with exact_limit 0 is a latency histogram from the start:
+    its memory is O(buckets) whatever number of times.
+    """
+    RELATIVE_ERROR = 0.01
+    GAMMA = (1 + RELATIVE_ERROR) / (1 - RELATIVE_ERROR)
+    LOG_GAMMA = math.log(GAMMA)
+    MIN_TIME = 1e-6  # smaller times are counted as zeros
+
+    __slots__ = ('exact', 'buckets', 'zeros', 'count', 'exact_limit')
+
+    def __init__(self, exact_limit: int = DEFAULT_CONFIG["DIGEST_EXACT_LIMIT"]):
+        self.exact = array('d')
+        self.buckets = None if exact_limit > 0 else {}  # dict {bucket index: count} after compaction
+        self.zeros = 0
+        self.count = 0
+        self.exact_limit = exact_limit
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, RequestTimeDigest):
+            return NotImplemented
+        return (self.exact, self.buckets, self.zeros, self.count) == \
+            (other.exact, other.buckets, other.zeros, other.count)
+
+    @property
+    def is_exact(self) -> bool:
+        return self.buckets is None
+
+    def add(self, request_time: float) -> None:
+        self.count += 1
+        if self.buckets is None:
+            self.exact.append(request_time)
+            if len(self.exact) > self.exact_limit:
+                self.compact()
+        else:
+            self._add_to_bucket(request_time, 1)
+
+    def _add_to_bucket(self, request_time: float, num: int) -> None:
+        if request_time < self.MIN_TIME:
+            self.zeros += num
+        else:
+            index = math.ceil(math.log(request_time) / self.LOG_GAMMA)
+            self.buckets[index] = self.buckets.get(index, 0) + num
+
+    def compact(self) -> None:
+        """Move exact times to sketch buckets."""
+        if self.buckets is None:
+            self.buckets = {}
+        for request_time in self.exact:
+            self._add_to_bucket(request_time, 1)
+        self.exact = array('d')
+
+    def merge(self, other: 'RequestTimeDigest') -> None:
+        """
+        Merge other digest in. Exact times are concatenated in order while they fit into exact_limit.
+        :param other: digest to merge in
+        """
+        self.count += other.count
+        if self.buckets is None and other.buckets is None:
+            self.exact.extend(other.exact)
+            if len(self.exact) > self.exact_limit:
+                self.compact()
+            return
 
-def collect_info(collector: DefaultDict[str, dict], url: str,
-                 url_req_time: float, url_num: int = 1) -> DefaultDict[str, dict]:
+        self.compact()
+        for request_time in other.exact:
+            self._add_to_bucket(request_time, 1)
+        self.zeros += other.zeros
+        for index, num in (other.buckets or {}).items():
+            self.buckets[index] = self.buckets.get(index, 0) + num
+
+    def sketch(self) -> Tuple[int, dict]:
+        """
+        Get sketch of digest as if it was compacted, digest itself is not changed.
+        :return: number of zeros and buckets
+        """
+        sketch = RequestTimeDigest()
+        sketch.buckets = dict(self.buckets or {})
+        sketch.zeros = self.zeros
+        for request_time in self.exact:
+            sketch._add_to_bucket(request_time, 1)
+        return sketch.zeros, sketch.buckets
+
+    @classmethod
+    def from_sketch(cls, zeros: int, buckets: dict,
+                    exact_limit: int = DEFAULT_CONFIG["DIGEST_EXACT_LIMIT"]) -> 'RequestTimeDigest':
+        digest = cls(exact_limit)
+        digest.buckets = buckets
+        digest.zeros = zeros
+        digest.count = zeros + sum(buckets.values())
+        return digest
+
+    def median(self) -> float:
+        if self.buckets is None:
+            return median(self.exact)
+        return self.quantile(0.5)
+
+    def quantile(self, q: float) -> float:
+        """
+        Get quantile of request times: linear interpolation between closest ranks for exact times
+        (as numpy.percentile does, so quantile(0.5) equals statistics.median), lower rank for sketch.
+        :param q: quantile from 0 to 1
+        :return: request time
+        """
+        if self.buckets is None:
+            if not self.exact:
+                raise ValueError("Quantile of empty digest")
+            return interpolate_quantile(sorted(self.exact), q)
+
+        rank = int(q * (self.count - 1))
+        if rank < self.zeros:
+            return 0.0
+        seen = self.zeros
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                return 2 * self.GAMMA ** index / (self.GAMMA + 1)  # middle of bucket in terms of relative error
+        raise ValueError("Quantile of empty digest")
+
+
+def interpolate_quantile(times: Sequence[float], q: float) -> float:
+    """
+    Get quantile of sorted (or partitioned around the needed ranks) request times by linear interpolation.
+    :param times: request times
+    :param q: quantile from 0 to 1
+    :return: request time
+    """
+    position = q * (len(times) - 1)
+    lower = int(position)
+    upper = min(lower + 1, len(times) - 1)
+    return times[lower] + (times[upper] - times[lower]) * (position - lower)
+
+
+def digest_exact_limit(actual_config: dict) -> int:
+    """
+    Get number of request times of one URL kept exactly: 0 if LATENCY_HISTOGRAMS are configured.
+    :param actual_config: actual configuration
+    :return: exact limit of RequestTimeDigest
+    """
+    if actual_config.get("LATENCY_HISTOGRAMS", DEFAULT_CONFIG["LATENCY_HISTOGRAMS"]):
+        return 0
+    return actual_config.get("DIGEST_EXACT_LIMIT", DEFAULT_CONFIG["DIGEST_EXACT_LIMIT"])
+
+
+def times_budget(actual_config: dict) -> int:
+    """
+    Convert MEMORY_BUDGET_MB from config to number of exact request times which could be kept in memory.
+    :param actual_config: actual configuration
+    :return: number of request times
+    """
+    return int(actual_config.get("MEMORY_BUDGET_MB", DEFAULT_CONFIG["MEMORY_BUDGET_MB"]) * 2 ** 20 //
+               array('d').itemsize)
+
+
+class UrlNormalizer:
+    """
+    Normalization of URLs before aggregation: rules are applied in order, results are kept in LRU cache.
+    Rule is a name from URL_RULES ("strip_query", "collapse_ids") or dict with regex "pattern" and "template"
+    of replacement, e.g. {"pattern": "^/api/v2/banner/\\d+", "template": "/api/v2/banner/{id}"}.
+    """
+
+    def __init__(self, rules: List[Union[str, dict]], cache_size: int = DEFAULT_CONFIG["URL_CACHE_SIZE"]):
+        """
+        :param rules: rules of normalization
+        :param cache_size: number of raw URLs in cache
+        """
+        self.rules = rules
+        self.cache_size = cache_size
+        self.substitutions = []
+        for rule in rules:
+            if isinstance(rule, dict):
+                try:
+                    self.substitutions.append((re.compile(rule["pattern"]), rule["template"]))
+                except (KeyError, re.error) as exception:
+                    raise ValueError(f"Bad URL rule {rule}: {exception}")
+            elif rule in URL_RULES:
+                self.substitutions.append(URL_RULES[rule])
+            else:
+                raise ValueError(f"Unknown URL rule: {rule}")
+        self.normalize = functools.lru_cache(maxsize=cache_size)(self.apply_rules)
+
+    def __reduce__(self):  # cache isn't pickled to checkpoints and workers
+        return UrlNormalizer, (self.rules, self.cache_size)
+
+    def __call__(self, url: str) -> str:
+        return self.normalize(url)
+
+    def apply_rules(self, url: str) -> str:
+        for pattern, template in self.substitutions:
+            url = pattern.sub(template, url)
+        return url
+
+
+def url_normalizer(actual_config: dict) -> Union[UrlNormalizer, None]:
+    """
+    Create normalizer of URLs from URL_RULES of config.
+    :param actual_config: actual configuration
+    :return: normalizer or None if there are no rules
+    """
+    rules = actual_config.get("URL_RULES")
+    if not rules:
+        return None
+    return UrlNormalizer(rules, actual_config.get("URL_CACHE_SIZE", DEFAULT_CONFIG["URL_CACHE_SIZE"]))
+
+
+class UrlStatsStore:
+    """
+    Columnar collector of per-URL stats.
+    URLs are interned to integer ids, count, sum and max of request time are kept in typed arrays by id,
+    request times are kept in RequestTimeDigest of URL.
+    URLs of add() are normalized by normalizer, URLs over max_urls distinct ones are collected to OTHER_URL.
+    """
+
+    def __init__(self, exact_limit: int = DEFAULT_CONFIG["DIGEST_EXACT_LIMIT"], budget: int = None,
+                 normalizer: UrlNormalizer = None, max_urls: int = None):
+        """
+        :param exact_limit: number of request times of URL kept exactly before compaction of its digest
+        :param budget: number of exact request times of all URLs, after that digests of updated URLs are compacted
+        :param normalizer: normalizer of URLs (URLs are kept as is if None)
+        :param max_urls: number of distinct URLs (no limit if None)
+        """
+        self.normalizer = normalizer
+        self.max_urls = max_urls
+        self.url_ids = {}
+        self.urls = []
+        self.counts = array('q')
+        self.time_sums = array('d')
+        self.time_maxes = array('d')
+        self.digests = []
+        self.total_time = 0.0
+        self.exact_times = 0
+        self.exact_limit = exact_limit
+        self.budget = budget
+
+    def __len__(self) -> int:
+        return len(self.urls)
+
+    def url_id(self, url: str) -> int:
+        """
+        Get id of URL, new URL gets the next id, new URL over max_urls gets id of OTHER_URL.
+        :param url: normalized URL
+        :return: id of URL
+        """
+        url_id = self.url_ids.get(url)
+        if url_id is None:
+            if self.max_urls and len(self.urls) >= self.max_urls and url != OTHER_URL:
+                return self.url_id(OTHER_URL)
+            url_id = self.url_ids[url] = len(self.urls)
+            self.urls.append(url)
+            self.counts.append(0)
+            self.time_sums.append(0.0)
+            self.time_maxes.append(0.0)
+            self.digests.append(RequestTimeDigest(self.exact_limit))
+        return url_id
+
+    def normalize(self, url: str) -> str:
+        return self.normalizer(url) if self.normalizer else url
+
+    def add(self, url: str, request_time: float, url_num: int = 1) -> None:
+        self.add_by_id(self.url_id(self.normalize(url)), request_time, url_num)
+
+    def add_by_id(self, url_id: int, request_time: float, url_num: int = 1) -> None:
+        self.counts[url_id] += url_num
+        self.time_sums[url_id] += request_time
+        if request_time > self.time_maxes[url_id]:
+            self.time_maxes[url_id] = request_time
+        self.total_time += request_time
+
+        digest = self.digests[url_id]  # for median calculating
+        exact_before = len(digest.exact)
+        digest.add(request_time)
+        if self.budget and self.exact_times >= self.budget and len(digest.exact) > DIGEST_MIN_EXACT:
+            digest.compact()
+        self.exact_times += len(digest.exact) - exact_before
+
+    def scale(self, factor: float) -> None:
+        """
+        Scale counts and sums of request times (e.g. from sample to the whole log), digests are not changed.
+        :param factor: multiplier of counts and sums
+        """
+        for url_id in range(len(self.urls)):
+            self.counts[url_id] = round(self.counts[url_id] * factor)
+            self.time_sums[url_id] *= factor
+        self.total_time *= factor
+
+    def merge(self, other: 'UrlStatsStore') -> None:
+        """
+        Merge store filled by another process in.
+        Exact request times are concatenated in order, so median stays the same as in one process.
+        :param other: store to merge in
+        """
+        for other_id, url in enumerate(other.urls):
+            url_id = self.url_id(url)
+            self.counts[url_id] += other.counts[other_id]
+            self.time_sums[url_id] += other.time_sums[other_id]
+            self.time_maxes[url_id] = max(self.time_maxes[url_id], other.time_maxes[other_id])
+            digest = self.digests[url_id]
+            exact_before = len(digest.exact)
+            digest.merge(other.digests[other_id])
+            self.exact_times += len(digest.exact) - exact_before
+        self.total_time += other.total_time
+
+
+def collect_info(collector: UrlStatsStore, url: str, url_req_time: float, url_num: int = 1) -> UrlStatsStore:
     """
     Function to collect all data from parsed log for future stat calculations
-    :param collector: initialized dictionary from caller function
+    :param collector: initialized store from caller function
     :param url: URL
     :param url_req_time: request time for URL
     :param url_num: appearance number of URL
-    :return: updated collector of format
-    {
-        url:
-        {
-            'url_rt': float,
-            'url_rt_lst': list,
-            'url_rt_max': float,
-            'num_of_url': int,
-        },
-        'total':
-        {
-            'total_url_rt': float,
-        }
+    :return: updated collector
+    """
+    collector.add(url, url_req_time, url_num)
+    return collector
+
+
+def parse_lines(lines: Iterable[bytes], exact_limit: int = DEFAULT_CONFIG["DIGEST_EXACT_LIMIT"],
+                budget: int = None, memory: UrlStatsStore = None, normalizer: UrlNormalizer = None,
+                max_urls: int = None, timer: StageTimer = NULL_TIMER) -> Tuple[UrlStatsStore, int, int]:
+    """
+    Parse lines and collect info from them.
+    :param lines: iterable with log lines
+    :param exact_limit: number of request times of one URL kept exactly
+    :param budget: number of exact request times of all URLs (no limit if None)
+    :param memory: collector to update, new one is created if None
+    :param normalizer: normalizer of URLs of new collector
+    :param max_urls: number of distinct URLs of new collector (no limit if None)
+    :param timer: timer of "aggregate" stage
+    :return: collector, fails count and number of lines
+    """
+    if memory is None:
+        memory = UrlStatsStore(exact_limit, budget, normalizer, max_urls)
+    fails_count = 0
+    num_of_lines = 0
+
+    parse = LineParser().parse
+    collect = timer.wrap("aggregate", collect_info)
+    for line in lines:
+        parsed_line = parse(line)
+        if not parsed_line.fail:
+            memory = collect(memory, parsed_line.url, parsed_line.request_time)
+        else:
+            fails_count += 1
+        num_of_lines += 1
+
+    return memory, fails_count, num_of_lines
+
+
+def parse_view(view: memoryview, start: int, end: int, chunk_size: int, raw_ids: dict,
+               memory: UrlStatsStore, timer: StageTimer = NULL_TIMER) -> Tuple[int, int, int]:
+    """
+    Parse up to chunk_size complete lines of memory mapped log without copying them.
+    URL slice is looked up in raw_ids as memoryview, it is decoded, normalized and interned only when it is met
+    the first time (raw_ids is not bigger than max_urls of memory).
+    :param view: memoryview of mapped log
+    :param start: offset of the first line
+    :param end: offset where parsing stops
+    :param chunk_size: number of lines to parse
+    :param raw_ids: dict of URLs in bytes to their ids in memory, new URLs are added to it
+    :param memory: collector to update
+    :param timer: timer of "aggregate" stage
+    :return: fails count, number of lines and offset after the last parsed line
+    """
+    mapped = view.obj
+    find_newline = mapped.find
+    find_space = mapped.rfind
+    url_match = URL_PATTERN.match
+    request_time_match = REQUEST_TIME_PATTERN.fullmatch
+    add_by_id = timer.wrap("aggregate", memory.add_by_id)
+    fails_count = 0
+    num_of_lines = 0
+
+    while num_of_lines < chunk_size:
+        newline = find_newline(b'\n', start, end)
+        if newline == -1:
+            break
+        space = find_space(b' ', start, newline)
+        if space == -1:  # empty or truncated line, slicing from -1 + 1 would copy the map from its start
+            fails_count += 1
+            num_of_lines += 1
+            start = newline + 1
+            continue
+        url = url_match(view, start, newline)
+        request_time = request_time_match(mapped[space + 1:newline])
+        if url and request_time:
+            url_view = view[slice(*url.span(1))]
+            url_id = raw_ids.get(url_view)
+            if url_id is None:
+                raw_url = url_view.tobytes()
+                url_id = memory.url_id(memory.normalize(raw_url.decode("UTF-8", "replace")))
+                if not memory.max_urls or len(raw_ids) < memory.max_urls:
+                    raw_ids[raw_url] = url_id
+            add_by_id(url_id, round(float(request_time[1]), 3))
+        else:
+            fails_count += 1
+        num_of_lines += 1
+        start = newline + 1
+
+    return fails_count, num_of_lines, start
+
+
+def parse_mapped(log_file: Path, memory: UrlStatsStore, start: int = 0, end: int = None, chunk_size: int = 50000,
+                 timer: StageTimer = NULL_TIMER) -> Generator[Tuple[int, int, LogPosition], None, None]:
+    """
+    Parse uncompressed log straight from memory map, lines are not read into bytes objects.
+    Last line without newline is not parsed: nginx is still writing it.
+    :param log_file: path to logfile
+    :param memory: collector to update
+    :param start: offset of the first line
+    :param end: offset where parsing stops (end of file if None)
+    :param chunk_size: number of lines between yielded results
+    :param timer: timer of "aggregate" stage
+    :return: generator of fails count and number of lines of every chunk and positions after them
+    """
+    raw_ids = {}
+    with open(log_file, 'rb') as lf_handler:
+        size = os.fstat(lf_handler.fileno()).st_size
+        end = size if end is None else min(end, size)
+        if start >= end:
+            return
+        with mmap.mmap(lf_handler.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                while True:
+                    fails_count, num_of_lines, start = parse_view(view, start, end, chunk_size, raw_ids, memory,
+                                                                  timer)
+                    if not num_of_lines:
+                        return
+                    yield fails_count, num_of_lines, LogPosition(start)
+            finally:
+                view.release()
+
+
+def parse_shard(shard: Tuple[str, int, int, int, int, UrlNormalizer, int]) -> Tuple[UrlStatsStore, int, int]:
+    """
+    Worker function: parse byte range of uncompressed log.
+    :param shard: tuple of path to logfile, start and end offsets, exact limit, memory budget, URL normalizer and
+                  max URLs of the worker
+    :return: collector, fails count and number of lines of the shard
+    """
+    log_file, start, end, exact_limit, budget, normalizer, max_urls = shard
+    memory = UrlStatsStore(exact_limit, budget, normalizer, max_urls)
+    fails_count = 0
+    num_of_lines = 0
+    for chunk_fails, chunk_lines, _ in parse_mapped(Path(log_file), memory, start, end):
+        fails_count += chunk_fails
+        num_of_lines += chunk_lines
+    return memory, fails_count, num_of_lines
+
+
+def parse_chunk(chunk: Tuple[List, int, int, UrlNormalizer, int]) -> Tuple[UrlStatsStore, int, int]:
+    """
+    Worker function: parse chunk of lines.
+    :param chunk: tuple of lines, exact limit, memory budget, URL normalizer and max URLs of the worker
+    :return: collector, fails count and number of lines of the chunk
+    """
+    lines, exact_limit, budget, normalizer, max_urls = chunk
+    return parse_lines(lines, exact_limit, budget, normalizer=normalizer, max_urls=max_urls)
+
+
+def bounded_map(executor: ProcessPoolExecutor, func: Callable, tasks: Iterable, window: int) -> Iterator:
+    """
+    Ordered executor.map which keeps at most window tasks in flight (executor.map consumes all tasks at once).
+    :param executor: pool of workers
+    :param func: function to call in workers
+    :param tasks: iterable with arguments for func
+    :param window: max number of submitted and not consumed tasks
+    :return: iterator of results in order of tasks
+    """
+    in_flight = deque()
+    for task in tasks:
+        in_flight.append(executor.submit(func, task))
+        if len(in_flight) >= window:
+            yield in_flight.popleft().result()
+    while in_flight:
+        yield in_flight.popleft().result()
+
+
+class ParseState:
+    """State of log parsing: collected info, counters and position of the next line in log."""
+
+    def __init__(self, log_file: Path, memory: UrlStatsStore, position: LogPosition = LogPosition(),
+                 fails_count: int = 0, num_of_lines: int = 0):
+        self.log_file = log_file
+        self.memory = memory
+        self.position = position
+        self.fails_count = fails_count
+        self.num_of_lines = num_of_lines
+
+    def update(self, fails_count: int, num_of_lines: int, position: LogPosition) -> None:
+        self.fails_count += fails_count
+        self.num_of_lines += num_of_lines
+        self.position = position
+
+
+def check_mistakes(state: ParseState, bias: float, min_lines: int) -> None:
+    """
+    Stop parsing of log which fails percent is certainly bigger than bias: after min_lines lines lower bound of Wilson
+    score interval (z = MISTAKES_CONFIDENCE_Z) of fails ratio is compared with bias after every chunk.
+    :param state: parsing state
+    :param bias: allowed fails ratio
+    :param min_lines: number of lines before the first check (check is turned off if 0)
+    :raises ValueError: if fails ratio is bigger than bias with certainty
+    """
+    num_of_lines = state.num_of_lines
+    if not min_lines or num_of_lines < min_lines:
+        return
+    ratio = state.fails_count / num_of_lines
+    z_squared = MISTAKES_CONFIDENCE_Z ** 2
+    margin = MISTAKES_CONFIDENCE_Z * math.sqrt(ratio * (1 - ratio) / num_of_lines +
+                                               z_squared / (4 * num_of_lines ** 2))
+    lower_bound = (ratio + z_squared / (2 * num_of_lines) - margin) / (1 + z_squared / num_of_lines)
+    if lower_bound > bias:
+        raise ValueError(f"Fails percent bigger than bias ({round(ratio, 2)} > {bias}) after {num_of_lines} lines, "
+                         f"parsing is stopped.")
+
+
+def checkpoint_path(log_file: Path, actual_config: dict) -> Union[Path, None]:
+    """
+    Get path to checkpoint of log. Relative CHECKPOINT_DIR is inside of REPORT_DIR, so checkpoints don't depend
+    on working directory of run (e.g. from cron).
+    :param log_file: path to logfile
+    :param actual_config: actual configuration
+    :return: path to checkpoint or None if checkpoints are turned off
+    """
+    checkpoint_dir = actual_config.get("CHECKPOINT_DIR")
+    if not checkpoint_dir:
+        return None
+    report_dir = actual_config.get("REPORT_DIR", DEFAULT_CONFIG["REPORT_DIR"])
+    return Path(report_dir, checkpoint_dir) / f"{log_file.name}.checkpoint"
+
+
+def save_checkpoint(state: ParseState, path: Path) -> None:
+    """
+    Save parsing state. Header with log identity and position is pickled before state,
+    so it could be read without loading collected info. File is replaced atomically.
+    :param state: state to save
+    :param path: path to checkpoint
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    header = {
+        'version': CHECKPOINT_VERSION,
+        'log_file': state.log_file.name,
+        'inode': state.log_file.stat().st_ino,
+        'position': tuple(state.position),
     }
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as checkpoint:
+        pickle.dump(header, checkpoint, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(state, checkpoint, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    logging.info(f"Checkpoint saved: {path}, position {state.position}, number of lines {state.num_of_lines}.")
+
 
+def load_checkpoint(path: Path, log_file: Path, header_only: bool = False) -> Union[ParseState, LogPosition, None]:
     """
-    url_rt = 'url_rt'
-    url_rt_lst = 'url_rt_lst'
-    url_rt_max = 'url_rt_max'
-    num_of_url = 'num_of_url'
-    total = 'total'
-    total_url_rt = 'total_url_rt'
+    Load parsing state if checkpoint exists and belongs to the same log file (which was not truncated or rotated).
+    :param path: path to checkpoint
+    :param log_file: path to logfile
+    :param header_only: return only position from checkpoint header
+    :return: parsing state (or position) or None if there is no valid checkpoint
+    """
+    if not path or not path.exists():
+        return None
 
-    if url_rt not in collector[url].keys():
-        collector[url][url_rt] = round(0.00, 2)
+    try:
+        with open(path, 'rb') as checkpoint:
+            header = pickle.load(checkpoint)
+            position = LogPosition(*header['position'])
+            log_stat = log_file.stat()
+            if header['version'] != CHECKPOINT_VERSION or header['log_file'] != log_file.name or \
+                    header['inode'] != log_stat.st_ino or log_stat.st_size < position.offset:
+                logging.info(f"Checkpoint {path} doesn't match log {log_file}, it is ignored.")
+                return None
+            if header_only:
+                return position
+            state = pickle.load(checkpoint)
+    except (OSError, EOFError, KeyError, pickle.UnpicklingError):
+        logging.exception(f"Checkpoint {path} is broken, it is ignored.")
+        return None
+
+    state.log_file = log_file
+    return state
+
+
+def prune_checkpoints(log_file: Path, checkpoint: Path) -> None:
+    """
+    Remove checkpoints which aren't needed after report of log is generated: checkpoint of gz log (rotated log won't
+    grow), checkpoints of removed logs and of uncompressed logs older than log which were parsed to the end (they
+    were rotated). Checkpoint of uncompressed log itself is kept to update report when new lines are appended.
+    :param log_file: path to reported logfile
+    :param checkpoint: path to its checkpoint
+    """
+    if log_file.suffix == '.gz':
+        checkpoint.unlink(missing_ok=True)
+    if not checkpoint.parent.is_dir():
+        return
+    mtime = log_file.stat().st_mtime
+    for other in checkpoint.parent.glob('*.checkpoint'):
+        if other == checkpoint:
+            continue
+        other_log = log_file.with_name(other.name[:-len('.checkpoint')])
+        try:
+            if other_log.suffix == '.gz' or other_log.stat().st_mtime >= mtime:
+                continue  # gz log (or newer log) could be still parsed by another process
+            position = load_checkpoint(other, other_log, header_only=True)
+            if position is not None and position.offset < complete_lines_end(other_log):
+                continue  # parsing of log isn't finished
+        except FileNotFoundError:
+            pass
+        logging.info(f"Checkpoint {other} isn't needed anymore, it is removed.")
+        other.unlink(missing_ok=True)
+
+
+def parse_log(state: ParseState, chunk_size: int = 50000, checkpoint: Path = None, checkpoint_every: int = 1000000,
+              decompressor: str = 'python', timer: StageTimer = NULL_TIMER,
+              mistakes_check: Callable[[ParseState], None] = None) -> ParseState:
+    """
+    Parse log from state position in one process, checkpoint is saved every checkpoint_every lines and at the end.
+    :param state: parsing state to update
+    :param chunk_size: number of lines in one chunk
+    :param checkpoint: path to checkpoint (checkpoint is not saved if None)
+    :param checkpoint_every: number of lines between checkpoints
+    :param decompressor: decompressor of gz log
+    :param timer: timer of "read" and "aggregate" stages
+    :param mistakes_check: function called with state after every chunk, it raises to stop parsing
+    :return: updated state
+    """
+    saved_lines = state.num_of_lines
+    if state.log_file.suffix == '.gz':
+        read_chunks = read_log_chunks(state.log_file, state.position, chunk_size, decompressor)
+        chunks = (parse_lines(lines, memory=state.memory, timer=timer)[1:] + (position,)
+                  for lines, position in timer.iterate("read", read_chunks))
+    else:
+        chunks = parse_mapped(state.log_file, state.memory, state.position.offset, chunk_size=chunk_size, timer=timer)
 
-    if url_rt_lst not in collector[url].keys():
-        collector[url][url_rt_lst] = []
+    for fails_count, num_of_lines, position in chunks:
+        state.update(fails_count, num_of_lines, position)
+        if mistakes_check:
+            mistakes_check(state)
+        if checkpoint and state.num_of_lines - saved_lines >= checkpoint_every:
+            save_checkpoint(state, checkpoint)
+            saved_lines = state.num_of_lines
 
-    if num_of_url not in collector[url].keys():
-        collector[url][num_of_url] = 0
+    if checkpoint:
+        save_checkpoint(state, checkpoint)
 
-    if url_rt_max not in collector.keys():
-        collector[url][url_rt_max] = round(0.00, 2)
+    return state
 
-    if url_req_time > collector[url][url_rt_max]:
-        collector[url][url_rt_max] = round(url_req_time, 3)
 
-    if total_url_rt not in collector[total].keys():
-        collector[total][total_url_rt] = round(0.00, 2)
+def parse_log_parallel(state: ParseState, workers: int, chunk_size: int = 50000, checkpoint: Path = None,
+                       checkpoint_every: int = 1000000, decompressor: str = 'python',
+                       timer: StageTimer = NULL_TIMER,
+                       mistakes_check: Callable[[ParseState], None] = None) -> ParseState:
+    """
+    Parse log from state position in pool of processes and merge results of workers into state.
+    Uncompressed logs are split into byte ranges of about SHARD_SIZE (at least one per worker), gz logs are streamed
+    to workers by chunks of lines. At most two tasks per worker are in flight and pending ones are cancelled when
+    mistakes_check stops parsing. Memory budget of state collector is shared between workers. Workers don't limit
+    distinct URLs: max_urls is applied once when results are merged in order of log, so __other__ is the same
+    as in one process.
+    :param state: parsing state to update
+    :param workers: number of processes
+    :param chunk_size: number of lines in one chunk for gz logs
+    :param checkpoint: path to checkpoint (checkpoint is not saved if None)
+    :param checkpoint_every: number of lines between checkpoints (saved after shard or chunk which crosses it)
+    :param decompressor: decompressor of gz log
+    :param timer: timer of "read" stage and "aggregate" stage (merge of results of workers)
+    :param mistakes_check: function called with state after every chunk (shard), it raises to stop parsing
+    :return: updated state
+    """
+    log_file = state.log_file
+    exact_limit, normalizer, max_urls = state.memory.exact_limit, state.memory.normalizer, None
+    worker_budget = state.memory.budget // workers if state.memory.budget else None
+    saved_lines = state.num_of_lines
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        try:
+            if log_file.suffix == '.gz':
+                positions = deque()
+
+                def chunks() -> Generator[Tuple[List, int, int, UrlNormalizer, int], None, None]:
+                    read_chunks = read_log_chunks(log_file, state.position, chunk_size, decompressor)
+                    for lines, position in timer.iterate("read", read_chunks):
+                        positions.append(position)
+                        yield lines, exact_limit, worker_budget, normalizer, max_urls
+
+                for shard_memory, shard_fails, shard_lines in bounded_map(executor, parse_chunk, chunks(), workers * 2):
+                    with timer.stage("aggregate"):
+                        state.memory.merge(shard_memory)  # results are ordered as chunks in log
+                    state.update(shard_fails, shard_lines, positions.popleft())
+                    if mistakes_check:
+                        mistakes_check(state)
+                    if checkpoint and state.num_of_lines - saved_lines >= checkpoint_every:
+                        save_checkpoint(state, checkpoint)
+                        saved_lines = state.num_of_lines
+            else:
+                shards_num = max(workers, -(-(log_file.stat().st_size - state.position.offset) // SHARD_SIZE))
+                shards = [(str(log_file), start, end, exact_limit, worker_budget, normalizer, max_urls)
+                          for start, end in split_log(log_file, shards_num, state.position.offset)]
+                results = bounded_map(executor, parse_shard, shards, workers * 2)
+                for shard, (shard_memory, shard_fails, shard_lines) in zip(shards, results):
+                    with timer.stage("aggregate"):
+                        state.memory.merge(shard_memory)  # results are ordered as shards in log
+                    state.update(shard_fails, shard_lines, LogPosition(shard[2]))
+                    if mistakes_check:
+                        mistakes_check(state)
+                    if checkpoint and state.num_of_lines - saved_lines >= checkpoint_every:
+                        save_checkpoint(state, checkpoint)
+                        saved_lines = state.num_of_lines
+        except BaseException:
+            executor.shutdown(wait=False, cancel_futures=True)  # only running tasks are waited for on exit
+            raise
+
+    if checkpoint:
+        save_checkpoint(state, checkpoint)
+
+    logging.info(f"Log is parsed by {workers} workers.")
+
+    return state
+
+
+def parse_sample(state: ParseState, fraction: float, chunk_size: int = 50000, decompressor: str = 'python',
+                 seed: int = None, timer: StageTimer = NULL_TIMER,
+                 mistakes_check: Callable[[ParseState], None] = None) -> ParseState:
+    """
+    Estimate stats of the whole log from uniform random sample of its blocks for quick triage.
+    Uncompressed log is split into blocks of SAMPLE_BLOCK_SIZE bytes aligned on lines and only sampled blocks are
+    parsed from memory map. Gz log is decompressed whole (it can't be sought), but only sampled chunks of lines are
+    parsed (the first chunk is always parsed). Counts, sums of request times and numbers of lines and fails are
+    scaled to the whole log, percents and quantiles are estimated from the sample as is.
+    :param state: new parsing state to update
+    :param fraction: share of blocks (chunks) to parse, from 0 to 1
+    :param chunk_size: number of lines in one chunk
+    :param decompressor: decompressor of gz log
+    :param seed: seed of random sample (random if None)
+    :param timer: timer of "read" and "aggregate" stages
+    :param mistakes_check: function called with state of sample after every chunk, it raises to stop parsing
+    :return: updated state
+    """
+    generator = random.Random(seed)
+    log_file = state.log_file
+    if log_file.suffix == '.gz':
+        total_lines = 0
+        for lines, position in timer.iterate("read", read_log_chunks(log_file, LogPosition(), chunk_size,
+                                                                     decompressor)):
+            total_lines += len(lines)
+            if not state.num_of_lines or generator.random() < fraction:
+                state.update(*parse_lines(lines, memory=state.memory, timer=timer)[1:], position)
+                if mistakes_check:
+                    mistakes_check(state)
+        factor = total_lines / max(state.num_of_lines, 1)
+    else:
+        blocks = split_log(log_file, max(complete_lines_end(log_file) // SAMPLE_BLOCK_SIZE, 1))
+        sampled = sorted(generator.sample(blocks, min(max(round(len(blocks) * fraction), 1), len(blocks))))
+        for start, end in sampled:
+            for fails_count, num_of_lines, position in parse_mapped(log_file, state.memory, start, end, chunk_size,
+                                                                    timer):
+                state.update(fails_count, num_of_lines, position)
+                if mistakes_check:
+                    mistakes_check(state)
+        sampled_bytes = sum(end - start for start, end in sampled)
+        factor = sum(end - start for start, end in blocks) / sampled_bytes if sampled_bytes else 1.0
 
-    # if we use += round(url_req_time, 3) then on next iterations result would be 1,789999999 etc
-    collector[url][url_rt] = round(collector[url][url_rt] + url_req_time, 3)
-    collector[url][url_rt_lst].append(url_req_time)  # for median calculating
-    collector[url][num_of_url] += url_num
-    collector[total][total_url_rt] = round(collector[total][total_url_rt] + url_req_time, 3)
+    logging.info(f"Sample of {state.num_of_lines} lines is parsed, stats are scaled by {factor:.2f}.")
+    state.memory.scale(factor)
+    state.fails_count = round(state.fails_count * factor)
+    state.num_of_lines = round(state.num_of_lines * factor)
+    return state
 
-    return collector
+
+QUANTILE_COLUMNS = {'time_med': 0.5, 'time_p75': 0.75, 'time_p90': 0.9, 'time_p95': 0.95, 'time_p99': 0.99}
+STATS_COLUMNS = ('count', 'count_perc', 'time_sum', 'time_perc', 'time_avg', 'time_max') + tuple(QUANTILE_COLUMNS)
+
+
+def rounded(values, digits: int) -> List[float]:
+    """
+    Round values by Python round in both NumPy and pure Python paths: numpy.round rounds scaled values half to even
+    (0.435 becomes 0.44 instead of 0.43), so report would depend on whether NumPy is installed.
+    :param values: list or NumPy array of numbers
+    :param digits: number of digits after point
+    :return: list of rounded values
+    """
+    if np is not None and isinstance(values, np.ndarray):
+        values = values.tolist()
+    return [round(value, digits) for value in values]
+
+
+def rounded_time_sums(collector: UrlStatsStore):
+    """
+    Sums of request times rounded to 3 digits, so stats don't depend on order of additions
+    (e.g. when stores of workers are merged).
+    :param collector: collected info after parsing log file
+    :return: NumPy array if NumPy is installed, list otherwise
+    """
+    time_sums = rounded(collector.time_sums, 3)
+    return np.array(time_sums, dtype=np.float64) if np is not None else time_sums
 
 
-def format_stats(stats_sorted: List) -> List:
+def top_url_ids(time_sums, report_size: int) -> List[int]:
     """
-    Reorganize sorted stats to list of dicts for min.js.
-    :param stats_sorted: sorted statistic data
-    :return: list of dictionaries for min.js
+    Select ids of report_size URLs with the biggest time_sum without sorting all URLs.
+    Order is the same as of stable sort by time_sum in descending order.
+    :param time_sums: rounded sums of request times by URL id
+    :param report_size: size of data for report
+    :return: list of URL ids
+    """
+    if report_size <= 0:
+        return []
+
+    if np is None:
+        return heapq.nlargest(report_size, range(len(time_sums)), key=time_sums.__getitem__)
+
+    if report_size < len(time_sums):
+        threshold = np.partition(time_sums, len(time_sums) - report_size)[len(time_sums) - report_size]
+        candidates = np.flatnonzero(time_sums >= threshold)  # all ties with threshold are kept
+    else:
+        candidates = np.arange(len(time_sums))
+    order = np.argsort(-time_sums[candidates], kind='stable')[:report_size]
+
+    return candidates[order].tolist()
+
+
+def calculate_quantiles(digests: List[RequestTimeDigest], quantiles: Sequence[float]) -> List[List[float]]:
+    """
+    Calculate quantiles of request times of URLs.
+    With NumPy exact times of all digests are copied to one buffer, every segment of it is partitioned in place
+    around the needed ranks only (selection instead of full sort) and quantiles are gathered by offsets at once.
+    Compacted digests give quantiles of their sketches.
+    :param digests: digests of URLs
+    :param quantiles: quantiles from 0 to 1
+    :return: list of values of every quantile in order of digests
+    """
+    result = [[0.0] * len(digests) for _ in quantiles]
+    exact = [num for num, digest in enumerate(digests) if digest.is_exact and len(digest.exact)]
+    for num, digest in enumerate(digests):
+        if not digest.is_exact or not len(digest.exact):
+            for values, q in zip(result, quantiles):
+                values[num] = digest.quantile(q)
+    if not exact:
+        return result
+
+    if np is None:
+        for num in exact:
+            times = sorted(digests[num].exact)
+            for values, q in zip(result, quantiles):
+                values[num] = interpolate_quantile(times, q)
+        return result
+
+    lengths = np.array([len(digests[num].exact) for num in exact], dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    buffer = np.concatenate([np.frombuffer(digests[num].exact, dtype=np.float64) for num in exact])
+    positions = np.array(quantiles, dtype=np.float64)[None, :] * (lengths[:, None] - 1)
+    lower = positions.astype(np.int64)
+    upper = np.minimum(lower + 1, lengths[:, None] - 1)
+    for offset, length, ranks in zip(offsets.tolist(), lengths.tolist(), np.hstack((lower, upper)).tolist()):
+        if length > 1:
+            buffer[offset:offset + length].partition(sorted(set(ranks)))
+    lower_times = buffer[offsets[:, None] + lower]
+    upper_times = buffer[offsets[:, None] + upper]
+    exact_quantiles = lower_times + (upper_times - lower_times) * (positions - lower)
+    for values, column in zip(result, exact_quantiles.T.tolist()):
+        for num, value in zip(exact, column):
+            values[num] = value
+    return result
+
+
+def calculate_columns(collector: UrlStatsStore, total_line_num: int, time_sums, url_ids: List[int],
+                      timer: StageTimer = NULL_TIMER) -> dict:
+    """
+    Calculate stats columns for selected URLs (vectorized with NumPy if it is installed).
+    :param collector: collected info after parsing log file
+    :param total_line_num: total number of lines
+    :param time_sums: rounded sums of request times by URL id
+    :param url_ids: ids of URLs to calculate stats for
+    :param timer: timer of "median" stage (median and other quantiles)
+    :return: dict of column name and list of values in order of url_ids
     """
-    table_lst = []
+    with timer.stage("median"):
+        quantiles = dict(zip(QUANTILE_COLUMNS, calculate_quantiles([collector.digests[url_id] for url_id in url_ids],
+                                                                   list(QUANTILE_COLUMNS.values()))))
+    total_time = round(collector.total_time, 3) or 1.0
+
+    if np is not None:
+        ids = np.array(url_ids, dtype=np.int64)
+        counts = np.array(collector.counts, dtype=np.int64)[ids]
+        sums = time_sums[ids]
+        return {
+            'count': counts.tolist(),
+            'count_perc': rounded(100 * counts / total_line_num, 2),
+            'time_sum': sums.tolist(),
+            'time_perc': rounded(100 * sums / total_time, 2),
+            'time_avg': rounded(sums / counts, 2),
+            'time_max': rounded(np.array(collector.time_maxes, dtype=np.float64)[ids], 3),
+            **{name: rounded(values, 2) for name, values in quantiles.items()},
+        }
+
+    counts = [collector.counts[url_id] for url_id in url_ids]
+    sums = [time_sums[url_id] for url_id in url_ids]
+    return {
+        'count': counts,
+        'count_perc': rounded([100 * count / total_line_num for count in counts], 2),
+        'time_sum': sums,
+        'time_perc': rounded([100 * time_sum / total_time for time_sum in sums], 2),
+        'time_avg': rounded([time_sum / count for time_sum, count in zip(sums, counts)], 2),
+        'time_max': rounded([collector.time_maxes[url_id] for url_id in url_ids], 3),
+        **{name: rounded(values, 2) for name, values in quantiles.items()},
+    }
+
+
+def format_stats(columns: dict, urls: List[str]) -> Generator[dict, None, None]:
+    """
+    Reorganize stats columns to dicts for min.js.
+    :param columns: stats columns
+    :param urls: URLs in order of columns
+    :return: generator of dictionaries for min.js
+    """
+    for row_num, url in enumerate(urls):
+        row = {name: columns[name][row_num] for name in STATS_COLUMNS}
+        row['url'] = url
+        yield row
 
-    for tup in stats_sorted:
-        tmp_dict = tup[1]
-        tmp_dict.update({'url': tup[0]})
-        table_lst.append(tmp_dict)
-        del tmp_dict
 
-    return table_lst
+def calculate_report_columns(collector: UrlStatsStore, total_line_num: int, report_size: int,
+                             timer: StageTimer = NULL_TIMER) -> Tuple[dict, List[str]]:
+    """
+    Select report_size URLs with the biggest time_sum and calculate stats only for them.
+    :param collector: collected info after parsing log file
+    :param total_line_num: total number of lines
+    :param report_size: size of data for report
+    :param timer: timer of "stats" and "median" stages
+    :return: stats columns and URLs in order of columns
+    """
+    with timer.stage("stats"):
+        time_sums = rounded_time_sums(collector)
+        url_ids = top_url_ids(time_sums, report_size)
+        columns = calculate_columns(collector, total_line_num, time_sums, url_ids, timer)
+    logging.info("Stats are calculated.")
+
+    return columns, [collector.urls[url_id] for url_id in url_ids]
 
 
-def calculate_stats(collector: DefaultDict[str, dict], total_line_num: int, report_size: int) -> str:
+def calculate_stats(collector: UrlStatsStore, total_line_num: int, report_size: int) -> str:
     """
-    Calculate stats from collected info, sort them and return sliced by report size in json format.
+    Select report_size URLs with the biggest time_sum, calculate stats only for them and return in json format.
     :param report_size: size of data for report
     :param collector: collected info after parsing log file
     :param total_line_num: total number of lines
     :return: json string with list of dictionaries of report_size
     """
-    stats = defaultdict(dict)
-    total_rt = collector.pop('total')
-    total_request_time = total_rt['total_url_rt']
-    count = 'count'
-    count_perc = 'count_perc'
-    time_sum = 'time_sum'
-    time_perc = 'time_perc'
-    time_avg = 'time_avg'
-    time_max = 'time_max'
-    time_med = 'time_med'
-
-    for url in collector.keys():
-        stats[url][count] = collector[url]['num_of_url']
-        stats[url][count_perc] = round(100 * collector[url]['num_of_url'] / total_line_num, 2)
-        stats[url][time_sum] = collector[url]['url_rt']
-        stats[url][time_perc] = round(100 * collector[url]['url_rt'] / total_request_time, 2)
-        stats[url][time_avg] = round(collector[url]['url_rt'] / collector[url]['num_of_url'], 2)
-        stats[url][time_max] = collector[url]['url_rt_max']
-        stats[url][time_med] = round(median(collector[url]['url_rt_lst']), 2)
-
-    sorted_stats = sorted(stats.items(), key=lambda tup: tup[1][time_sum], reverse=True)[:report_size]
-    table_lst = format_stats(sorted_stats)
-    logging.info("Stats are calculated.")
+    return json.dumps(list(format_stats(*calculate_report_columns(collector, total_line_num, report_size))))
+
+
+@functools.lru_cache(maxsize=None)
+def load_report_template(path: Path) -> Tuple[str, str]:
+    """
+    Load report template once and split it around $table_json placeholder.
+    :param path: path to template
+    :return: parts of report before and after table
+    """
+    logging.info(f"Loading template for report: {path}.")
+    text = path.read_text(encoding='utf-8')
+    for placeholder in Template.pattern.finditer(text):
+        if 'table_json' in (placeholder.group('named'), placeholder.group('braced')):
+            return (Template(text[:placeholder.start()]).safe_substitute(),
+                    Template(text[placeholder.end():]).safe_substitute())
+    raise ValueError(f"Report template {path} has no $table_json placeholder.")
+
 
-    return json.dumps(table_lst)
+def report_template_path(actual_config: dict) -> Path:
+    """Path to report template from config, template next to the script by default."""
+    return Path(actual_config.get("REPORT_TEMPLATE") or REPORT_TEMPLATE)
 
 
-def write_stats_to_report(statistics: str, path_to_report: str) -> None:
+@contextmanager
+def open_report(path_to_report: str, newline: str = None) -> ContextManager[TextIO]:
     """
-    Write statistics to report.
-    :param statistics: calculated statistics in json string
+    Open temporary file of report for writing and rename it to report at exit, so unfinished report is never
+    taken as generated. Report is gzip compressed if its path ends with .gz.
     :param path_to_report: path to report file
+    :param newline: newline mode of file
+    :return: context manager with text file handler
+    """
+    tmp_path = path_to_report + ".tmp"
+    with gzip.open(tmp_path, 'wt', encoding='utf-8', newline=newline) if path_to_report.endswith('.gz') else \
+            open(tmp_path, 'w', encoding='utf-8', newline=newline) as report:
+        yield report
+    os.replace(tmp_path, path_to_report)
+
+
+def write_stats_to_report(rows: Iterable[dict], path_to_report: str, template: Path = REPORT_TEMPLATE) -> None:
+    """
+    Stream rows of statistics to report in json.
+    :param rows: rows of statistics
+    :param path_to_report: path to report file (report is gzip compressed if it ends with .gz)
+    :param template: path to report template
+    :raises TypeError: if rows are json string (function took it before rows were streamed)
+    """
+    if isinstance(rows, (str, bytes)):
+        raise TypeError("Rows of statistics are expected instead of json string, use format_stats.")
+    head, tail = load_report_template(Path(template))
+
+    with open_report(path_to_report) as report:
+        report.write(head)
+        report.write('[')
+        for row_num, row in enumerate(rows):
+            if row_num:
+                report.write(', ')
+            report.write(json.dumps(row))
+        report.write(']')
+        report.write(tail)
+
+
+def export_path(report_path: str, export_format: str) -> str:
+    """Path to export of report in format, ndjson and csv exports are compressed as report."""
+    path = Path(report_path.removesuffix('.gz')).with_suffix('.' + export_format)
+    if report_path.endswith('.gz') and export_format != 'parquet':
+        return str(path) + '.gz'
+    return str(path)
+
+
+def write_ndjson(rows: Iterable[dict], path: str) -> None:
+    with open_report(path) as export:
+        for row in rows:
+            export.write(json.dumps(row))
+            export.write('\n')
+
+
+def write_csv(rows: Iterable[dict], path: str) -> None:
+    with open_report(path, newline='') as export:
+        writer = csv.DictWriter(export, fieldnames=STATS_COLUMNS + ('url',))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def write_parquet(columns: dict, urls: List[str], path: str) -> None:
+    """Write stats columns to parquet by row groups of PARQUET_ROW_GROUP rows."""
+    tmp_path = path + ".tmp"
+    schema = pa.schema([(name, pa.int64() if name == 'count' else pa.float64()) for name in STATS_COLUMNS] +
+                       [('url', pa.string())])
+    with pq.ParquetWriter(tmp_path, schema) as writer:
+        for start in range(0, len(urls), PARQUET_ROW_GROUP):
+            batch = [columns[name][start:start + PARQUET_ROW_GROUP] for name in STATS_COLUMNS]
+            batch.append(urls[start:start + PARQUET_ROW_GROUP])
+            writer.write_table(pa.table(batch, schema=schema))
+    os.replace(tmp_path, path)
+
+
+def export_formats(actual_config: dict) -> List[str]:
+    """
+    Check EXPORT_FORMATS of config, parquet is replaced by csv if PyArrow is not installed.
+    :param actual_config: actual configuration
+    :return: list of unique formats
+    """
+    formats = []
+    for export_format in actual_config.get("EXPORT_FORMATS") or []:
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format: {export_format}")
+        if export_format == 'parquet' and pa is None:
+            logging.warning("PyArrow is not installed, stats are exported to csv instead of parquet.")
+            export_format = 'csv'
+        if export_format not in formats:
+            formats.append(export_format)
+    return formats
+
+
+def export_stats(columns: dict, urls: List[str], report_path: str, formats: Iterable[str]) -> None:
+    """
+    Export stats next to report in other formats, rows are streamed to ndjson and csv.
+    :param columns: stats columns
+    :param urls: URLs in order of columns
+    :param report_path: path to html report
+    :param formats: formats checked by export_formats
+    """
+    for export_format in formats:
+        path = export_path(report_path, export_format)
+        if export_format == 'parquet':
+            write_parquet(columns, urls, path)
+        elif export_format == 'csv':
+            write_csv(format_stats(columns, urls), path)
+        else:
+            write_ndjson(format_stats(columns, urls), path)
+        logging.info(f"Stats are exported: {path}.")
+
+
+def sidecar_path(report_path: str, suffix: str) -> Path:
+    """Path to sidecar file of report (compressed or not) with suffix instead of .html."""
+    return Path(report_path.removesuffix('.gz')).with_suffix(suffix)
+
+
+def aggregate_path(report_path: str) -> Path:
+    """Path to aggregate sidecar of report (compressed or not)."""
+    return sidecar_path(report_path, '.agg')
+
+
+def save_aggregate(path: Path, memory: UrlStatsStore, num_of_lines: int, fails_count: int) -> None:
+    """
+    Save per-URL aggregate (count, sum, max and quantile sketch of request times) to gzip compressed binary file.
+    :param path: path to aggregate
+    :param memory: collected info after parsing log file
+    :param num_of_lines: total number of lines
+    :param fails_count: number of lines which were not parsed
+    """
+    tmp_path = path.with_name(path.name + '.tmp')
+    with gzip.open(tmp_path, 'wb') as aggregate:
+        aggregate.write(AGGREGATE_MAGIC)
+        aggregate.write(AGGREGATE_HEADER.pack(len(memory), num_of_lines, fails_count, memory.total_time))
+        for url_id, url in enumerate(memory.urls):
+            url_bytes = url.encode("UTF-8")
+            zeros, buckets = memory.digests[url_id].sketch()
+            indexes = sorted(buckets)
+            aggregate.write(AGGREGATE_URL.pack(len(url_bytes), memory.counts[url_id], memory.time_sums[url_id],
+                                               memory.time_maxes[url_id], zeros, len(indexes)))
+            aggregate.write(url_bytes)
+            aggregate.write(struct.pack(f'<{len(indexes)}i{len(indexes)}q', *indexes,
+                                        *(buckets[index] for index in indexes)))
+    os.replace(tmp_path, path)
+    logging.info(f"Aggregate saved: {path}.")
+
+
+def load_aggregate(path: Path) -> Tuple[UrlStatsStore, int, int]:
     """
-    with open("./report.html") as report_html_template:
-        logging.info("Loading template for report.")
-        template = Template(report_html_template.read())
+    Load per-URL aggregate saved by save_aggregate.
+    :param path: path to aggregate
+    :return: collector with sketches of request times, total number of lines and fails count
+    """
+    with gzip.open(path, 'rb') as aggregate:
+        data = aggregate.read()
+
+    if not data.startswith(AGGREGATE_MAGIC):
+        raise ValueError(f"{path} is not an aggregate of log.")
+
+    offset = len(AGGREGATE_MAGIC)
+    urls_num, num_of_lines, fails_count, total_time = AGGREGATE_HEADER.unpack_from(data, offset)
+    offset += AGGREGATE_HEADER.size
+    memory = UrlStatsStore()
+
+    for _ in range(urls_num):
+        url_length, count, time_sum, time_max, zeros, buckets_num = AGGREGATE_URL.unpack_from(data, offset)
+        offset += AGGREGATE_URL.size
+        url = data[offset:offset + url_length].decode("UTF-8")
+        offset += url_length
+        bucket_values = struct.unpack_from(f'<{buckets_num}i{buckets_num}q', data, offset)
+        offset += buckets_num * 12
+        url_id = memory.url_id(url)
+        memory.counts[url_id] = count
+        memory.time_sums[url_id] = time_sum
+        memory.time_maxes[url_id] = time_max
+        memory.digests[url_id] = RequestTimeDigest.from_sketch(
+                zeros, dict(zip(bucket_values[:buckets_num], bucket_values[buckets_num:]))
+        )
+    memory.total_time = total_time
+
+    return memory, num_of_lines, fails_count
+
+
+def report_path_of(log_file: NamedTuple, actual_config: dict) -> str:
+    """Path to report of log in REPORT_DIR."""
+    report_name = f"report-{log_file.log_date.strftime('%Y.%m.%d')}.html"
+    if actual_config.get("REPORT_GZIP"):
+        report_name += ".gz"
+    return actual_config.get("REPORT_DIR") + "/" + report_name
+
+
+def peak_rss_mb() -> Union[float, None]:
+    """Peak resident set size of this process and its finished children in MB (None if it is unknown)."""
+    if resource is None:
+        return None
+    scale = 1 if sys.platform == 'darwin' else 1024  # ru_maxrss is in bytes on macOS and in KB on Linux
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return round(peak * scale / 2 ** 20, 1)
 
-    report_template = template.safe_substitute(table_json=statistics)
 
-    with open(path_to_report, 'w') as report:
-        report.write(report_template)
+def save_run_stats(timer: StageTimer, seconds: float, log_file: Path, path: Path) -> dict:
+    """
+    Log timings of stages and resources of report generation and save them to json sidecar.
+    "parse" stage is time of parsing without "read" and "aggregate" (with workers it is time of waiting for them).
+    :param timer: timer of stages with counts of report generation
+    :param seconds: wall time of report generation
+    :param log_file: path to logfile
+    :param path: path to json sidecar
+    :return: saved stats
+    """
+    stages = dict(timer.seconds)
+    stages["parse"] = max(stages.pop("parsing", 0.0) - stages["read"] - stages["aggregate"], 0.0)
+    parsing_seconds = stages["read"] + stages["parse"] + stages["aggregate"]
+    run_stats = {
+        "log": str(log_file),
+        "seconds": round(seconds, 6),
+        "stages": {stage: round(stages[stage], 6) for stage in STAGES},
+        **timer.counts,
+        "lines_per_sec": round(timer.counts.get("parsed_lines", 0) / max(parsing_seconds, 1e-9)),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    logging.info("Run stats: " + ", ".join(f"{name} {value}" for name, value in run_stats.items()))
+
+    with open_report(str(path)) as stats_file:
+        json.dump(run_stats, stats_file, indent=2)
+    return run_stats
+
+
+def generate_report(log_file: NamedTuple, actual_config: dict) -> int:
+    """
+    Generate report of log by make_report. With STATS (--stats) timings of stages, lines/sec, peak RSS and number
+    of distinct URLs are logged and saved to report-YYYY.MM.DD.stats.json. With PROFILE (--profile) cProfile stats
+    are also dumped to report-YYYY.MM.DD.prof.
+    :param log_file: log file to be read
+    :param actual_config: actual configuration
+    :return: number of parsed lines
+    """
+    profile = actual_config.get("PROFILE")
+    if not (actual_config.get("STATS") or profile):
+        return make_report(log_file, actual_config)
+
+    report_path = report_path_of(log_file, actual_config)
+    timer = StageTimer()
+    profiler = cProfile.Profile() if profile else None
+    started = time.perf_counter()
+    try:
+        if profiler:
+            num_of_lines = profiler.runcall(make_report, log_file, actual_config, timer)
+        else:
+            num_of_lines = make_report(log_file, actual_config, timer)
+    finally:
+        if profiler:
+            profiler.dump_stats(sidecar_path(report_path, '.prof'))
+            logging.info(f"Profile is dumped to {sidecar_path(report_path, '.prof')}.")
+
+    save_run_stats(timer, time.perf_counter() - started, log_file.log_name, sidecar_path(report_path, '.stats.json'))
+    return num_of_lines
 
 
-def generate_report(log_file: NamedTuple, actual_config: dict) -> None:
+def make_report(log_file: NamedTuple, actual_config: dict, timer: StageTimer = NULL_TIMER) -> int:
     """
     Generating report in few steps:
         1. Get report name, path and size;
-        2. Read log line by line, parse lines, count fails and collect data;
-        3. If fails < mistake bias then calculate stats, write it to report. Otherwise - raise Exception.
+        2. Read log by chunks of lines, parse lines, count fails and collect data (in pool of processes if
+           WORKERS > 1). Parsing is resumed from checkpoint of the log if there is one;
+           Parsing is stopped early if fails percent is certainly bigger than bias after MISTAKES_CHECK_LINES lines.
+           With SAMPLE_FRACTION (--sample) only uniform random sample of blocks of log is parsed, stats are
+           estimated from it and written to report-YYYY.MM.DD.sample.html (log isn't marked as reported);
+        3. If fails < mistake bias then calculate stats, write it to report and save aggregate of the log
+           for rollup reports (if SAVE_AGGREGATES). Otherwise - raise Exception.
     :param log_file: log file to be read
     :param actual_config: actual configuration
+    :param timer: timer of stages
+    :return: number of parsed lines
     """
-    report_name = f"report-{log_file.log_date.strftime('%Y.%m.%d')}.html"
-    report_path = actual_config.get("REPORT_DIR") + "/" + report_name
+    report_path = report_path_of(log_file, actual_config)
     report_size = actual_config.get("REPORT_SIZE")
     bias = actual_config.get("MISTAKES_BIAS")
-
-    memory = defaultdict(dict)
-    fails_count = 0
-    num_of_lines = 0
-
-    for line in read_log(log_file.log_name):
-        parsed_line = parse_line(line)
-        if not parsed_line.fail:
-            memory = collect_info(memory, parsed_line.url, parsed_line.request_time)
+    workers = actual_config.get("WORKERS", 1)
+    chunk_size = actual_config.get("CHUNK_LINES", DEFAULT_CONFIG["CHUNK_LINES"])
+    checkpoint = checkpoint_path(log_file.log_name, actual_config)
+    checkpoint_every = actual_config.get("CHECKPOINT_EVERY_LINES", DEFAULT_CONFIG["CHECKPOINT_EVERY_LINES"])
+    decompressor = actual_config.get("GZ_DECOMPRESSOR", DEFAULT_CONFIG["GZ_DECOMPRESSOR"])
+    formats = export_formats(actual_config)
+    sample_fraction = actual_config.get("SAMPLE_FRACTION")
+    check_lines = actual_config.get("MISTAKES_CHECK_LINES", DEFAULT_CONFIG["MISTAKES_CHECK_LINES"])
+    mistakes_check = functools.partial(check_mistakes, bias=bias, min_lines=check_lines)
+    if sample_fraction:
+        report_path = str(sidecar_path(report_path, '.sample.html')) + ('.gz' if report_path.endswith('.gz') else '')
+        checkpoint = None
+
+    state = load_checkpoint(checkpoint, log_file.log_name)
+    if state is None:
+        exact_limit = digest_exact_limit(actual_config)
+        max_urls = actual_config.get("MAX_URLS", DEFAULT_CONFIG["MAX_URLS"])
+        memory = UrlStatsStore(exact_limit, times_budget(actual_config), url_normalizer(actual_config), max_urls)
+        state = ParseState(log_file.log_name, memory)
+    else:
+        logging.info(f"Resuming from checkpoint: position {state.position}, number of lines {state.num_of_lines}.")
+
+    started = time.perf_counter()
+    lines_before = state.num_of_lines
+    with timer.stage("parsing"):
+        if sample_fraction:
+            parse_sample(state, sample_fraction, chunk_size, decompressor, actual_config.get("SAMPLE_SEED"), timer,
+                         mistakes_check)
+        elif workers > 1:
+            parse_log_parallel(state, workers, chunk_size, checkpoint, checkpoint_every, decompressor, timer,
+                               mistakes_check)
         else:
-            fails_count += 1
-        num_of_lines += 1
-        if num_of_lines > 100000:
-            break
+            parse_log(state, chunk_size, checkpoint, checkpoint_every, decompressor, timer, mistakes_check)
+    lines_per_second = (state.num_of_lines - lines_before) / max(time.perf_counter() - started, 1e-9)
+    logging.info(f"Throughput: {lines_per_second:.0f} lines/sec.")
+    memory, fails_count, num_of_lines = state.memory, state.fails_count, state.num_of_lines
+    timer.count(lines=num_of_lines, parsed_lines=num_of_lines - lines_before, fails=fails_count,
+                distinct_urls=len(memory), workers=workers)
 
     logging.info(f"Log is read and parsed. Fails count {fails_count}, number of lines {num_of_lines}.\nStarting to "
                  f"calculate stats.")
 
+    if not num_of_lines:
+        raise ValueError(f"Log {log_file.log_name} is empty.")
+
     mistake_percent = round(fails_count / num_of_lines, 2)
     if mistake_percent < bias:
-        stats = calculate_stats(memory, num_of_lines, report_size)
-        write_stats_to_report(stats, report_path)
+        columns, urls = calculate_report_columns(memory, num_of_lines, report_size, timer)
+        with timer.stage("render"):
+            write_stats_to_report(format_stats(columns, urls), report_path, report_template_path(actual_config))
+            export_stats(columns, urls, report_path, formats)
         logging.info(f"Report generated. Fails percent is {mistake_percent}.")
+        if actual_config.get("SAVE_AGGREGATES") and not sample_fraction:
+            save_aggregate(aggregate_path(report_path), memory, num_of_lines, fails_count)
+        if checkpoint:
+            prune_checkpoints(log_file.log_name, checkpoint)
+        return num_of_lines
     else:
         raise ValueError(f"Fails percent bigger than bias ({mistake_percent} > {bias}).")
 
 
+def log_has_new_lines(log_file: Path, actual_config: dict) -> bool:
+    """
+    Check that uncompressed log has grown since its checkpoint was saved.
+    :param log_file: path to logfile
+    :param actual_config: actual configuration
+    :return: bool
+    """
+    position = load_checkpoint(checkpoint_path(log_file, actual_config), log_file, header_only=True)
+    return position is not None and log_file.suffix != '.gz' and complete_lines_end(log_file) > position.offset
+
+
 def main(actual_config: dict, file_pattern: Pattern) -> None:
     try:
         actual_log_file = find_log_last(actual_config.get("LOG_DIR"), file_pattern)  # recommended that
@@ -330,6 +2051,11 @@ def main(actual_config: dict, file_pattern: Pattern) -> None:
             generate_report(actual_log_file, actual_config)
             logging.info("Complete!")
             return
+        elif log_has_new_lines(actual_log_file.log_name, actual_config):
+            logging.info("Log had been reported, but new lines were appended! Updating report.")
+            generate_report(actual_log_file, actual_config)
+            logging.info("Complete!")
+            return
         else:
             logging.info("Logs had already been reported!")
             return
@@ -341,6 +2067,665 @@ def main(actual_config: dict, file_pattern: Pattern) -> None:
         sys.exit(1)
 
 
+def generate_report_job(log_file: NamedTuple, actual_config: dict) -> NamedTuple:
+    """
+    Worker function of batch mode: generate report and measure its time.
+    :param log_file: log file to be read
+    :param actual_config: actual configuration
+    :return: named tuple with log name, number of lines, log size, seconds and error (None if report is generated)
+    """
+    started = time.perf_counter()
+    num_of_lines, error = 0, None
+    try:
+        num_of_lines = generate_report(log_file, actual_config)
+    except (ValueError, OSError) as exception:
+        logging.exception(f"Report of {log_file.log_name} was not generated!")
+        error = str(exception)
+
+    return ReportResult(
+            log_name=log_file.log_name,
+            num_of_lines=num_of_lines,
+            log_size=log_file.log_name.stat().st_size,
+            seconds=time.perf_counter() - started,
+            error=error
+    )
+
+
+def log_batch_summary(results: List[NamedTuple], seconds: float) -> None:
+    """
+    Log throughput of every report of batch and of the whole batch.
+    :param results: results of report jobs
+    :param seconds: time of the whole batch
+    """
+    total_lines = sum(result.num_of_lines for result in results)
+    total_size = sum(result.log_size for result in results)
+    summary = [f"{'log':<40} {'lines':>12} {'MB':>9} {'seconds':>9} {'lines/sec':>11} {'MB/sec':>8}  status"]
+    for result in results:
+        summary.append(
+                f"{result.log_name.name:<40} {result.num_of_lines:>12} {result.log_size / 2 ** 20:>9.1f} "
+                f"{result.seconds:>9.2f} {result.num_of_lines / result.seconds:>11.0f} "
+                f"{result.log_size / 2 ** 20 / result.seconds:>8.2f}  {result.error or 'ok'}"
+        )
+    summary.append(
+            f"{'total':<40} {total_lines:>12} {total_size / 2 ** 20:>9.1f} {seconds:>9.2f} "
+            f"{total_lines / seconds:>11.0f} {total_size / 2 ** 20 / seconds:>8.2f}"
+    )
+    logging.info("Batch summary:\n" + "\n".join(summary))
+
+
+def batch_main(actual_config: dict, file_pattern: Pattern, since: datetime, until: datetime) -> None:
+    """
+    Generate reports of all not reported logs with dates in [since, until] range.
+    Logs are reported concurrently by WORKERS processes, each log is parsed in one process.
+    :param actual_config: actual configuration
+    :param file_pattern: name pattern for log file to search.
+    :param since: the first date
+    :param until: the last date
+    """
+    try:
+        index = log_dir_index(actual_config.get("LOG_DIR"), file_pattern).refresh(actual_config.get("REPORT_DIR"))
+        logs = [LastLog(log_name=Path(entry.path), log_date=entry.date) for entry in index.logs(since, until)
+                if not entry.reported]
+    except NotADirectoryError:
+        logging.info("Not a directory exception when finding logs!")
+        sys.exit(1)
+
+    if not logs:
+        logging.info("No logs to report")
+        return
+
+    processes = max(min(actual_config.get("WORKERS", 1), len(logs)), 1)
+    job_config = dict(actual_config, WORKERS=1)
+    logging.info(f"Generating {len(logs)} reports in {processes} processes.")
+
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        results = list(executor.map(generate_report_job, logs, [job_config] * len(logs)))
+    log_batch_summary(results, time.perf_counter() - started)
+
+    if any(result.error for result in results):
+        sys.exit(1)
+
+
+def rollup_main(actual_config: dict, since: datetime, until: datetime) -> None:
+    """
+    Generate report of [since, until] range by merging saved aggregates of days, logs are not parsed.
+    :param actual_config: actual configuration
+    :param since: the first date
+    :param until: the last date
+    """
+    report_dir = Path(actual_config.get("REPORT_DIR"))
+    aggregates = {}
+    for path in report_dir.glob("report-*.agg"):
+        try:
+            report_date = datetime.strptime(path.stem[len("report-"):], REPORT_DATE_FORMAT)
+        except ValueError:
+            continue  # aggregate of other rollup
+        if since <= report_date <= until:
+            aggregates[report_date] = path
+
+    if not aggregates:
+        logging.info("No aggregates to roll up")
+        return
+
+    memory = UrlStatsStore()
+    num_of_lines = 0
+    for report_date in sorted(aggregates):
+        day_memory, day_lines, _ = load_aggregate(aggregates[report_date])
+        memory.merge(day_memory)
+        num_of_lines += day_lines
+
+    first, last = min(aggregates).strftime(REPORT_DATE_FORMAT), max(aggregates).strftime(REPORT_DATE_FORMAT)
+    report_path = str(report_dir / f"report-{first}-{last}.html")
+    if actual_config.get("REPORT_GZIP"):
+        report_path += ".gz"
+    formats = export_formats(actual_config)
+    columns, urls = calculate_report_columns(memory, num_of_lines, actual_config.get("REPORT_SIZE"))
+    write_stats_to_report(format_stats(columns, urls), report_path, report_template_path(actual_config))
+    export_stats(columns, urls, report_path, formats)
+    logging.info(f"Rollup report of {len(aggregates)} days generated: {report_path}.")
+
+
+class LogFollower:
+    """
+    Tail of the latest uncompressed log in the dir, complete lines are read as they are appended.
+    Rotation is survived: the rest of renamed log is read from the open file before the next log is opened,
+    truncated log is read from the start.
+    """
+
+    def __init__(self, path_to_log_dir: str, file_pattern: Pattern, from_start: bool = False):
+        """
+        :param path_to_log_dir: path to directory with logs
+        :param file_pattern: name pattern for log file to search
+        :param from_start: read the first log from the start, otherwise only new lines are read
+        """
+        self.path_to_log_dir = path_to_log_dir
+        self.file_pattern = file_pattern
+        self.from_start = from_start
+        self.log_file = None
+        self.handler = None
+        self.offset = 0
+
+    def latest_log(self) -> Union[Path, None]:
+        logs = [log.log_name for log in find_logs(self.path_to_log_dir, self.file_pattern)
+                if log.log_name.suffix != '.gz']
+        return logs[-1] if logs else None
+
+    def open(self, log_file: Path, from_start: bool) -> None:
+        self.close()
+        self.log_file = log_file
+        self.handler = open(log_file, 'rb')
+        self.offset = 0 if from_start else complete_lines_end(log_file)
+        self.handler.seek(self.offset)
+        logging.info(f"Following {log_file} from offset {self.offset}.")
+
+    def close(self) -> None:
+        if self.handler:
+            self.handler.close()
+            self.handler = None
+
+    def rotated(self, latest: Path) -> bool:
+        if latest != self.log_file:
+            return True
+        try:
+            return os.stat(latest).st_ino != os.fstat(self.handler.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+
+    def read_lines(self) -> Generator[List[bytes], None, None]:
+        """
+        Read complete lines of followed log appended since the last call.
+        :return: generator of lists of lines
+        """
+        if os.fstat(self.handler.fileno()).st_size < self.offset:  # log was truncated (copytruncate)
+            logging.info(f"{self.log_file} was truncated.")
+            self.offset = 0
+            self.handler.seek(0)
+
+        while True:
+            lines = self.handler.readlines(FOLLOW_READ_SIZE)
+            if lines and not lines[-1].endswith(b'\n'):  # nginx is still writing it, it is read again next time
+                self.handler.seek(-len(lines.pop()), os.SEEK_CUR)
+            if not lines:
+                return
+            self.offset += sum(map(len, lines))
+            yield lines
+
+    def poll(self) -> Generator[List[bytes], None, None]:
+        """
+        Read new complete lines of the latest log, switch to the next log after rotation.
+        :return: generator of lists of lines
+        """
+        latest = self.latest_log()
+        if self.handler is None:
+            if latest is None:
+                return
+            self.open(latest, self.from_start)
+
+        yield from self.read_lines()
+        if latest is not None and self.rotated(latest):
+            self.open(latest, from_start=True)
+            yield from self.read_lines()
+
+
+class RollingWindow:
+    """
+    Per-URL stats of the last `seconds` seconds: ring of `buckets` collectors of equal time spans.
+    Memory doesn't grow with time: old bucket is reused when its time span is out of window.
+    """
+
+    def __init__(self, seconds: float, buckets: int = DEFAULT_CONFIG["FOLLOW_BUCKETS"],
+                 exact_limit: int = DEFAULT_CONFIG["DIGEST_EXACT_LIMIT"], budget: int = None,
+                 normalizer: UrlNormalizer = None, max_urls: int = None):
+        """
+        :param seconds: length of window
+        :param buckets: number of buckets
+        :param exact_limit: number of request times of one URL kept exactly
+        :param budget: number of exact request times of all URLs of one bucket (no limit if None)
+        :param normalizer: normalizer of URLs
+        :param max_urls: number of distinct URLs of one bucket (no limit if None)
+        """
+        self.step = seconds / buckets
+        self.store_args = (exact_limit, budget, normalizer, max_urls)
+        self.numbers = [-1] * buckets  # number of time span of bucket since epoch of clock
+        self.stores = [None] * buckets
+        self.fails_counts = array('q', [0] * buckets)
+        self.lines_counts = array('q', [0] * buckets)
+
+    def bucket(self, now: float) -> int:
+        """
+        Get index of bucket of time, bucket is cleared if it was of older time span.
+        :param now: time in seconds
+        :return: index of bucket
+        """
+        number = int(now // self.step)
+        index = number % len(self.numbers)
+        if self.numbers[index] != number:
+            self.numbers[index] = number
+            self.stores[index] = UrlStatsStore(*self.store_args)
+            self.fails_counts[index] = 0
+            self.lines_counts[index] = 0
+        return index
+
+    def snapshot(self, now: float) -> Tuple[UrlStatsStore, int, int]:
+        """
+        Merge buckets of window ending at time.
+        :param now: time in seconds
+        :return: collector, fails count and number of lines of window
+        """
+        first = int(now // self.step) - len(self.numbers)
+        memory = UrlStatsStore(*self.store_args[:2])
+        fails_count = num_of_lines = 0
+        for index in sorted(range(len(self.numbers)), key=self.numbers.__getitem__):  # buckets in time order
+            if self.numbers[index] > first and self.stores[index] is not None:
+                memory.merge(self.stores[index])
+                fails_count += self.fails_counts[index]
+                num_of_lines += self.lines_counts[index]
+        return memory, fails_count, num_of_lines
+
+
+def collect_live_lines(windows: Iterable[RollingWindow], lines: Iterable[bytes], now: float) -> None:
+    """
+    Parse lines once and collect info from them into current buckets of all windows.
+    :param windows: rolling windows
+    :param lines: log lines
+    :param now: time of reading of lines
+    """
+    buckets = [(window, window.bucket(now)) for window in windows]
+    stores = [window.stores[index] for window, index in buckets]
+    fails_count = num_of_lines = 0
+
+    parse = LineParser().parse
+    for line in lines:
+        parsed_line = parse(line)
+        if not parsed_line.fail:
+            for store in stores:
+                collect_info(store, parsed_line.url, parsed_line.request_time)
+        else:
+            fails_count += 1
+        num_of_lines += 1
+
+    for window, index in buckets:
+        window.fails_counts[index] += fails_count
+        window.lines_counts[index] += num_of_lines
+
+
+def write_live_stats(windows: dict, path: str, report_size: int, log_file: Path, now: float) -> None:
+    """
+    Write stats of rolling windows to json file.
+    :param windows: dict of window name and rolling window
+    :param path: path to json file
+    :param report_size: number of URLs of every window
+    :param log_file: followed log
+    :param now: current time of windows clock
+    """
+    live_stats = {"updated": datetime.now().isoformat(timespec='seconds'), "log": str(log_file), "windows": {}}
+    for name, window in windows.items():
+        memory, fails_count, num_of_lines = window.snapshot(now)
+        columns, urls = calculate_report_columns(memory, num_of_lines, report_size)
+        live_stats["windows"][name] = {
+            "lines": num_of_lines,
+            "fails": fails_count,
+            "stats": list(format_stats(columns, urls)),
+        }
+    with open_report(path) as report:
+        json.dump(live_stats, report)
+
+
+def follow_main(actual_config: dict, file_pattern: Pattern) -> None:
+    """
+    Follow the latest log and refresh stats of rolling windows (FOLLOW_WINDOWS) every FOLLOW_REFRESH_SECONDS
+    in REPORT_DIR/report-live.json until interrupted.
+    :param actual_config: actual configuration
+    :param file_pattern: name pattern for log file to search.
+    """
+    windows_config = actual_config.get("FOLLOW_WINDOWS", DEFAULT_CONFIG["FOLLOW_WINDOWS"])
+    buckets = actual_config.get("FOLLOW_BUCKETS", DEFAULT_CONFIG["FOLLOW_BUCKETS"])
+    poll_seconds = actual_config.get("FOLLOW_POLL_SECONDS", DEFAULT_CONFIG["FOLLOW_POLL_SECONDS"])
+    refresh_seconds = actual_config.get("FOLLOW_REFRESH_SECONDS", DEFAULT_CONFIG["FOLLOW_REFRESH_SECONDS"])
+    exact_limit = digest_exact_limit(actual_config)
+    budget = times_budget(actual_config) // (buckets * len(windows_config))  # budget is shared by all buckets
+    max_urls = actual_config.get("MAX_URLS", DEFAULT_CONFIG["MAX_URLS"])
+    normalizer = url_normalizer(actual_config)
+    live_path = str(Path(actual_config.get("REPORT_DIR")) / LIVE_REPORT_NAME)
+
+    windows = {name: RollingWindow(seconds, buckets, exact_limit, budget, normalizer, max_urls)
+               for name, seconds in windows_config.items()}
+    follower = LogFollower(actual_config.get("LOG_DIR"), file_pattern)
+    next_refresh = time.monotonic() + refresh_seconds
+
+    try:
+        while True:
+            for lines in follower.poll():
+                collect_live_lines(windows.values(), lines, time.monotonic())
+            now = time.monotonic()
+            if now >= next_refresh and follower.log_file:
+                write_live_stats(windows, live_path, actual_config.get("REPORT_SIZE"), follower.log_file, now)
+                next_refresh = now + refresh_seconds
+            time.sleep(poll_seconds)
+    except NotADirectoryError:
+        logging.info("Not a directory exception when following logs!")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        logging.info("Follow mode is stopped.")
+    finally:
+        follower.close()
+
+
+class InotifyWatcher:
+    """
+    Watcher of directory by Linux inotify (via ctypes, no dependencies).
+    It is registered in selector by its file descriptor and drained when it's ready.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: path to directory
+        :raises OSError: if inotify isn't available
+        """
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), INOTIFY_MASK) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch of {path} failed")
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def drain(self) -> set:
+        """
+        Read all pending events.
+        :return: names of files which were written or renamed to directory
+        """
+        finished = set()
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return finished
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                if mask & INOTIFY_FINISHED:
+                    finished.add(os.fsdecode(data[offset:offset + length].rstrip(b'\0')))
+                offset += length
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class ReportDaemon:
+    """
+    Long-lived process which reports logs of LOG_DIR as they appear.
+    LOG_DIR is watched by inotify (polled every DAEMON_POLL_SECONDS anyway, or only polled if inotify isn't
+    available). Not reported log is queued when it is finished: inotify saw it written or renamed to LOG_DIR, or
+    it wasn't modified for DAEMON_SETTLE_SECONDS. Queued logs are reported by persistent pool of WORKERS processes.
+    Commands are accepted on local UNIX socket DAEMON_SOCKET: one line of "status", "report [YYYYMMDD]" (the latest
+    log if date isn't given, log is reported even if it had been reported) or "stop", reply is one line of JSON.
+    """
+
+    def __init__(self, actual_config: dict, file_pattern: Pattern):
+        """
+        :param actual_config: actual configuration
+        :param file_pattern: name pattern for log file to search.
+        """
+        self.config = actual_config
+        self.job_config = dict(actual_config, WORKERS=1)
+        self.workers = max(actual_config.get("WORKERS", 1), 1)
+        self.poll_seconds = actual_config.get("DAEMON_POLL_SECONDS", DEFAULT_CONFIG["DAEMON_POLL_SECONDS"])
+        self.settle_seconds = actual_config.get("DAEMON_SETTLE_SECONDS", DEFAULT_CONFIG["DAEMON_SETTLE_SECONDS"])
+        self.index = log_dir_index(actual_config.get("LOG_DIR"), file_pattern)
+        self.queue = deque()  # logs to report
+        self.queued = set()  # paths of queued and running logs
+        self.running = {}  # future: log
+        self.done = deque(maxlen=DAEMON_HISTORY)
+        self.failed = {}  # path: (size, mtime) of log which report failed, it is queued again when log is changed
+        self.finished = set()  # names of logs which were written or renamed to LOG_DIR
+        self.started = datetime.now()
+        self.executor = None
+        self.watcher = None
+        self.wakeup = None
+        self.stopped = False
+
+    def scan(self) -> None:
+        """
+        Refresh index of logs and reports and queue finished not reported logs.
+        Not reported logs are stat'ed again: old logs could be still copied into LOG_DIR.
+        """
+        now = time.time()
+        self.index.refresh(self.config.get("REPORT_DIR"))
+        not_reported = self.index.restat(os.path.basename(entry.path) for entry in self.index.logs()
+                                         if not entry.reported)
+        self.finished.intersection_update(os.path.basename(entry.path) for entry in not_reported)
+        for entry in not_reported:
+            if entry.path in self.queued or self.failed.get(entry.path) == (entry.size, entry.mtime):
+                continue
+            if os.path.basename(entry.path) in self.finished or now - entry.mtime >= self.settle_seconds:
+                self.enqueue(LastLog(log_name=Path(entry.path), log_date=entry.date))
+
+    def enqueue(self, log_file: NamedTuple) -> bool:
+        """
+        Queue log to report if it isn't queued yet.
+        :param log_file: log file to be reported
+        :return: True if log is queued
+        """
+        if str(log_file.log_name) in self.queued:
+            return False
+        self.queued.add(str(log_file.log_name))
+        self.queue.append(log_file)
+        logging.info(f"Log {log_file.log_name} is queued.")
+        return True
+
+    def submit(self) -> None:
+        """Send queued logs to free workers of pool."""
+        while self.queue and len(self.running) < self.workers:
+            log_file = self.queue.popleft()
+            future = self.executor.submit(generate_report_job, log_file, self.job_config)
+            self.running[future] = log_file
+            if self.wakeup:
+                future.add_done_callback(lambda _: self.wakeup.send(b'\0'))
+
+    def collect(self) -> None:
+        """Take results of finished reports."""
+        for future in [future for future in self.running if future.done()]:
+            log_file = self.running.pop(future)
+            path = str(log_file.log_name)
+            self.queued.discard(path)
+            self.finished.discard(log_file.log_name.name)
+            try:
+                result = future.result()
+            except Exception as exception:  # worker crashed, report is not generated
+                logging.exception(f"Report of {path} was not generated!")
+                result = ReportResult(log_file.log_name, 0, 0, 0.0, str(exception))
+            self.done.append(result)
+            if result.error:
+                try:
+                    stat = os.stat(path)
+                    self.failed[path] = (stat.st_size, stat.st_mtime)
+                except FileNotFoundError:
+                    pass
+            else:
+                self.failed.pop(path, None)
+                logging.info(f"Report of {path} is generated: {result.num_of_lines} lines in "
+                             f"{result.seconds:.2f} seconds.")
+
+    def status(self) -> dict:
+        return {
+            "pid": os.getpid(),
+            "started": self.started.isoformat(timespec="seconds"),
+            "watcher": "inotify" if self.watcher else "polling",
+            "workers": self.workers,
+            "queued": [str(log_file.log_name) for log_file in self.queue],
+            "running": [str(log_file.log_name) for log_file in self.running.values()],
+            "done": [{"log": str(result.log_name), "lines": result.num_of_lines, "seconds": round(result.seconds, 3),
+                      "error": result.error} for result in self.done],
+        }
+
+    def command(self, line: str) -> dict:
+        """
+        Execute command of client.
+        :param line: "status", "report [YYYYMMDD]" or "stop"
+        :return: reply
+        """
+        name, *args = line.split() or [""]
+        if name == "status":
+            return self.status()
+        if name == "stop":
+            self.stopped = True
+            return {"stopped": True}
+        if name == "report" and len(args) <= 1:
+            try:
+                since = until = datetime.strptime(args[0], DATE_FORMAT) if args else None
+                logs = self.index.refresh().logs(since or datetime.min, until or datetime.max)
+            except (ValueError, NotADirectoryError) as exception:
+                return {"error": str(exception)}
+            if not logs:
+                return {"error": "Log is not found"}
+            log_file = LastLog(log_name=Path(logs[-1].path), log_date=logs[-1].date)
+            self.failed.pop(logs[-1].path, None)
+            return {"queued": str(log_file.log_name), "new": self.enqueue(log_file)}
+        return {"error": f"Unknown command: {line.strip()}"}
+
+    def handle(self, connection: socket.socket) -> None:
+        """
+        Read one line of command from client and reply to it.
+        :param connection: connection of client
+        """
+        with connection:
+            connection.settimeout(DAEMON_CLIENT_TIMEOUT)
+            try:
+                data = b''
+                while b'\n' not in data and len(data) < DAEMON_COMMAND_SIZE:
+                    chunk = connection.recv(DAEMON_COMMAND_SIZE)
+                    if not chunk:
+                        break
+                    data += chunk
+                reply = self.command(data.split(b'\n')[0].decode("UTF-8", "replace"))
+                connection.sendall(json.dumps(reply).encode() + b'\n')
+            except OSError:
+                logging.exception("Command of client is not handled!")
+
+    def serve(self, socket_path: str) -> None:
+        """
+        Run daemon until "stop" command (or stop()).
+        :param socket_path: path to UNIX socket for commands
+        """
+        if self.config.get("DAEMON_INOTIFY", DEFAULT_CONFIG["DAEMON_INOTIFY"]):
+            try:
+                self.watcher = InotifyWatcher(self.config.get("LOG_DIR"))
+            except (OSError, AttributeError, TypeError):
+                logging.info("inotify is not available, LOG_DIR is polled.")
+        if os.path.exists(socket_path):  # left by killed daemon
+            os.unlink(socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(socket_path)
+        server.listen()
+        self.wakeup, wakeup_reader = socket.socketpair()
+        selector = selectors.DefaultSelector()
+        selector.register(server, selectors.EVENT_READ, "client")
+        selector.register(wakeup_reader, selectors.EVENT_READ, "wakeup")
+        if self.watcher:
+            selector.register(self.watcher, selectors.EVENT_READ, "watcher")
+        logging.info(f"Daemon is started: {self.status()['watcher']} of {self.config.get('LOG_DIR')}, "
+                     f"{self.workers} workers, socket {socket_path}.")
+
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers) as self.executor:
+                next_scan = time.monotonic()
+                while not self.stopped:
+                    if time.monotonic() >= next_scan:
+                        self.scan()
+                        next_scan = time.monotonic() + self.poll_seconds
+                    self.submit()
+                    for key, _ in selector.select(max(next_scan - time.monotonic(), 0)):
+                        if key.data == "client":
+                            self.handle(server.accept()[0])
+                        elif key.data == "wakeup":
+                            wakeup_reader.recv(DAEMON_COMMAND_SIZE)
+                        else:
+                            self.finished |= self.watcher.drain()
+                            next_scan = time.monotonic()
+                    self.collect()
+                logging.info("Daemon is stopping, running reports are finished.")
+                wait(self.running)
+                self.collect()
+        finally:
+            selector.close()
+            server.close()
+            os.unlink(socket_path)
+            self.wakeup.close()
+            self.wakeup = None
+            wakeup_reader.close()
+            if self.watcher:
+                self.watcher.close()
+
+    def stop(self, *_) -> None:
+        self.stopped = True
+        if self.wakeup:
+            self.wakeup.send(b'\0')
+
+
+def daemon_main(actual_config: dict, file_pattern: Pattern) -> None:
+    """
+    Run daemon which reports logs of LOG_DIR as they appear until "stop" command, SIGTERM or Ctrl+C.
+    :param actual_config: actual configuration
+    :param file_pattern: name pattern for log file to search.
+    """
+    daemon = ReportDaemon(actual_config, file_pattern)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+    try:
+        daemon.serve(actual_config.get("DAEMON_SOCKET", DEFAULT_CONFIG["DAEMON_SOCKET"]))
+    except NotADirectoryError:
+        logging.info("Not a directory exception when watching logs!")
+        sys.exit(1)
+    logging.info("Daemon is stopped.")
+
+
+def daemon_request(socket_path: str, command: str) -> dict:
+    """
+    Send command to daemon and get its reply.
+    :param socket_path: path to UNIX socket of daemon
+    :param command: "status", "report [YYYYMMDD]" or "stop"
+    :return: reply of daemon
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(DAEMON_CLIENT_TIMEOUT)
+        client.connect(socket_path)
+        client.sendall(command.encode("UTF-8") + b'\n')
+        reply = b''
+        while not reply.endswith(b'\n'):
+            chunk = client.recv(DAEMON_COMMAND_SIZE)
+            if not chunk:
+                break
+            reply += chunk
+    return json.loads(reply)
+
+
+def parse_date(date: str) -> datetime:
+    """Parse date of --since and --until arguments."""
+    try:
+        return datetime.strptime(date, DATE_FORMAT)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Date should be in YYYYMMDD format: {date}")
+
+
+def parse_fraction(fraction: str) -> float:
+    """Parse share of --sample argument."""
+    try:
+        value = float(fraction)
+    except ValueError:
+        value = 0.0
+    if not 0 < value <= 1:
+        raise argparse.ArgumentTypeError(f"Sample fraction should be in (0, 1]: {fraction}")
+    return value
+
+
 if __name__ == "__main__":
     print(
             "####----##########----####\n"
@@ -353,6 +2738,72 @@ if __name__ == "__main__":
             dest="config",
             help="Add a path to configuration file. Otherwise default config will be used"
     )
+    parser.add_argument(
+            "--workers",
+            dest="workers",
+            type=int,
+            help="Number of processes to parse log. Otherwise WORKERS from config will be used"
+    )
+    parser.add_argument(
+            "--since",
+            dest="since",
+            type=parse_date,
+            help="Report all not reported logs since this date (YYYYMMDD) in WORKERS processes"
+    )
+    parser.add_argument(
+            "--until",
+            dest="until",
+            type=parse_date,
+            help="Report all not reported logs until this date (YYYYMMDD) in WORKERS processes"
+    )
+    parser.add_argument(
+            "--format",
+            dest="formats",
+            action="append",
+            choices=EXPORT_FORMATS,
+            help="Export stats next to html report in this format too (could be repeated)"
+    )
+    parser.add_argument(
+            "--follow",
+            dest="follow",
+            action="store_true",
+            help="Follow the latest log and refresh stats of the last 1m/5m/1h in REPORT_DIR/report-live.json"
+    )
+    parser.add_argument(
+            "--stats",
+            dest="stats",
+            action="store_true",
+            help="Log timings of stages, lines/sec and peak RSS and save them to report-YYYY.MM.DD.stats.json"
+    )
+    parser.add_argument(
+            "--profile",
+            dest="profile",
+            action="store_true",
+            help="The same as --stats and dump cProfile stats to report-YYYY.MM.DD.prof"
+    )
+    parser.add_argument(
+            "--sample",
+            dest="sample",
+            type=parse_fraction,
+            help="Estimate report from this share (0-1] of random blocks of log to report-YYYY.MM.DD.sample.html"
+    )
+    parser.add_argument(
+            "--daemon",
+            dest="daemon",
+            action="store_true",
+            help="Watch LOG_DIR and report new logs in pool of WORKERS processes, accept commands on DAEMON_SOCKET"
+    )
+    parser.add_argument(
+            "--send",
+            dest="send",
+            help="Send command to daemon (status, report [YYYYMMDD] or stop) and print its reply"
+    )
+    parser.add_argument(
+            "--rollup",
+            dest="rollup",
+            action="store_true",
+            help="Generate one report of --since/--until range from saved aggregates of days without parsing logs"
+    )
     args = parser.parse_args()
     logging.basicConfig(
             format='[%(asctime)s] %(levelname).1s %(message)s',
@@ -361,4 +2812,25 @@ if __name__ == "__main__":
     log_file_pattern: Pattern[str] = re.compile("^nginx-access-ui\.log-(\d{8})(|\.gz)$")  # group 1 is date,
     # group 2 is file extension
     config = prepare_config(DEFAULT_CONFIG, args.config)
-    main(config, log_file_pattern)
\ No newline at end of file
+    if args.workers:
+        config["WORKERS"] = args.workers
+    if args.formats:
+        config["EXPORT_FORMATS"] = args.formats
+    if args.stats:
+        config["STATS"] = True
+    if args.profile:
+        config["PROFILE"] = True
+    if args.sample:
+        config["SAMPLE_FRACTION"] = args.sample
+    if args.send:
+        print(json.dumps(daemon_request(config.get("DAEMON_SOCKET"), args.send), indent=2))
+    elif args.daemon:
+        daemon_main(config, log_file_pattern)
+    elif args.follow:
+        follow_main(config, log_file_pattern)
+    elif args.rollup:
+        rollup_main(config, args.since or datetime.min, args.until or datetime.max)
+    elif args.since or args.until:
+        batch_main(config, log_file_pattern, args.since or datetime.min, args.until or datetime.max)
+    else:
+        main(config, log_file_pattern)
\ No newline at end of file
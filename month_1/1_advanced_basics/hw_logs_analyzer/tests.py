@@ -1,18 +1,46 @@
+import csv
+import gzip
 import json
 import logging
+import os
+import pickle
+import random
+import shutil
+import sys
 import tempfile
+import threading
+import time
 import unittest
 
-from collections import defaultdict, namedtuple
+from collections import namedtuple
 from datetime import datetime
-from decimal import Decimal
+from functools import partial
+from statistics import median
 from gzip import GzipFile
 from pathlib import Path
 from re import compile
+from string import Template
 from unittest.mock import mock_open, patch
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
 from log_analyzer import prepare_config, find_log_last, log_is_reported, read_log, parse_line, collect_info, \
-    calculate_stats
+    calculate_stats, split_log, parse_lines, parse_log_parallel, RequestTimeDigest, LineParser, \
+    UrlStatsStore, top_url_ids, ParseState, LogPosition, read_log_chunks, parse_log, save_checkpoint, load_checkpoint, \
+    find_logs, batch_main, prune_checkpoints, checkpoint_path, save_aggregate, load_aggregate, rollup_main, split_lines, \
+    parse_mapped, UrlNormalizer, OTHER_URL, write_stats_to_report, aggregate_path, \
+    calculate_report_columns, export_stats, export_formats, \
+    LogFollower, RollingWindow, collect_live_lines, write_live_stats, generate_report, \
+    calculate_quantiles, digest_exact_limit, check_mistakes, LogDirIndex, log_dir_index, ReportDaemon, daemon_request
 
 logging.basicConfig(
             format='[%(asctime)s] %(levelname).1s %(message)s',
@@ -169,6 +197,34 @@ class TestFindLogLast(unittest.TestCase):
         self.assertEqual(actual_log.log_name, expected_log[0])
         self.assertEqual(actual_log.log_date, expected_log[1])
 
+    def test_index_is_refreshed_incrementally(self):
+        for day in (20, 21):
+            (self.log_dir / f'nginx-access-ui.log-202203{day}.gz').write_bytes(b'x' * day)
+        report_dir = self.log_dir / 'reports'
+        report_dir.mkdir()
+        (report_dir / 'report-2022.03.20.html.gz').touch()
+        try:
+            index = LogDirIndex(str(self.log_dir), self.log_file_pattern).refresh(str(report_dir))
+            self.assertEqual([(entry.date.day, entry.size, entry.reported) for entry in index.logs()],
+                             [(20, 20, True), (21, 21, False)])
+            self.assertEqual(index.logs(since=datetime(2022, 3, 21))[0].path,
+                             str(self.log_dir / 'nginx-access-ui.log-20220321.gz'))
+
+            (self.log_dir / 'nginx-access-ui.log-20220320.gz').unlink()
+            (self.log_dir / 'nginx-access-ui.log-20220322').touch()
+            with patch.object(index, 'parse_date', wraps=index.parse_date) as parse_date:
+                index.refresh()
+            parse_date.assert_called_once_with('nginx-access-ui.log-20220322')
+            self.assertEqual([(entry.date.day, entry.reported) for entry in index.logs()], [(21, False), (22, None)])
+            self.assertNotIn('nginx-access-ui.log-20220320.gz', index.dates)
+        finally:
+            for file in report_dir.glob('*'):
+                file.unlink()
+            report_dir.rmdir()
+
+        self.assertIs(log_dir_index(str(self.log_dir), self.log_file_pattern),
+                      log_dir_index(str(self.log_dir), self.log_file_pattern))
+
 
 class TestLogIsReported(unittest.TestCase):
     def setUp(self):
@@ -272,20 +328,26 @@ class TestParseLine(unittest.TestCase):
                 result = parse_line(line)
                 self.assertEqual(tuple(result), expected_result)
 
+class TestLineParser(unittest.TestCase):
+    def test_record_is_reused(self):
+        parser = LineParser()
+        first = parser.parse(LOG_LINES[0].encode())
+        self.assertEqual(tuple(first), ('/api/v2/banner/25019354', 0.39, False))
+
+        second = parser.parse(LOG_LINES[3].encode())
+        self.assertIs(first, second)
+        self.assertEqual(tuple(second), (None, None, True))
+
+    def test_bad_request_time(self):
+        for request_time in ('-', '1', '.5', '0.5s'):
+            with self.subTest(request_time=request_time):
+                line = LOG_LINES[0].replace('0.390', request_time).encode()
+                self.assertTrue(LineParser().parse(line).fail)
+
+
 class TestCollector(unittest.TestCase):
     def test_collector(self):
-        test_collector = defaultdict(dict)
-        expected_values = defaultdict(dict)
-        expected_values['url1']['url_rt'] = round(3.0, 3)
-        expected_values['url1']['num_of_url'] = 5
-        expected_values['url1']['url_rt_lst'] = [0.6, 0.6, 0.6, 0.6, 0.6]
-        expected_values['url1']['url_rt_max'] = round(0.6, 3)
-        expected_values['url2']['url_rt'] = round(1.4, 3)
-        expected_values['url2']['num_of_url'] = 2
-        expected_values['url2']['url_rt_lst'] = [0.7, 0.7]
-        expected_values['url2']['url_rt_max'] = round(0.7, 3)
-        expected_values['total']['total_url_rt'] = Decimal(4.4)
-
+        test_collector = UrlStatsStore()
         test_data = {
             'url1': {
                 'request': 0.6,
@@ -302,7 +364,151 @@ class TestCollector(unittest.TestCase):
 
             x -= 1
 
-        self.assertEqual(test_collector, expected_values)
+        self.assertEqual(test_collector.urls, ['url1', 'url2'])
+        self.assertEqual(test_collector.url_ids, {'url1': 0, 'url2': 1})
+        self.assertEqual(test_collector.counts.tolist(), [5, 2])
+        self.assertEqual([round(time_sum, 3) for time_sum in test_collector.time_sums], [3.0, 1.4])
+        self.assertEqual(test_collector.time_maxes.tolist(), [0.6, 0.7])
+        self.assertEqual(test_collector.digests[0].exact.tolist(), [0.6, 0.6, 0.6, 0.6, 0.6])
+        self.assertEqual(test_collector.digests[1].exact.tolist(), [0.7, 0.7])
+        self.assertAlmostEqual(test_collector.total_time, 4.4)
+        self.assertEqual(test_collector.exact_times, 7)
+
+    def test_collector_budget(self):
+        test_collector = UrlStatsStore(budget=100)
+        for x in range(200):
+            test_collector = collect_info(test_collector, 'url1', 0.1)
+            test_collector = collect_info(test_collector, 'url2', 0.2)
+
+        self.assertFalse(test_collector.digests[0].is_exact)
+        self.assertLessEqual(test_collector.exact_times, 100)
+        self.assertEqual(test_collector.counts[0], 200)
+        self.assertEqual(len(test_collector.digests[1]), 200)
+
+
+class TestUrlNormalizer(unittest.TestCase):
+    def test_rules(self):
+        normalizer = UrlNormalizer([{'pattern': '^/api/1/', 'template': '/api/v1/'}, 'collapse_ids'])  # in order
+        self.assertEqual(normalizer('/api/v2/banner/25019354'), '/api/v2/banner/{id}')
+        self.assertEqual(normalizer('/api/1/banners/?banner_id=123&x=1a'), '/api/v1/banners/?banner_id={id}&x=1a')
+        self.assertEqual(UrlNormalizer(['strip_query'])('/api/1/banners/?banner_id=123'), '/api/1/banners/')
+
+    def test_cache(self):
+        normalizer = UrlNormalizer(['strip_query'], cache_size=2)
+        for url in ('/a?1', '/a?1', '/b?2', '/c?3'):
+            normalizer(url)
+        info = normalizer.normalize.cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (1, 3, 2))
+        self.assertEqual(pickle.loads(pickle.dumps(normalizer))('/a?1'), '/a')
+
+    def test_bad_rules(self):
+        for rule in ('collapse', {'pattern': '('}, {'template': ''}):
+            with self.subTest(rule=rule):
+                with self.assertRaises(ValueError):
+                    UrlNormalizer([rule])
+
+    def test_max_urls(self):
+        store = UrlStatsStore(normalizer=UrlNormalizer(['strip_query']), max_urls=2)
+        for number in range(10):
+            store.add(f'/url{number % 5}?id={number}', 0.1)
+        self.assertEqual(store.urls, ['/url0', '/url1', OTHER_URL])
+        self.assertEqual(store.counts.tolist(), [2, 2, 6])
+
+    def test_mapped_max_urls(self):
+        lines = [LOG_LINES[0].replace('25019354', str(number)) for number in range(100)]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            log_file = Path(tmp_dir) / 'nginx-access-ui.log-20170630'
+            log_file.write_text(''.join(lines))
+            memory = UrlStatsStore(max_urls=10)
+            list(parse_mapped(log_file, memory))
+        self.assertEqual(memory.urls, parse_lines(line.encode() for line in lines)[0].urls[:10] + [OTHER_URL])
+        self.assertEqual(memory.counts[-1], 90)
+
+
+class TestRequestTimeDigest(unittest.TestCase):
+    def setUp(self):
+        generator = random.Random(42)
+        self.times = [round(generator.lognormvariate(-1, 1), 3) for _ in range(5001)]
+
+    def test_exact_median(self):
+        digest = RequestTimeDigest(exact_limit=len(self.times))
+        for request_time in self.times:
+            digest.add(request_time)
+
+        self.assertTrue(digest.is_exact)
+        self.assertEqual(digest.median(), median(self.times))
+
+    def test_sketch_median_error_bound(self):
+        digest = RequestTimeDigest(exact_limit=100)
+        for request_time in self.times:
+            digest.add(request_time)
+
+        self.assertFalse(digest.is_exact)
+        self.assertEqual(len(digest.exact), 0)
+        exact_median = median(self.times)
+        self.assertLessEqual(abs(digest.median() - exact_median), RequestTimeDigest.RELATIVE_ERROR * exact_median)
+
+    def test_merge(self):
+        whole = RequestTimeDigest(exact_limit=100)
+        parts = [RequestTimeDigest(exact_limit=100) for _ in range(3)]
+        for i, request_time in enumerate(self.times):
+            whole.add(request_time)
+            parts[i % 3].add(0.0 if i == 0 else request_time)
+        parts[0].merge(parts[1])
+        parts[0].merge(parts[2])
+
+        self.assertEqual(len(parts[0]), len(self.times))
+        self.assertAlmostEqual(parts[0].median(), whole.median())
+
+    def test_quantiles(self):
+        digests = [RequestTimeDigest(exact_limit=len(self.times)) for _ in range(3)]
+        for i, request_time in enumerate(self.times):
+            digests[i % 3].add(request_time)
+        digests[2].add(1.0)  # even number of times
+        quantiles = [0.5, 0.75, 0.9, 0.95, 0.99]
+
+        expected = [[digest.quantile(q) for digest in digests] for q in quantiles]
+        self.assertEqual(expected[0], [median(digest.exact) for digest in digests])
+        for values, q in zip(calculate_quantiles(digests, quantiles), expected):
+            for value, expected_value in zip(values, q):
+                self.assertAlmostEqual(value, expected_value)
+        with patch('log_analyzer.np', None):
+            self.assertEqual(calculate_quantiles(digests, quantiles), expected)
+
+    def test_sketch_quantiles_error_bound(self):
+        exact = RequestTimeDigest(exact_limit=len(self.times))
+        sketch = RequestTimeDigest(exact_limit=100)
+        for request_time in self.times:
+            exact.add(request_time)
+            sketch.add(request_time)
+
+        for q in (0.75, 0.9, 0.95, 0.99):
+            lower_time = sorted(self.times)[int(q * (len(self.times) - 1))]
+            self.assertLessEqual(abs(sketch.quantile(q) - lower_time), RequestTimeDigest.RELATIVE_ERROR * lower_time)
+        self.assertEqual(calculate_quantiles([sketch], [0.9]), [[sketch.quantile(0.9)]])
+
+    def test_histogram(self):
+        digest = RequestTimeDigest(exact_limit=0)
+        for request_time in self.times:
+            digest.add(request_time)
+
+        self.assertFalse(digest.is_exact)
+        self.assertEqual(len(digest.exact), 0)
+        self.assertLess(len(digest.buckets), 1000)
+        exact_median = median(self.times)
+        self.assertLessEqual(abs(digest.median() - exact_median), RequestTimeDigest.RELATIVE_ERROR * exact_median)
+        self.assertEqual(digest_exact_limit({"LATENCY_HISTOGRAMS": True, "DIGEST_EXACT_LIMIT": 10}), 0)
+        self.assertEqual(digest_exact_limit({"DIGEST_EXACT_LIMIT": 10}), 10)
+
+    def test_merge_stores_keeps_exact_order(self):
+        first = parse_lines([line.encode() for line in LOG_LINES[:2]])[0]
+        second = parse_lines([line.encode() for line in LOG_LINES[1:]])[0]
+        first.merge(second)
+
+        self.assertEqual(first.urls, ['/api/v2/banner/25019354', '/api/1/photogenic_banners/list/?server_name=WIN7RB4',
+                                      '/api/v2/banner/16852664'])
+        self.assertEqual(first.digests[1].exact.tolist(), [0.133, 0.133])
+        self.assertEqual(first.exact_times, 4)
 
 
 class TestCalculateStats(unittest.TestCase):
@@ -316,6 +522,10 @@ class TestCalculateStats(unittest.TestCase):
                     'time_avg': 0.6,
                     'time_max': 0.600,
                     'time_med': 0.600,
+                    'time_p75': 0.600,
+                    'time_p90': 0.600,
+                    'time_p95': 0.600,
+                    'time_p99': 0.600,
                 }, url2={
                     'count': 2,
                     'count_perc': 28.57,
@@ -324,23 +534,21 @@ class TestCalculateStats(unittest.TestCase):
                     'time_avg': 0.7,
                     'time_max': 0.700,
                     'time_med': 0.700,
+                    'time_p75': 0.700,
+                    'time_p90': 0.700,
+                    'time_p95': 0.700,
+                    'time_p99': 0.700,
                 }
         )
         sorted_expected_dict = sorted(expected_dict.items(), key=lambda tup: tup[1]['time_sum'], reverse=True)
-        self.expected_json = json.dumps(sorted_expected_dict)
-        sorted_expected_dict2 = sorted(expected_dict.items(), key=lambda tup: tup[1]['time_sum'], reverse=True)[:1]
-        self.expected_json2 = json.dumps(sorted_expected_dict2)
-
-        self.test_values = defaultdict(dict)
-        self.test_values['url1']['url_rt'] = round(3.0, 3)
-        self.test_values['url1']['num_of_url'] = 5
-        self.test_values['url1']['url_rt_lst'] = [0.6, 0.6, 0.6, 0.6, 0.6]
-        self.test_values['url1']['url_rt_max'] = round(0.6, 3)
-        self.test_values['url2']['url_rt'] = round(1.4, 3)
-        self.test_values['url2']['num_of_url'] = 2
-        self.test_values['url2']['url_rt_lst'] = [0.7, 0.7]
-        self.test_values['url2']['url_rt_max'] = round(0.7, 3)
-        self.test_values['total']['total_url_rt'] = round(4.4, 3)
+        expected_table = [dict(stats, url=url) for url, stats in sorted_expected_dict]
+        self.expected_json = json.dumps(expected_table)
+        self.expected_json2 = json.dumps(expected_table[:1])
+
+        self.test_values = UrlStatsStore()
+        for url, request_time, num in (('url2', 0.7, 2), ('url1', 0.6, 5)):
+            for _ in range(num):
+                collect_info(self.test_values, url, request_time)
 
         self.total_line_num = 7
         self.report_size = 2
@@ -353,6 +561,692 @@ class TestCalculateStats(unittest.TestCase):
         test_stats2 = calculate_stats(self.test_values, self.total_line_num, self.report_size - 1)
         self.assertEqual(test_stats2, self.expected_json2)
 
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_stats_without_numpy(self):
+        rng = random.Random(4)
+        collector = UrlStatsStore()
+        for num in range(20000):
+            collector.add(f'/url{rng.randrange(300)}', rng.randrange(1, 2000) / 1000)
+        collector.add('/half', 0.435)  # numpy.round gives 0.44, round gives 0.43
+        collector.add('/half', 0.435)
+        with_numpy = json.loads(calculate_stats(collector, 20002, 301))
+        with patch('log_analyzer.np', None):
+            without_numpy = json.loads(calculate_stats(collector, 20002, 301))
+        self.assertEqual(with_numpy, without_numpy)
+        self.assertEqual([row['time_med'] for row in with_numpy if row['url'] == '/half'], [0.43])
+
+
+class TestWriteReport(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.rows = [{'count': number, 'time_sum': number / 10, 'url': f'/url{number}'} for number in range(100)]
+        template = Template((Path(__file__).parent / 'report.html').read_text(encoding='utf-8'))
+        self.expected = template.safe_substitute(table_json=json.dumps(self.rows))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_streamed_report_equals_substituted(self):
+        report_path = self.tmp_dir.name + '/report-2017.06.30.html'
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.tmp_dir.name)  # template is found next to the script, not in working directory
+        write_stats_to_report(iter(self.rows), report_path)
+        self.assertEqual(Path(report_path).read_text(encoding='utf-8'), self.expected)
+        self.assertEqual(list(Path(self.tmp_dir.name).iterdir()), [Path(report_path)])
+
+    def test_gzip_report(self):
+        report_path = self.tmp_dir.name + '/report-2017.06.30.html.gz'
+        write_stats_to_report(self.rows, report_path)
+        with gzip.open(report_path, 'rt', encoding='utf-8') as report:
+            self.assertEqual(report.read(), self.expected)
+        self.assertEqual(aggregate_path(report_path), Path(self.tmp_dir.name) / 'report-2017.06.30.agg')
+
+    def test_json_string_is_rejected(self):
+        report_path = Path(self.tmp_dir.name) / 'report-2017.06.30.html'
+        with self.assertRaises(TypeError):
+            write_stats_to_report(json.dumps(self.rows), str(report_path))
+        self.assertFalse(report_path.exists())
+
+    def test_template_without_placeholder(self):
+        template = Path(self.tmp_dir.name) / 'template.html'
+        template.write_text('<html>$other</html>')
+        with self.assertRaises(ValueError):
+            write_stats_to_report(self.rows, self.tmp_dir.name + '/report.html', template)
+
+    def test_exports(self):
+        store = parse_lines(line.encode() for line in LOG_LINES * 3)[0]
+        columns, urls = calculate_report_columns(store, 12, 10)
+        rows = json.loads(calculate_stats(store, 12, 10))
+        report_path = self.tmp_dir.name + '/report-2017.06.30.html.gz'
+        export_stats(columns, urls, report_path, export_formats({"EXPORT_FORMATS": ['ndjson', 'csv', 'ndjson']}))
+
+        with gzip.open(self.tmp_dir.name + '/report-2017.06.30.ndjson.gz', 'rt') as export:
+            self.assertEqual([json.loads(line) for line in export], rows)
+        with gzip.open(self.tmp_dir.name + '/report-2017.06.30.csv.gz', 'rt', newline='') as export:
+            table = list(csv.DictReader(export))
+        self.assertEqual([row['url'] for row in table], urls)
+        self.assertEqual([float(row['time_sum']) for row in table], columns['time_sum'])
+
+    @unittest.skipIf(pyarrow is None, 'PyArrow is not installed')
+    def test_parquet(self):
+        store = parse_lines(line.encode() for line in LOG_LINES * 3)[0]
+        columns, urls = calculate_report_columns(store, 12, 10)
+        with patch('log_analyzer.PARQUET_ROW_GROUP', 2):
+            export_stats(columns, urls, self.tmp_dir.name + '/report-2017.06.30.html', ['parquet'])
+        table = pyarrow.parquet.read_table(self.tmp_dir.name + '/report-2017.06.30.parquet')
+        self.assertEqual(table.column('url').to_pylist(), urls)
+        self.assertEqual(table.column('count').to_pylist(), columns['count'])
+
+    def test_parquet_without_pyarrow(self):
+        with patch('log_analyzer.pa', None):
+            self.assertEqual(export_formats({"EXPORT_FORMATS": ['parquet', 'csv']}), ['csv'])
+        with self.assertRaises(ValueError):
+            export_formats({"EXPORT_FORMATS": ['xml']})
+
+
+class TestTopUrlIds(unittest.TestCase):
+    def setUp(self):
+        generator = random.Random(7)
+        self.time_sums = [float(generator.randrange(20)) for _ in range(500)]  # a lot of ties
+        self.expected = sorted(range(len(self.time_sums)), key=self.time_sums.__getitem__, reverse=True)
+
+    def test_same_as_full_sort(self):
+        for report_size in (0, 1, 10, 37, 500, 1000):
+            with self.subTest(report_size=report_size):
+                if numpy is not None:
+                    self.assertEqual(top_url_ids(numpy.array(self.time_sums), report_size),
+                                     self.expected[:report_size])
+                with patch('log_analyzer.np', None):
+                    self.assertEqual(top_url_ids(self.time_sums, report_size), self.expected[:report_size])
+
+    def test_median_only_for_report_rows(self):
+        store = UrlStatsStore()
+        for url_id, time_sum in enumerate(self.time_sums):
+            collect_info(store, f'url{url_id}', time_sum)
+        with patch('log_analyzer.calculate_quantiles', wraps=calculate_quantiles) as quantiles:
+            calculate_stats(store, len(self.time_sums), 10)
+        self.assertEqual(quantiles.call_count, 1)
+        self.assertEqual(len(quantiles.call_args[0][0]), 10)
+
+
+LOG_LINES = [
+    '1.196.116.32 -  - [29/Jun/2017:03:50:22 +0300] "GET /api/v2/banner/25019354 HTTP/1.1" 200 927 "-" "Lynx/2.8.8dev.9 '
+    'libwww-FM/2.14 SSL-MM/1.4.1 GNUTLS/2.10.5" "-" "1498697422-2190034393-4708-9752759" "dc7161be3" 0.390\n',
+    '1.99.174.176 3b81f63526fa8  - [29/Jun/2017:03:50:22 +0300] "GET /api/1/photogenic_banners/list/?server_name=WIN7RB4 '
+    'HTTP/1.1" 200 12 "-" "Python-urllib/2.7" "-" "1498697422-32900793-4708-9752770" "-" 0.133\n',
+    '1.169.137.128 -  - [29/Jun/2017:03:50:22 +0300] "GET /api/v2/banner/16852664 HTTP/1.1" 200 19415 "-" "Slotovod" '
+    '"-" "1498697422-2118016444-4708-9752769" "712e90144abee9" 0.199\n',
+    '1.169.137.128 -  - [29/Jun/2017:03:50:22 +0300] "" 200 19415 "-" "Slotovod" "-" '
+    '"1498697422-2118016444-4708-9752769" "712e90144abee9" 0.199\n',
+]
+
+
+class TestParallelParsing(unittest.TestCase):
+    def setUp(self):
+        self.lines = [LOG_LINES[i % len(LOG_LINES)].replace(' 0.', f' {i % 7}.') for i in range(1000)]
+        with tempfile.NamedTemporaryFile(delete=False, suffix='.log') as f:
+            f.write(''.join(self.lines).encode())
+            self.temp_file = Path(f.name)
+        self.temp_file_gz = Path(str(self.temp_file) + '.gz')
+        with GzipFile(mode='wb', filename=str(self.temp_file_gz)) as gz:
+            gz.write(''.join(self.lines).encode())
+
+    def tearDown(self):
+        self.temp_file.unlink()
+        self.temp_file_gz.unlink()
+
+    def test_shards_cover_file(self):
+        shards = split_log(self.temp_file, 4)
+        self.assertEqual(shards[0][0], 0)
+        self.assertEqual(shards[-1][1], self.temp_file.stat().st_size)
+        content = self.temp_file.read_bytes()
+        lines = [line for start, end in shards for line in content[start:end].splitlines(keepends=True)]
+        self.assertEqual(lines, [line.encode() for line in self.lines])
+
+    def test_more_shards_than_lines(self):
+        with open(self.temp_file, 'w') as f:
+            f.write(LOG_LINES[0])
+        shards = split_log(self.temp_file, 8)
+        self.assertEqual(shards, [(0, len(LOG_LINES[0]))])
+
+    def test_mapped_equals_parse_lines(self):
+        with open(self.temp_file, 'ab') as f:
+            f.write(LOG_LINES[0][:50].encode())  # nginx is still writing the last line
+        complete = self.temp_file.read_bytes()[:split_log(self.temp_file, 1)[0][1]]
+        expected = parse_lines(complete.splitlines(keepends=True))
+
+        memory = UrlStatsStore()
+        chunks = list(parse_mapped(self.temp_file, memory, chunk_size=300))
+        self.assertEqual([num_of_lines for _, num_of_lines, _ in chunks], [300, 300, 300, 100])
+        self.assertEqual(chunks[-1][2], LogPosition(split_log(self.temp_file, 1)[0][1]))
+        self.assertEqual(sum(fails_count for fails_count, _, _ in chunks), expected[1])
+        self.assertEqual(memory.urls, expected[0].urls)
+        self.assertEqual(memory.digests, expected[0].digests)
+
+    def test_mapped_blank_lines(self):
+        with open(self.temp_file, 'ab') as f:
+            f.write(b'x' * 2 ** 22 + b'\n')  # big truncated record without spaces
+            f.write(b'\n' * 20000)
+            f.write(''.join(self.lines[:10]).encode())
+        expected = parse_lines(read_log(self.temp_file))
+
+        memory = UrlStatsStore()
+        started = time.perf_counter()
+        chunks = list(parse_mapped(self.temp_file, memory))
+        self.assertLess(time.perf_counter() - started, 5)  # the map is not copied for every blank line
+        self.assertEqual(sum(num_of_lines for _, num_of_lines, _ in chunks), 1000 + 1 + 20000 + 10)
+        self.assertEqual(sum(fails_count for fails_count, _, _ in chunks), expected[1])
+        self.assertEqual(memory.digests, expected[0].digests)
+
+    def test_parallel_max_urls(self):
+        rng = random.Random(11)
+        with open(self.temp_file, 'w') as f:
+            for num in range(20000):
+                f.write(LOG_LINES[0].replace('/api/', f'/api/{rng.randrange(500)}/'))
+        expected = parse_log(ParseState(self.temp_file, UrlStatsStore(max_urls=100)))
+        with patch('log_analyzer.SHARD_SIZE', 2 ** 16):
+            state = parse_log_parallel(ParseState(self.temp_file, UrlStatsStore(max_urls=100)), 3)
+        self.assertEqual(len(state.memory), 101)
+        self.assertEqual(state.memory.urls, expected.memory.urls)
+        self.assertEqual(calculate_stats(state.memory, state.num_of_lines, 200),
+                         calculate_stats(expected.memory, expected.num_of_lines, 200))
+
+    def test_parallel_equals_single_process(self):
+        memory, fails_count, num_of_lines = parse_lines(read_log(self.temp_file))
+        expected = (calculate_stats(memory, num_of_lines, 1000), fails_count, num_of_lines)
+        for log_file in (self.temp_file, self.temp_file_gz):
+            with self.subTest(log_file=log_file):
+                state = parse_log_parallel(ParseState(log_file, UrlStatsStore()), 3, chunk_size=100)
+                memory, fails_count, num_of_lines = state.memory, state.fails_count, state.num_of_lines
+                self.assertEqual(memory.digests, parse_lines(read_log(self.temp_file))[0].digests)
+                self.assertEqual((calculate_stats(memory, num_of_lines, 1000), fails_count, num_of_lines), expected)
+
+
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.lines = [LOG_LINES[i % len(LOG_LINES)].replace(' 0.', f' {i % 7}.').encode() for i in range(300)]
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.log_file = Path(self.tmp_dir.name) / 'nginx-access-ui.log-20170630'
+        self.gz_file = Path(self.tmp_dir.name) / 'nginx-access-ui.log-20170630.gz'
+        self.checkpoint = Path(self.tmp_dir.name) / 'checkpoints' / 'log.checkpoint'
+        data = b''.join(self.lines)
+        with open(self.gz_file, 'wb') as gz_file:  # two gzip members, the boundary is inside of a line
+            gz_file.write(gzip.compress(data[:len(data) // 2 + 10]))
+            gz_file.write(gzip.compress(data[len(data) // 2 + 10:]))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_gz_resume_from_every_position(self):
+        chunks = list(read_log_chunks(self.gz_file, chunk_size=10))
+        self.assertEqual([line for lines, _ in chunks for line in lines], self.lines)
+        self.assertGreater(chunks[-1][1].offset, 0)  # the last position is inside of the second member
+
+        read_lines = 0
+        for lines, position in chunks:
+            read_lines += len(lines)
+            with self.subTest(position=position):
+                rest = [line for lines, _ in read_log_chunks(self.gz_file, position, 10) for line in lines]
+                self.assertEqual(rest, self.lines[read_lines:])
+
+    @unittest.skipUnless(shutil.which('gzip'), 'gzip is not installed')
+    def test_gz_pipe_decompressor(self):
+        chunks = list(read_log_chunks(self.gz_file, chunk_size=10, decompressor='gzip'))
+        self.assertEqual([line for lines, _ in chunks for line in lines], self.lines)
+
+        self.assertEqual(list(read_log_chunks(self.gz_file, chunks[-1][1])), [])
+
+        read_lines = 0
+        for lines, position in read_log_chunks(self.gz_file, chunk_size=30):
+            read_lines += len(lines)
+            with self.subTest(position=position):
+                rest = [line for lines, _ in read_log_chunks(self.gz_file, position, 10, 'gzip') for line in lines]
+                self.assertEqual(rest, self.lines[read_lines:])
+
+    def test_split_lines(self):
+        blocks = [b'a\nbb', b'b\n', b'', b'cc\nd']
+        self.assertEqual(list(split_lines(blocks, 0, 2)), [([b'a\n', b'bbb\n'], 6), ([b'cc\n', b'd'], 10)])
+        self.assertEqual(list(split_lines(blocks, 6, 10)), [([b'cc\n', b'd'], 10)])
+
+    def test_plain_unfinished_line(self):
+        with open(self.log_file, 'wb') as log_file:
+            log_file.write(b''.join(self.lines[:10]) + self.lines[10][:20])
+        chunks = list(read_log_chunks(self.log_file, chunk_size=4))
+        self.assertEqual([line for lines, _ in chunks for line in lines], self.lines[:10])
+
+        with open(self.log_file, 'ab') as log_file:
+            log_file.write(self.lines[10][20:])
+        rest = [line for lines, _ in read_log_chunks(self.log_file, chunks[-1][1], 4) for line in lines]
+        self.assertEqual(rest, self.lines[10:11])
+
+    def test_resume_appended_log(self):
+        with open(self.log_file, 'wb') as log_file:
+            log_file.write(b''.join(self.lines[:100]))
+        parse_log(ParseState(self.log_file, UrlStatsStore()), chunk_size=30, checkpoint=self.checkpoint,
+                  checkpoint_every=30)
+        with open(self.log_file, 'ab') as log_file:
+            log_file.write(b''.join(self.lines[100:]))
+
+        state = load_checkpoint(self.checkpoint, self.log_file)
+        self.assertEqual(state.num_of_lines, 100)
+        parse_log(state, chunk_size=30)
+        expected = parse_log(ParseState(self.log_file, UrlStatsStore()))
+
+        self.assertEqual((state.fails_count, state.num_of_lines), (expected.fails_count, expected.num_of_lines))
+        self.assertEqual(calculate_stats(state.memory, state.num_of_lines, 100),
+                         calculate_stats(expected.memory, expected.num_of_lines, 100))
+
+    def test_checkpoint_of_other_log_is_ignored(self):
+        self.log_file.write_bytes(b''.join(self.lines))
+        save_checkpoint(parse_log(ParseState(self.log_file, UrlStatsStore())), self.checkpoint)
+        self.log_file.rename(self.log_file.with_name('rotated'))
+        self.log_file.write_bytes(b''.join(self.lines))  # the same name, but other file
+
+        self.assertIsNone(load_checkpoint(self.checkpoint, self.log_file))
+
+    def test_checkpoint_path(self):
+        config = {"REPORT_DIR": "/var/reports", "CHECKPOINT_DIR": "checkpoints"}
+        self.assertEqual(checkpoint_path(self.log_file, config),
+                         Path('/var/reports/checkpoints/nginx-access-ui.log-20170630.checkpoint'))
+        self.assertEqual(checkpoint_path(self.log_file, dict(config, CHECKPOINT_DIR="/tmp/state")),
+                         Path('/tmp/state/nginx-access-ui.log-20170630.checkpoint'))
+        self.assertIsNone(checkpoint_path(self.log_file, dict(config, CHECKPOINT_DIR=None)))
+
+    def test_prune_checkpoints(self):
+        checkpoint_dir = self.checkpoint.parent
+        old_log = self.log_file.with_name('nginx-access-ui.log-20170628')
+        old_log.write_bytes(b''.join(self.lines))
+        save_checkpoint(parse_log(ParseState(old_log, UrlStatsStore())), checkpoint_dir / f'{old_log.name}.checkpoint')
+        parsed_log = self.log_file.with_name('nginx-access-ui.log-20170629')
+        parsed_log.write_bytes(b''.join(self.lines))
+        with self.assertRaises(ValueError):  # crash in the middle of log
+            parse_log(ParseState(parsed_log, UrlStatsStore()), chunk_size=30, checkpoint_every=30,
+                      checkpoint=checkpoint_dir / f'{parsed_log.name}.checkpoint',
+                      mistakes_check=lambda state: state.num_of_lines < 90 or int('crash'))
+        (checkpoint_dir / 'nginx-access-ui.log-20170601.checkpoint').write_bytes(b'removed log')
+        for log_file in (old_log, parsed_log):
+            os.utime(log_file, (time.time() - 3600, time.time() - 3600))
+
+        self.log_file.write_bytes(b''.join(self.lines))
+        checkpoint = checkpoint_dir / f'{self.log_file.name}.checkpoint'
+        save_checkpoint(parse_log(ParseState(self.log_file, UrlStatsStore())), checkpoint)
+        prune_checkpoints(self.log_file, checkpoint)
+        self.assertEqual(sorted(path.name for path in checkpoint_dir.iterdir()),
+                         [f'{parsed_log.name}.checkpoint', checkpoint.name])
+
+        gz_checkpoint = checkpoint_dir / f'{self.gz_file.name}.checkpoint'
+        save_checkpoint(parse_log(ParseState(self.gz_file, UrlStatsStore())), gz_checkpoint)
+        prune_checkpoints(self.gz_file, gz_checkpoint)
+        self.assertFalse(gz_checkpoint.exists())
+        self.assertTrue(checkpoint.exists())
+
+    def test_parallel_gz_resume(self):
+        state = parse_log_parallel(ParseState(self.gz_file, UrlStatsStore()), 2, chunk_size=50,
+                                   checkpoint=self.checkpoint, checkpoint_every=50)
+        resumed = load_checkpoint(self.checkpoint, self.gz_file)
+        self.assertEqual(resumed.num_of_lines, len(self.lines))
+        self.assertEqual(list(read_log_chunks(self.gz_file, resumed.position)), [])
+        self.assertEqual(calculate_stats(resumed.memory, resumed.num_of_lines, 100),
+                         calculate_stats(state.memory, state.num_of_lines, 100))
+
+    def test_parallel_plain_resume(self):
+        self.log_file.write_bytes(b''.join(self.lines))
+        expected = parse_log(ParseState(self.log_file, UrlStatsStore()))
+
+        def crash(state):
+            if state.num_of_lines >= 200:
+                raise ValueError('crash')
+
+        with self.assertRaises(ValueError), patch('log_analyzer.SHARD_SIZE', 2048):
+            parse_log_parallel(ParseState(self.log_file, UrlStatsStore()), 2, checkpoint=self.checkpoint,
+                               checkpoint_every=50, mistakes_check=crash)
+        resumed = load_checkpoint(self.checkpoint, self.log_file)
+        self.assertTrue(0 < resumed.num_of_lines < len(self.lines))
+        state = parse_log_parallel(resumed, 2, checkpoint=self.checkpoint)
+        self.assertEqual((state.num_of_lines, state.fails_count), (expected.num_of_lines, expected.fails_count))
+        self.assertEqual(calculate_stats(state.memory, state.num_of_lines, 100),
+                         calculate_stats(expected.memory, expected.num_of_lines, 100))
+
+
+
+class TestBatchMode(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.log_dir = Path(self.tmp_dir.name) / 'log'
+        self.report_dir = Path(self.tmp_dir.name) / 'reports'
+        self.log_dir.mkdir()
+        self.report_dir.mkdir()
+        for day in range(20, 26):
+            with open(self.log_dir / f'nginx-access-ui.log-201706{day}', 'w') as log_file:
+                log_file.write(''.join(LOG_LINES[:3]) * day)
+        (self.log_dir / 'nginx-access-ui.log-20170626.bz2').touch()
+        (self.report_dir / 'report-2017.06.22.html').touch()
+        self.log_file_pattern = compile(r'^nginx-access-ui\.log-(\d{8})(|\.gz)$')
+        self.config = {
+            "REPORT_SIZE": 10,
+            "REPORT_DIR": str(self.report_dir),
+            "LOG_DIR": str(self.log_dir),
+            "MISTAKES_BIAS": 0.05,
+            "WORKERS": 2,
+            "CHECKPOINT_DIR": None,
+        }
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_find_logs(self):
+        logs = find_logs(str(self.log_dir), self.log_file_pattern, datetime(2017, 6, 21), datetime(2017, 6, 24))
+        self.assertEqual([log.log_date.day for log in logs], [21, 22, 23, 24])
+        self.assertEqual(logs[0].log_name, self.log_dir / 'nginx-access-ui.log-20170621')
+
+    def test_batch_reports_not_reported_logs(self):
+        with self.assertLogs(level='INFO') as logs:
+            batch_main(self.config, self.log_file_pattern, datetime(2017, 6, 21), datetime(2017, 6, 24))
+
+        reports = sorted(report.name for report in self.report_dir.iterdir())
+        self.assertEqual(reports, ['report-2017.06.21.html', 'report-2017.06.22.html', 'report-2017.06.23.html',
+                                   'report-2017.06.24.html'])
+        self.assertEqual((self.report_dir / 'report-2017.06.22.html').stat().st_size, 0)  # it was not regenerated
+        summary = [log for log in logs.output if 'Batch summary' in log][0]
+        self.assertIn('nginx-access-ui.log-20170623', summary)
+        self.assertNotIn('nginx-access-ui.log-20170622', summary)
+
+
+    def test_run_stats(self):
+        log_file = find_logs(str(self.log_dir), self.log_file_pattern, datetime(2017, 6, 25))[0]
+        for workers in (1, 2):
+            with self.subTest(workers=workers):
+                config = dict(self.config, WORKERS=workers, PROFILE=True)
+                num_of_lines = generate_report(log_file, config)
+
+                run_stats = json.loads((self.report_dir / 'report-2017.06.25.stats.json').read_text())
+                self.assertEqual((run_stats['lines'], run_stats['parsed_lines']), (num_of_lines, num_of_lines))
+                self.assertEqual((run_stats['distinct_urls'], run_stats['workers']), (3, workers))
+                self.assertEqual(sorted(run_stats['stages']),
+                                 ['aggregate', 'median', 'parse', 'read', 'render', 'stats'])
+                self.assertTrue(all(seconds >= 0 for seconds in run_stats['stages'].values()))
+                self.assertGreater(run_stats['stages']['aggregate'], 0)
+                self.assertTrue((self.report_dir / 'report-2017.06.25.prof').exists())
+
+    def test_early_stop_on_mistakes(self):
+        with open(self.log_dir / 'nginx-access-ui.log-20170627', 'w') as log_file:
+            log_file.write((LOG_LINES[0] + LOG_LINES[3] * 3) * 1000)
+        log_file = find_logs(str(self.log_dir), self.log_file_pattern, datetime(2017, 6, 27))[0]
+        for workers in (1, 2):
+            with self.subTest(workers=workers):
+                config = dict(self.config, WORKERS=workers, CHUNK_LINES=100, MISTAKES_CHECK_LINES=100)
+                with self.assertRaisesRegex(ValueError, 'parsing is stopped'):
+                    generate_report(log_file, config)
+
+        state = ParseState(log_file.log_name, UrlStatsStore())
+        with self.assertRaisesRegex(ValueError, 'after 100 lines'):
+            parse_log(state, 100, mistakes_check=partial(check_mistakes, bias=0.05, min_lines=100))
+        check_mistakes(ParseState(log_file.log_name, UrlStatsStore(), fails_count=6, num_of_lines=100), 0.05, 100)
+
+        state = ParseState(log_file.log_name, UrlStatsStore())
+        with self.assertRaisesRegex(ValueError, 'parsing is stopped'), patch('log_analyzer.SHARD_SIZE', 4096):
+            parse_log_parallel(state, 2, mistakes_check=partial(check_mistakes, bias=0.05, min_lines=100))
+        self.assertLessEqual(state.num_of_lines, 1000)  # stopped after the first of many shards
+
+    def test_sample(self):
+        lines = [LOG_LINES[i % 3].replace(' 0.', f' {i % 5}.') for i in range(3000)]
+        with open(self.log_dir / 'nginx-access-ui.log-20170627', 'w') as log_file:
+            log_file.write(''.join(lines))
+        with gzip.open(self.log_dir / 'nginx-access-ui.log-20170628.gz', 'wt') as log_file:
+            log_file.write(''.join(lines))
+
+        for day in (27, 28):
+            with self.subTest(day=day):
+                log_file = find_logs(str(self.log_dir), self.log_file_pattern, datetime(2017, 6, day))[0]
+                config = dict(self.config, WORKERS=1, CHUNK_LINES=100, SAMPLE_FRACTION=0.3, SAMPLE_SEED=1,
+                              SAVE_AGGREGATES=True)
+                with patch('log_analyzer.SAMPLE_BLOCK_SIZE', 5000):
+                    num_of_lines = generate_report(log_file, config)
+
+                self.assertAlmostEqual(num_of_lines, len(lines), delta=len(lines) * 0.05)
+                self.assertFalse((self.report_dir / f'report-2017.06.{day}.html').exists())
+                self.assertFalse((self.report_dir / f'report-2017.06.{day}.agg').exists())
+                report = (self.report_dir / f'report-2017.06.{day}.sample.html').read_text()
+                table = json.loads(report.split('var table = ')[1].split(';\n')[0])
+                self.assertEqual(len(table), 3)
+                for row in table:
+                    self.assertAlmostEqual(row['count'], len(lines) / 3, delta=len(lines) * 0.05)
+                    self.assertAlmostEqual(row['time_avg'], 2.0, delta=0.5)
+
+
+class TestRollup(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.report_dir = Path(self.tmp_dir.name)
+        generator = random.Random(3)
+        self.days = []
+        for day in range(3):
+            lines = [LOG_LINES[generator.randrange(4)].replace(' 0.', f' {generator.randrange(5)}.').encode()
+                     for _ in range(500)]
+            self.days.append(lines)
+            memory, fails_count, num_of_lines = parse_lines(lines)
+            save_aggregate(self.report_dir / f'report-2017.06.2{day}.agg', memory, num_of_lines, fails_count)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_save_load(self):
+        memory, fails_count, num_of_lines = parse_lines(self.days[0])
+        loaded, loaded_lines, loaded_fails = load_aggregate(self.report_dir / 'report-2017.06.20.agg')
+
+        self.assertEqual((loaded_lines, loaded_fails), (num_of_lines, fails_count))
+        self.assertEqual(loaded.urls, memory.urls)
+        self.assertEqual(loaded.counts, memory.counts)
+        self.assertEqual(loaded.time_sums, memory.time_sums)
+        self.assertEqual(loaded.time_maxes, memory.time_maxes)
+        for digest, loaded_digest in zip(memory.digests, loaded.digests):
+            self.assertFalse(loaded_digest.is_exact)
+            self.assertEqual(len(loaded_digest), len(digest))
+            self.assertLessEqual(abs(loaded_digest.median() - digest.median()),
+                                 RequestTimeDigest.RELATIVE_ERROR * digest.median())
+
+    def test_rollup_report(self):
+        config = {"REPORT_DIR": str(self.report_dir), "REPORT_SIZE": 10}
+        rollup_main(config, datetime(2017, 6, 21), datetime(2017, 6, 22))
+
+        report = self.report_dir / 'report-2017.06.21-2017.06.22.html'
+        table = json.loads(report.read_text().split('var table = ')[1].split(';\n')[0])
+        memory, fails_count, num_of_lines = parse_lines(self.days[1] + self.days[2])
+        expected = json.loads(calculate_stats(memory, num_of_lines, 10))
+
+        self.assertEqual([row['url'] for row in table], [row['url'] for row in expected])
+        for row, expected_row in zip(table, expected):
+            for column in ('count', 'count_perc', 'time_sum', 'time_perc', 'time_avg', 'time_max'):
+                self.assertEqual(row[column], expected_row[column])
+            self.assertAlmostEqual(row['time_med'], expected_row['time_med'], delta=0.02 * expected_row['time_med'])
+
+
+
+class TestFollow(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.log_dir = Path(self.tmp_dir.name)
+        self.log_file = self.log_dir / 'nginx-access-ui.log-20170630'
+        self.lines = [LOG_LINES[i % len(LOG_LINES)].replace(' 0.', f' {i % 7}.').encode() for i in range(100)]
+        self.pattern = compile(r"^nginx-access-ui\.log-(\d{8})(|\.gz)$")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def read(self, follower):
+        return [line for lines in follower.poll() for line in lines]
+
+    def test_follow_appended_lines(self):
+        self.log_file.write_bytes(b''.join(self.lines[:10]))
+        follower = LogFollower(str(self.log_dir), self.pattern)
+        self.addCleanup(follower.close)
+        self.assertEqual(self.read(follower), [])  # only new lines are read
+
+        with open(self.log_file, 'ab') as log_file:
+            log_file.write(b''.join(self.lines[10:20]) + self.lines[20][:30])
+        self.assertEqual(self.read(follower), self.lines[10:20])
+        with open(self.log_file, 'ab') as log_file:
+            log_file.write(self.lines[20][30:])
+        self.assertEqual(self.read(follower), self.lines[20:21])
+
+    def test_follow_rotation(self):
+        self.log_file.write_bytes(b''.join(self.lines[:10]))
+        follower = LogFollower(str(self.log_dir), self.pattern, from_start=True)
+        self.addCleanup(follower.close)
+        self.assertEqual(self.read(follower), self.lines[:10])
+
+        with open(self.log_file, 'ab') as log_file:
+            log_file.write(b''.join(self.lines[10:20]))
+        self.log_file.rename(self.log_dir / 'rotated')
+        (self.log_dir / 'nginx-access-ui.log-20170701').write_bytes(b''.join(self.lines[20:30]))
+        self.assertEqual(self.read(follower), self.lines[10:30])
+
+        next_log = self.log_dir / 'nginx-access-ui.log-20170701'
+        next_log.write_bytes(b''.join(self.lines[30:35]))  # copytruncate
+        self.assertEqual(self.read(follower), self.lines[30:35])
+
+    def test_rolling_windows(self):
+        windows = [RollingWindow(60, 6), RollingWindow(3600, 60)]
+        for second in range(0, 100, 10):
+            collect_live_lines(windows, self.lines[second:second + 10], second)
+
+        memory, fails_count, num_of_lines = windows[0].snapshot(99)
+        expected = parse_lines(self.lines[40:])
+        self.assertEqual((fails_count, num_of_lines), expected[1:])
+        self.assertEqual(calculate_stats(memory, num_of_lines, 10), calculate_stats(expected[0], 60, 10))
+
+        memory, fails_count, num_of_lines = windows[1].snapshot(99)
+        expected = parse_lines(self.lines)
+        self.assertEqual(calculate_stats(memory, num_of_lines, 10), calculate_stats(expected[0], 100, 10))
+        self.assertEqual(len(windows[0].stores), 6)
+
+    def test_live_stats(self):
+        window = RollingWindow(60, 6)
+        collect_live_lines([window], self.lines, 0)
+        path = str(self.log_dir / 'report-live.json')
+        write_live_stats({'1m': window}, path, 10, self.log_file, 1)
+
+        live_stats = json.loads(Path(path).read_text())
+        self.assertEqual(live_stats['windows']['1m']['stats'], json.loads(calculate_stats(window.stores[0], 100, 10)))
+        self.assertEqual(live_stats['windows']['1m']['lines'], 100)
+
+
+class TestDaemon(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.log_dir = Path(self.tmp_dir.name) / 'log'
+        self.report_dir = Path(self.tmp_dir.name) / 'reports'
+        self.log_dir.mkdir()
+        self.report_dir.mkdir()
+        self.pattern = compile(r"^nginx-access-ui\.log-(\d{8})(|\.gz)$")
+        self.config = {
+            "REPORT_SIZE": 10,
+            "REPORT_DIR": str(self.report_dir),
+            "LOG_DIR": str(self.log_dir),
+            "MISTAKES_BIAS": 0.5,
+            "WORKERS": 1,
+            "CHECKPOINT_DIR": None,
+            "DAEMON_POLL_SECONDS": 0.1,
+            "DAEMON_SETTLE_SECONDS": 3600,
+        }
+        self.socket_path = str(Path(self.tmp_dir.name) / 'daemon.sock')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_log(self, day, age=0):
+        log_file = self.log_dir / f'nginx-access-ui.log-201706{day}'
+        log_file.write_text(''.join(LOG_LINES[:3]))
+        if age:
+            os.utime(log_file, (time.time() - age, time.time() - age))
+        return log_file
+
+    def test_scan_queues_finished_logs(self):
+        self.write_log(20, age=7200)
+        self.write_log(21, age=7200)
+        self.write_log(22)
+        self.write_log(23)
+        (self.report_dir / 'report-2017.06.21.html').touch()
+        daemon = ReportDaemon(self.config, self.pattern)
+        daemon.finished.add('nginx-access-ui.log-20170623')
+
+        daemon.scan()
+        self.assertEqual([log_file.log_name.name for log_file in daemon.queue],
+                         ['nginx-access-ui.log-20170620', 'nginx-access-ui.log-20170623'])
+        daemon.scan()
+        self.assertEqual(len(daemon.queue), 2)
+
+        self.assertEqual(daemon.command('report 20170621'),
+                         {'queued': str(self.log_dir / 'nginx-access-ui.log-20170621'), 'new': True})
+        self.assertEqual(daemon.command('report')['queued'], str(self.log_dir / 'nginx-access-ui.log-20170623'))
+        self.assertIn('error', daemon.command('report 2017'))
+        self.assertIn('error', daemon.command('unknown'))
+        self.assertEqual(daemon.command('status')['queued'], [str(self.log_dir / f'nginx-access-ui.log-201706{day}')
+                                                              for day in (20, 23, 21)])
+
+    def test_scan_restats_backfilled_logs(self):
+        self.write_log(23)
+        log_file = self.write_log(20, age=7200)
+        daemon = ReportDaemon(self.config, self.pattern)
+        daemon.index.refresh(str(self.report_dir))
+
+        with open(log_file, 'a') as f:  # old log is still copied into LOG_DIR
+            f.write(LOG_LINES[0])
+        daemon.scan()
+        self.assertEqual(len(daemon.queue), 0)
+
+        os.utime(log_file, (time.time() - 7200, time.time() - 7200))
+        stat = log_file.stat()
+        daemon.failed[str(log_file)] = (stat.st_size, stat.st_mtime)  # its report failed
+        daemon.scan()
+        self.assertEqual(len(daemon.queue), 0)
+        with open(log_file, 'a') as f:
+            f.write(LOG_LINES[1])
+        os.utime(log_file, (time.time() - 7200, time.time() - 7200))
+        daemon.scan()
+        self.assertEqual([queued.log_name for queued in daemon.queue], [log_file])
+
+    def check_serve(self, inotify):
+        self.write_log(20, age=7200)
+        daemon = ReportDaemon(dict(self.config, DAEMON_INOTIFY=inotify), self.pattern)
+        thread = threading.Thread(target=daemon.serve, args=(self.socket_path,))
+        thread.start()
+        self.addCleanup(thread.join, 10)
+        self.addCleanup(daemon.stop)
+
+        def wait_for(condition):
+            deadline = time.monotonic() + 10
+            while time.monotonic() < deadline:
+                status = daemon_request(self.socket_path, 'status') if os.path.exists(self.socket_path) else {}
+                if condition(status):
+                    return status
+                time.sleep(0.05)
+            self.fail(f'Daemon status is {status}')
+
+        status = wait_for(lambda status: len(status.get('done', [])) == 1)
+        self.assertTrue((self.report_dir / 'report-2017.06.20.html').exists())
+        self.assertEqual((status['done'][0]['lines'], status['done'][0]['error']), (3, None))
+        if not inotify or sys.platform == 'linux':
+            self.assertEqual(status['watcher'], 'inotify' if inotify else 'polling')
+
+        self.write_log(21)  # not settled, it is reported when inotify sees it written (or on demand)
+        if status['watcher'] == 'polling':
+            self.assertTrue(daemon_request(self.socket_path, 'report 20170621')['new'])
+        wait_for(lambda status: len(status['done']) == 2)
+        self.assertTrue((self.report_dir / 'report-2017.06.21.html').exists())
+
+        self.assertEqual(daemon_request(self.socket_path, 'stop'), {'stopped': True})
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertFalse(os.path.exists(self.socket_path))
+
+    def test_serve_inotify(self):
+        self.check_serve(inotify=True)
+
+    def test_serve_polling(self):
+        self.check_serve(inotify=False)
+
 
 if __name__ == '__main__':
     unittest.main()